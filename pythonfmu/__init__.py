@@ -1,6 +1,14 @@
 from ._version import __version__
-from .builder import FmuBuilder
-from .enums import Fmi2Causality, Fmi2Initial, Fmi2Variability
+from .enums import Fmi2Causality, Fmi2DependencyKind, Fmi2Initial, Fmi2Variability
 from .fmi2slave import Fmi2Slave
 from .variables import Boolean, Integer, Real, String
 from .default_experiment import DefaultExperiment
+
+
+def __getattr__(name):
+    # The builder is only needed to build FMUs, not to run them
+    if name == "FmuBuilder":
+        from .builder import FmuBuilder
+
+        return FmuBuilder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,6 @@
 import argparse
 
-from pythonfmu import builder, csvbuilder, deploy
+from pythonfmu import batchbuilder, builder, csvbuilder, deploy
 from ._version import __version__
 
 
@@ -26,6 +26,13 @@ def cli_main():
     )
     builder.create_command_parser(build_parser)
 
+    batch_parser = subparsers.add_parser(
+        "build-many",
+        description="Build in parallel the FMUs listed in a JSON manifest.",
+        help="Build many FMUs in parallel."
+    )
+    batchbuilder.create_command_parser(batch_parser)
+
     csv_parser = subparsers.add_parser(
         "buildcsv",
         description="Build an FMU from a CSV file.",
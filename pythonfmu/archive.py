@@ -0,0 +1,147 @@
+"""Writing of the FMU archives.
+
+The deflated entries read from files are compressed by a pool of threads (zlib releases the
+GIL) and written in order as they complete. Entries whose source is unchanged since a previous
+archive are copied from it as they were compressed, without reading nor compressing the source.
+"""
+import os
+import struct
+import zlib
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+# Deflated files compressed in the pool, smaller ones are not worth a thread and larger ones are streamed
+PARALLEL_MIN_SIZE = 1 << 16
+PARALLEL_MAX_SIZE = 1 << 28
+# Size of the blocks read from the files
+READ_SIZE = 1 << 20
+
+# Local file header of the archive entries, up to the lengths of the name and extra field
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+# Entry of an archive: its name, the file holding its content or the content, its compression method and
+# optional level, and the optional digest of the content (the entries of a previous archive with the same
+# digest are reused)
+Entry = namedtuple("Entry", ["arcname", "source", "method", "level", "digest"], defaults=[None, None])
+
+
+class PreviousArchive:
+    """Archive built before, whose compressed entries are reused when their content is unchanged.
+
+    Args:
+        path (pathlib.Path): The archive
+        digests (Dict[str, str]): Digest of the content of its entries, by name
+    """
+
+    def __init__(self, path: Path, digests: Dict[str, str]):
+        self._file = open(path, "rb")
+        try:
+            with zipfile.ZipFile(self._file) as archive:
+                self._infos = dict((info.filename, info) for info in archive.infolist())
+        except zipfile.BadZipFile:
+            self._infos = dict()
+        self._digests = digests
+
+    def reusable(self, entry: Entry) -> bool:
+        """Test if the archive holds an entry with the same digest and compression method."""
+        info = self._infos.get(entry.arcname)
+        return (
+            info is not None
+            and entry.digest is not None
+            and self._digests.get(entry.arcname) == entry.digest
+            and info.compress_type == entry.method
+        )
+
+    def raw(self, entry: Entry) -> Tuple[zipfile.ZipInfo, bytes]:
+        """Information and compressed content of a reusable entry."""
+        info = self._infos[entry.arcname]
+        self._file.seek(info.header_offset)
+        header = LOCAL_HEADER.unpack(self._file.read(LOCAL_HEADER.size))
+        self._file.seek(header[10] + header[11], os.SEEK_CUR)
+        return info, self._file.read(info.compress_size)
+
+    def close(self):
+        self._file.close()
+
+
+def deflate(path: Path, level: Optional[int]) -> Tuple[int, int, bytes]:
+    """CRC, size and deflated content of a file, compressed as `zipfile` does."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15)
+    crc = size = 0
+    chunks = list()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            chunks.append(compressor.compress(block))
+    chunks.append(compressor.flush())
+    return crc, size, b"".join(chunks)
+
+
+def write_raw(archive: zipfile.ZipFile, info: zipfile.ZipInfo, data: bytes):
+    """Append an entry already compressed, `info` giving its method, CRC and sizes.
+
+    `zipfile` only writes the content it compresses itself, the entry is appended the way it
+    does, the central directory being written from `filelist` when the archive is closed.
+    """
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+    info.header_offset = archive.fp.tell()
+    archive.fp.write(info.FileHeader(zip64))
+    archive.fp.write(data)
+    archive.filelist.append(info)
+    archive.NameToInfo[info.filename] = info
+    archive.start_dir = archive.fp.tell()
+
+
+def write_entries(archive: zipfile.ZipFile, entries: Iterable[Entry], previous: Optional[PreviousArchive] = None,
+                  workers: Optional[int] = None):
+    """Write entries to an archive, in order.
+
+    Args:
+        archive (zipfile.ZipFile): Archive open for writing
+        entries (Iterable[Entry]): The entries
+        previous (PreviousArchive): Optional, archive whose unchanged entries are copied
+        workers (int): Optional number of compressing threads, the number of CPUs by default
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(workers, thread_name_prefix="pythonfmu-deflate") as pool:
+        # Entries waiting for their turn, with their pending compression or whether they are reused
+        pending: Deque[Tuple[Entry, Optional[Future], bool]] = deque()
+
+        def write_next():
+            entry, compressed, reused = pending.popleft()
+            if compressed is not None or reused:
+                if reused:
+                    before, data = previous.raw(entry)
+                    crc, size = before.CRC, before.file_size
+                else:
+                    crc, size, data = compressed.result()
+                info = zipfile.ZipInfo.from_file(entry.source, entry.arcname)
+                info.compress_type = entry.method
+                info.CRC, info.file_size, info.compress_size = crc, size, len(data)
+                write_raw(archive, info, data)
+            elif isinstance(entry.source, bytes):
+                archive.writestr(entry.arcname, entry.source, compress_type=entry.method, compresslevel=entry.level)
+            else:
+                archive.write(entry.source, entry.arcname, compress_type=entry.method, compresslevel=entry.level)
+
+        for entry in entries:
+            reused = previous is not None and previous.reusable(entry)
+            compressed = None
+            if (
+                not reused
+                and entry.method == zipfile.ZIP_DEFLATED
+                and isinstance(entry.source, Path)
+                and PARALLEL_MIN_SIZE <= entry.source.stat().st_size <= PARALLEL_MAX_SIZE
+            ):
+                compressed = pool.submit(deflate, entry.source, entry.level)
+            pending.append((entry, compressed, reused))
+            # Write the entries in order, keeping at most two compressions per thread in memory
+            while pending and (pending[0][1] is None or pending[0][1].done() or len(pending) > 2 * workers):
+                write_next()
+        while pending:
+            write_next()
@@ -0,0 +1,160 @@
+"""Build many FMUs in parallel."""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .builder import FmuBuilder
+
+FilePath = Union[str, Path]
+
+# Outcome of one build: FMU path (None on failure), duration in seconds and error message (None on success)
+BuildResult = namedtuple("BuildResult", ["script_file", "fmu", "duration", "error"])
+
+# Arguments of FmuBuilder.build_FMU holding paths, resolved relative to the manifest
+PATH_ARGUMENTS = ("script_file", "dest", "documentation_folder", "cache_dir")
+
+
+def _build(arguments: Dict[str, Any]) -> BuildResult:
+    start = time.perf_counter()
+    try:
+        fmu = str(FmuBuilder.build_FMU(**arguments))
+        error = None
+    except Exception as e:
+        fmu = None
+        error = f"{type(e).__name__}: {e}"
+    return BuildResult(str(arguments.get("script_file")), fmu, time.perf_counter() - start, error)
+
+
+def read_manifest(manifest: FilePath) -> List[Dict[str, Any]]:
+    """Read the builds listed in a JSON manifest.
+
+    The manifest is a list of objects holding the arguments of `FmuBuilder.build_FMU`, e.g.
+    `[{"script_file": "model.py", "project_files": ["data"], "canGetAndSetFMUstate": true}]`.
+    Relative paths are relative to the manifest folder.
+
+    Args:
+        manifest (FilePath): The manifest file
+
+    Returns:
+        List[Dict[str, Any]]: Arguments of each build
+    """
+    manifest = Path(manifest)
+    builds = json.loads(manifest.read_text())
+    if not isinstance(builds, list):
+        raise ValueError(f"The manifest {manifest!s} must hold a list of builds")
+
+    root = manifest.parent
+    for arguments in builds:
+        if "script_file" not in arguments:
+            raise ValueError(f"Build without script_file in manifest {manifest!s}: {arguments}")
+        for name in PATH_ARGUMENTS:
+            if arguments.get(name) is not None:
+                arguments[name] = str(root / arguments[name])
+        if "project_files" in arguments:
+            arguments["project_files"] = [str(root / f) for f in arguments["project_files"]]
+    return builds
+
+
+class BatchBuilder:
+
+    @staticmethod
+    def build_many(
+        builds: Iterable[Dict[str, Any]],
+        jobs: Optional[int] = None,
+        cache_dir: Optional[FilePath] = None,
+    ) -> List[BuildResult]:
+        """Build FMUs in parallel.
+
+        `FmuBuilder.build_FMU` imports the models and changes `sys.path`, so each build runs in
+        its own fresh worker process.
+
+        Args:
+            builds (Iterable[Dict[str, Any]]): Arguments of `FmuBuilder.build_FMU` for each FMU
+            jobs (int): Optional number of parallel builds, the number of CPUs by default
+            cache_dir (FilePath): Optional build cache folder shared by the builds not setting their own
+
+        Returns:
+            List[BuildResult]: Result of each build, in the same order
+        """
+        builds = [dict(arguments) for arguments in builds]
+        if cache_dir is not None:
+            for arguments in builds:
+                arguments.setdefault("cache_dir", str(cache_dir))
+        if not builds:
+            return list()
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(jobs or multiprocessing.cpu_count(), len(builds)), maxtasksperchild=1) as pool:
+            return pool.map(_build, builds, chunksize=1)
+
+    @staticmethod
+    def build_manifest(
+        manifest: FilePath,
+        dest: Optional[FilePath] = None,
+        jobs: Optional[int] = None,
+        cache_dir: Optional[FilePath] = None,
+    ) -> List[BuildResult]:
+        """Build the FMUs listed in a manifest (see `read_manifest`) and print a summary.
+
+        Args:
+            manifest (FilePath): The manifest file
+            dest (FilePath): Optional destination of the builds not setting their own
+            jobs (int): Optional number of parallel builds, the number of CPUs by default
+            cache_dir (FilePath): Optional build cache folder shared by the builds not setting their own
+
+        Returns:
+            List[BuildResult]: Result of each build, in the manifest order
+        """
+        builds = read_manifest(manifest)
+        if dest is not None:
+            for arguments in builds:
+                arguments.setdefault("dest", str(dest))
+
+        start = time.perf_counter()
+        results = BatchBuilder.build_many(builds, jobs=jobs, cache_dir=cache_dir)
+        total = time.perf_counter() - start
+
+        for result in results:
+            outcome = result.fmu if result.error is None else f"FAILED {result.error}"
+            print(f"{result.duration:8.2f} s  {Path(result.script_file).name}: {outcome}")
+        failed = sum(result.error is not None for result in results)
+        print(f"Built {len(results) - failed}/{len(results)} FMUs in {total:.2f} s")
+        return results
+
+
+def _build_manifest_command(**options):
+    results = BatchBuilder.build_manifest(**options)
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+def create_command_parser(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        dest="manifest",
+        help="Path to the JSON manifest listing the builds.",
+        required=True
+    )
+
+    parser.add_argument(
+        "-d", "--dest", dest="dest", help="Where to save the FMUs not setting their destination.", default=None
+    )
+
+    parser.add_argument(
+        "-j", "--jobs", dest="jobs", type=int, help="Number of parallel builds (default: number of CPUs).", default=None
+    )
+
+    parser.add_argument(
+        "--cache",
+        dest="cache_dir",
+        help="Build cache folder shared by the builds, unchanged FMUs are copied from it instead of built.",
+        default=None
+    )
+
+    parser.set_defaults(execute=_build_manifest_command)
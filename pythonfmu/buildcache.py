@@ -0,0 +1,155 @@
+"""Cache of built FMUs, keyed by the content of their inputs."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from .osutil import walk_files
+
+FilePath = Union[str, Path]
+
+# Bumped when the layout of the cache or the content of the keys changes
+CACHE_VERSION = 2
+
+# File holding the digests of the files hashed so far, with their size and modification time
+DIGESTS_FILE = "digests.json"
+# Folder holding the last build of each lineage (see `BuildCache.put`)
+LINEAGES_FOLDER = "lineages"
+
+
+class BuildCache:
+    """Folder keeping the FMUs built from given inputs, so that rebuilding them is a copy.
+
+    The key of a build covers the content of the files it reads and the build options. File
+    digests are remembered with the size and modification time of the files, so large files are
+    only hashed again when they change.
+
+    The last build of a lineage (e.g. of a script with a compression policy) is remembered with
+    the digests of its entries, so rebuilding it after some files changed may reuse the entries
+    of the others (see `archive.PreviousArchive`).
+
+    Args:
+        folder (FilePath): Cache folder, created if needed
+    """
+
+    def __init__(self, folder: FilePath):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._digests_file = self.folder / DIGESTS_FILE
+        self._digests: Dict[str, Any] = dict()
+        if self._digests_file.is_file():
+            try:
+                self._digests = json.loads(self._digests_file.read_text())
+            except ValueError:
+                pass
+        self._digests_changed = False
+
+    def file_digest(self, path: Path) -> str:
+        """SHA-256 digest of a file content.
+
+        Args:
+            path (pathlib.Path): The file
+
+        Returns:
+            str: Hexadecimal digest
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        known = self._digests.get(str(path))
+        if known is not None and known[:2] == signature:
+            return known[2]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self._digests[str(path)] = signature + [digest]
+        self._digests_changed = True
+        return digest
+
+    def key(self, files: Iterable[FilePath], **options) -> str:
+        """Key of a build.
+
+        Args:
+            files (Iterable[FilePath]): Files and folders read by the build, folders are walked like the
+                builder does (see `osutil.walk_files`)
+            **options: Build options, must have a stable representation
+
+        Returns:
+            str: Hexadecimal key
+        """
+        sha = hashlib.sha256(f"pythonfmu-build-cache-{CACHE_VERSION}".encode())
+        for name, value in sorted(options.items()):
+            sha.update(f"{name}={value!r}\n".encode())
+        for path in files:
+            path = Path(path)
+            entries = walk_files(path) if path.is_dir() else [path]
+            for entry in entries:
+                name = entry.relative_to(path).as_posix() if path.is_dir() else entry.name
+                sha.update(f"{path.name}/{name}:{self.file_digest(entry)}\n".encode())
+        self._save_digests()
+        return sha.hexdigest()
+
+    def get(self, key: str) -> Optional[Path]:
+        """FMU built for a key, if any."""
+        entry = self.folder / key
+        fmus = list(entry.glob("*.fmu")) if entry.is_dir() else []
+        return fmus[0] if len(fmus) == 1 else None
+
+    def put(self, key: str, fmu: Path, lineage: Optional[str] = None, digests: Optional[Dict[str, str]] = None) -> Path:
+        """Store the FMU built for a key.
+
+        Args:
+            key (str): Key of the build
+            fmu (pathlib.Path): The FMU
+            lineage (str): Optional, lineage of the build, the FMU becomes its last build
+            digests (Dict[str, str]): Optional, digests of the content of the FMU entries that may be reused
+
+        Returns:
+            pathlib.Path: The cached FMU
+        """
+        entry = self.folder / key
+        # Filled aside then renamed, so concurrent builds never see a partial entry
+        staging = Path(tempfile.mkdtemp(prefix=f"{key}-", dir=self.folder))
+        shutil.copy2(fmu, staging / fmu.name)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Stored meanwhile by another build
+            shutil.rmtree(staging, ignore_errors=True)
+        if lineage is not None:
+            self._replace(
+                self._lineage_file(lineage), json.dumps(dict(key=key, name=fmu.name, digests=digests or dict()))
+            )
+        return entry / fmu.name
+
+    def previous(self, lineage: str) -> Optional[Tuple[Path, Dict[str, str]]]:
+        """Last FMU built for a lineage and the digests of its entries, if still cached."""
+        try:
+            last = json.loads(self._lineage_file(lineage).read_text())
+        except (OSError, ValueError):
+            return None
+        fmu = self.folder / last["key"] / last["name"]
+        return (fmu, last["digests"]) if fmu.is_file() else None
+
+    def _lineage_file(self, lineage: str) -> Path:
+        return self.folder / LINEAGES_FOLDER / f"{hashlib.sha256(lineage.encode()).hexdigest()}.json"
+
+    def _replace(self, path: Path, text: str):
+        # Replaced atomically, a concurrent build may lose its update but never read a partial file
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=path.name, dir=path.parent)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def _save_digests(self):
+        if not self._digests_changed:
+            return
+        self._replace(self._digests_file, json.dumps(self._digests))
+        self._digests_changed = False
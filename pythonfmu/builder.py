@@ -2,9 +2,13 @@
 from __future__ import annotations
 
 import argparse
+import builtins
+import errno
+import fnmatch
 import importlib
 import itertools
 import logging
+import py_compile
 import re
 import shutil
 import sys
@@ -12,16 +16,38 @@ import tempfile
 from types import FunctionType
 import zipfile
 import inspect
-from pathlib import Path
-from typing import Iterable, Literal, Optional, Tuple, Union
-from xml.dom.minidom import parseString
-from xml.etree.ElementTree import Element, SubElement, tostring
-from .osutil import get_lib_extension, get_platform
+import io
+import os
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Iterator, List, Literal, Mapping, Optional, Tuple, Union
+from ._version import __version__
+from .archive import Entry, PreviousArchive, write_entries
+from .buildcache import BuildCache
+from .osutil import get_lib_extension, get_platform, walk_files
 from .fmi2slave import FMI2_MODEL_OPTIONS, Fmi2Slave
 
 FilePath = Union[str, Path]
 HERE = Path(__file__).parent
 
+# Modules of the package only used to build FMUs, not embedded in them
+BUILD_MODULES = frozenset([
+    "__main__.py",
+    "archive.py",
+    "batchbuilder.py",
+    "buildcache.py",
+    "builder.py",
+    "csvbuilder.py",
+    "deploy.py",
+    "osutil.py",
+])
+
+# Compression methods allowed in FMUs by the FMI standard
+COMPRESSION_METHODS = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED}
+
+# Pattern, compression method and level of the archive entries
+CompressionPolicy = List[Tuple[str, int, Optional[int]]]
+
 logger = logging.getLogger(__name__)
 
 def match_par(txt: str, left: str = "(", right: str = ")") -> tuple[int, Literal[-1]] | tuple[int, int]:
@@ -160,15 +186,15 @@ def update_model_parameters(src: Path, model: Fmi2Slave, newargs: dict) -> str:
 
     return module_code
 
-def get_model_description(filepath: Path, module_name: str, class_name: str) -> Tuple[str, Element]:
-    """Extract the FMU model description as XML.
+def get_model_description(filepath: Path, module_name: str, class_name: str) -> Tuple[str, Fmi2Slave]:
+    """Instantiate the model to describe.
 
     Args:
         filepath (pathlib.Path) : script file path
         module_name (str) : python module to load
 
     Returns:
-        Tuple[str, xml.etree.TreeElement.Element] : FMU model name, model description
+        Tuple[str, Fmi2Slave] : FMU model name, model instance writing the description (see `Fmi2Slave.write_xml`)
     """
     # Add current folder to handle local dependencies
     sys.path.insert(0, str(filepath.parent))
@@ -186,8 +212,172 @@ def get_model_description(filepath: Path, module_name: str, class_name: str) ->
         raise TypeError(
             f"The provided class '{class_name}' does not inherit from {Fmi2Slave.__qualname__}"
         )
-    # Produce the xml
-    return instance.modelName, instance.to_xml()
+    return instance.modelName, instance
+
+def split_destination(dest: FilePath) -> Tuple[Path, Union[Path, str]]:
+    """Folder of the FMU to build and its file name if given, creating the folder.
+
+    Args:
+        dest (FilePath) : destination folder, or FMU file name with '.fmu' extension
+
+    Returns:
+        Tuple[pathlib.Path, Union[pathlib.Path, str]] : the folder and the FMU file, "" when named after the model
+    """
+    dest = Path(dest)
+    if ( dest.suffix == '.fmu' and # explicit FMU file name shall always have suffix '.fmu'
+         ( dest.is_file() or # Note that .is_file() returns False if the file does not yet exist
+           not dest.is_dir())): # if dest represents an (existing) directory we cannot interpret as file!
+        dest_file = dest
+        dest = dest.parent
+    else:
+        dest_file = "" # FMU file name is automatically generated by the build
+    if not dest.exists():
+        dest.mkdir(parents=True)
+    return dest, dest_file
+
+def runtime_files() -> List[Path]:
+    """Files of pythonfmu embedded in every FMU, part of the build cache keys."""
+    return sorted(dep for dep in HERE.glob("*.py") if dep.name not in BUILD_MODULES) + [HERE / "resources" / "binaries"]
+
+def copy_cached(cache: BuildCache, key: str, dest: Path, dest_file: Union[Path, str]) -> Optional[Path]:
+    """Copy the FMU cached for a build key to its destination, if any.
+
+    Args:
+        cache (BuildCache) : the build cache
+        key (str) : key of the build
+        dest (pathlib.Path) : destination folder
+        dest_file (Union[pathlib.Path, str]) : FMU file name, "" to keep the one of the cached FMU
+
+    Returns:
+        Optional[pathlib.Path] : the copied FMU, None if it is not cached
+    """
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    logger.info(f"FMU {cached.name} unchanged, copied from the build cache")
+    dest_file = dest / cached.name if dest_file == "" else dest_file
+    shutil.copyfile(cached, dest_file)
+    return dest_file
+
+def link_project_file(src: Path, dest: Path):
+    """Link a project file or folder in the build folder, copying it where links are not supported.
+
+    Args:
+        src (pathlib.Path) : project file or folder
+        dest (pathlib.Path) : path in the build folder
+    """
+    try:
+        os.symlink(src.resolve(), dest, target_is_directory=src.is_dir())
+    except OSError:
+        if src.is_dir():
+            shutil.copytree(src, dest)
+        else:
+            shutil.copy2(src, dest)
+
+@contextmanager
+def read_only(paths: Iterable[Path]) -> Iterator[None]:
+    """Refuse to open the files within some paths for writing through `open` and `os.open`.
+
+    The model is described from a build folder linking the project files, this keeps it from
+    changing them through the links. Other ways to write files (e.g. extension modules) are not
+    covered.
+
+    Args:
+        paths (Iterable[pathlib.Path]) : files and folders to protect
+    """
+    roots = [os.path.realpath(path) for path in paths]
+    builtin_open, io_open, os_open = builtins.open, io.open, os.open
+
+    def check(file):
+        if isinstance(file, int):
+            return
+        path = os.path.realpath(os.fsdecode(file))
+        for root in roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                raise PermissionError(
+                    errno.EACCES, "Project files can not be written while the model is described", os.fsdecode(file)
+                )
+
+    def guarded_open(file, mode="r", *args, **kwargs):
+        if any(flag in mode for flag in "wax+"):
+            check(file)
+        return io_open(file, mode, *args, **kwargs)
+
+    def guarded_os_open(path, flags, *args, **kwargs):
+        if flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND):
+            check(path)
+        return os_open(path, flags, *args, **kwargs)
+
+    builtins.open = io.open = guarded_open
+    os.open = guarded_os_open
+    try:
+        yield
+    finally:
+        builtins.open, io.open, os.open = builtin_open, io_open, os_open
+
+def parse_compression(compression: Union[Mapping[str, str], Iterable[Tuple[str, str]], None]) -> CompressionPolicy:
+    """Parse a compression policy.
+
+    Args:
+        compression (Mapping[str, str]) : compression method of the entries matching each pattern, the first
+           matching pattern applies. Methods are `stored` or `deflated`, optionally followed by `:level`
+           (e.g. `{"*.h5": "stored", "*": "deflated:6"}`). Entries not matching any pattern are stored.
+
+    Returns:
+        CompressionPolicy : the parsed policy
+    """
+    policy = list()
+    for pattern, method in dict(compression or {}).items():
+        name, _, level = str(method).partition(":")
+        if name not in COMPRESSION_METHODS:
+            raise ValueError(
+                f"Unsupported compression method '{name}' for '{pattern}', expected one of {list(COMPRESSION_METHODS)}"
+            )
+        policy.append((pattern, COMPRESSION_METHODS[name], int(level) if level else None))
+    return policy
+
+def compression_for(arcname: str, policy: CompressionPolicy) -> Tuple[int, Optional[int]]:
+    """Compression method and level of an archive entry."""
+    for pattern, method, level in policy:
+        if fnmatch.fnmatchcase(arcname, pattern):
+            return method, level
+    return zipfile.ZIP_STORED, None
+
+def compile_sources(sources: Iterable[Tuple[Path, str]], output: Path) -> List[Tuple[Path, str]]:
+    """Compile Python sources to bytecode for the running interpreter.
+
+    The bytecode files are written to the `__pycache__` folders of a mirror of the resources
+    folder, with unchecked hashes: the importer uses them without checking the sources, whose
+    timestamps are not preserved when extracting the FMU.
+
+    Args:
+        sources (Iterable[Tuple[pathlib.Path, str]]) : files and their name in the resources folder, the
+           Python sources among them are compiled
+        output (pathlib.Path) : folder receiving the bytecode
+
+    Returns:
+        List[Tuple[pathlib.Path, str]] : the bytecode files and their name in the resources folder
+    """
+    compiled = list()
+    for source, name in sources:
+        if not name.endswith(".py"):
+            continue
+        relative = PurePosixPath(name)
+        pycache = relative.parent / "__pycache__" / f"{relative.stem}.{sys.implementation.cache_tag}.pyc"
+        cfile = output / pycache
+        try:
+            py_compile.compile(
+                str(source),
+                cfile=str(cfile),
+                dfile=name,
+                doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            )
+        except py_compile.PyCompileError as e:
+            logger.warning(f"Skip compiling {name}: {e.msg}")
+            continue
+        compiled.append((cfile, pycache.as_posix()))
+    return compiled
 
 class FmuBuilder:
 
@@ -198,6 +388,9 @@ class FmuBuilder:
         project_files: Iterable[FilePath] = set(),
         documentation_folder: Optional[FilePath] = None,
         newargs: dict | None = None,
+        precompile: bool = False,
+        cache_dir: Optional[FilePath] = None,
+        compression: Union[Mapping[str, str], Iterable[Tuple[str, str]], None] = None,
         **options,
     ) -> Path:
         """ Build the FMU from the Python script, additional project files and documentatiion.
@@ -210,6 +403,11 @@ class FmuBuilder:
             project_files (Iterable[FilePath]): Optional list/tuple of additional project files needed to run model
             documentation_folder (FilePath): Optional additional documentation (beyond modelDescription)
             newargs (dict): Optional dict of replacements of model class __init__() arguments.
+            precompile (bool): Optional, add the bytecode of the Python sources for the running interpreter version.
+            cache_dir (FilePath): Optional build cache folder. If the script, project files, documentation and options
+               are unchanged since a previous build using the same folder, its FMU is copied instead of built.
+            compression (Mapping[str, str]): Optional compression method of the FMU entries matching each pattern,
+               see `parse_compression`. Entries are stored by default.
         """
         script_file = Path(script_file)
         if not script_file.exists():
@@ -217,17 +415,9 @@ class FmuBuilder:
         if not script_file.suffix.endswith(".py"):
             raise ValueError(f"File {script_file!s} must have extension '.py'!")
         
-        dest = Path(dest)
-        if ( dest.suffix == '.fmu' and # explicit FMU file name shall always have suffix '.fmu'
-             ( dest.is_file() or # Note that .is_file() returns False if the file does not yet exist
-               not dest.is_dir())): # if dest represents an (existing) directory we cannot interpret as file!
-            dest_file = dest
-            dest = dest.parent
-        else:
-            dest_file = "" # FMU file name is automatically generated below
-        if not dest.exists():
-            dest.mkdir(parents=True)
+        dest, dest_file = split_destination(dest)
         project_files = set(map(Path, project_files))
+        compression_policy = parse_compression(compression)
 
         if documentation_folder is not None:
             documentation_folder = Path(documentation_folder)
@@ -236,6 +426,27 @@ class FmuBuilder:
                     f"The documentation folder does not exists {documentation_folder!s}"
                 )
 
+        cache = cache_key = None
+        if cache_dir is not None:
+            cache = BuildCache(cache_dir)
+            cache_key = cache.key(
+                itertools.chain(
+                    [script_file],
+                    sorted(project_files),
+                    [] if documentation_folder is None else [documentation_folder],
+                    runtime_files(),
+                ),
+                version=__version__,
+                dest_name=dest_file.name if dest_file != "" else "",
+                newargs=sorted(newargs.items()) if newargs else None,
+                precompile=sys.implementation.cache_tag if precompile else None,
+                compression=compression_policy,
+                options=sorted(options.items()),
+            )
+            cached = copy_cached(cache, cache_key, dest, dest_file)
+            if cached is not None:
+                return cached
+
         if script_file.parent not in sys.path:
             sys.path.insert(0, str(script_file.parent))
 
@@ -243,7 +454,10 @@ class FmuBuilder:
         model_class = get_model_class(script_file)
 
         with tempfile.TemporaryDirectory(prefix="pythonfmu_") as tempd:
-            temp_dir = Path(tempd)
+            # Resources of the FMU as seen by the model when it is described: the script, and
+            # links to the project files which are streamed from their location into the FMU
+            temp_dir = Path(tempd) / "resources"
+            temp_dir.mkdir()
 
             if newargs:
                 model_file = temp_dir / f"{module_name}.py"
@@ -254,89 +468,115 @@ class FmuBuilder:
             else:
                 shutil.copy2(script_file, temp_dir)
 
-            # Embed pythonfmu in the FMU so it does not need to be included
-            dep_folder = temp_dir / "pythonfmu"
-            dep_folder.mkdir()
-            for dep in HERE.glob('*.py'):  # Find all python files at the same level as this one
-                shutil.copy2(dep, dep_folder)
+            # Project files and their name in the resources folder
+            projects: List[Tuple[Path, str]] = list()
             for file_ in project_files:
                 if file_ == script_file.parent:
-                    new_folder = temp_dir / file_.name
-                    new_folder.mkdir()
-                    for f in file_.iterdir():
-                        if f.is_dir():
-                            temp_dest = new_folder / f.name
-                            shutil.copytree(f, temp_dest)
-                        elif f.name != script_file.name:
-                            shutil.copy2(f, new_folder)
+                    for f in sorted(file_.iterdir()):
+                        if f.name != script_file.name:
+                            projects.append((f, f"{file_.name}/{f.name}"))
                         else:
                             logger.debug(
                                 "Skip file with the same name as the script found in project file."
                             )
                 else:
-                    if file_.is_dir():
-                        temp_dest = temp_dir / file_.name
-                        shutil.copytree(file_, temp_dest)
-                    else:
-                        assert file_.name != script_file.name, ( # avoid the inclusion of the script in project files
-                            "It seems that the script file is included a second time in the project_files")
-                        shutil.copy2(file_, temp_dir)
-
-            model_identifier, xml = get_model_description(
-                temp_dir.absolute() / script_file.name, module_name, model_class.__name__
-            )
+                    assert file_.name != script_file.name, ( # avoid the inclusion of the script in project files
+                        "It seems that the script file is included a second time in the project_files")
+                    projects.append((file_, file_.name))
+            for src, name in projects:
+                (temp_dir / name).parent.mkdir(exist_ok=True)
+                link_project_file(src, temp_dir / name)
+
+            with read_only(src for src, _ in projects):
+                model_identifier, instance = get_model_description(
+                    temp_dir.absolute() / script_file.name, module_name, model_class.__name__
+                )
             dest_file = dest / f"{model_identifier}.fmu" if dest_file == "" else dest_file
 
-            type_node = xml.find("CoSimulation")
             option_names = [opt.name for opt in FMI2_MODEL_OPTIONS]
-            for option, value in options.items():
-                if option in option_names:
-                    type_node.set(option, str(value).lower())
-
-            with zipfile.ZipFile(dest_file, "w") as zip_fmu:
-
-                resource = Path("resources")
-
-                # Add files copied in temporary directory
-                for f in temp_dir.rglob("*"):
-                    if f.is_file() and f.parent.name != "__pycache__":
-                        relative_f = f.relative_to(temp_dir)
-                        zip_fmu.write(f, arcname=(resource / relative_f))
-
-                # Add information for the Python loader
-                zip_fmu.writestr(str(resource.joinpath("slavemodule.txt")), module_name)
-
-                # Add FMI API wrapping Python class library
-                binaries = Path("binaries")
-                src_binaries = HERE / "resources" / "binaries"
-                for f in itertools.chain(
-                    src_binaries.rglob("*.dll"),
-                    src_binaries.rglob("*.so"),
-                    src_binaries.rglob("*.dylib"),
+            model_options = dict((option, value) for option, value in options.items() if option in option_names)
+
+            # Files of the resources folder and their name in it: the ones written in the build folder, the
+            # project files and the pythonfmu runtime, embedded so that it does not need to be installed
+            sources = [(f, f.relative_to(temp_dir).as_posix()) for f in walk_files(temp_dir, followlinks=False)]
+            for src, name in projects:
+                if src.is_dir():
+                    sources.extend((f, f"{name}/{f.relative_to(src).as_posix()}") for f in walk_files(src))
+                else:
+                    sources.append((src, name))
+            sources.extend((dep, f"pythonfmu/{dep.name}") for dep in HERE.glob("*.py") if dep.name not in BUILD_MODULES)
+            sources.sort(key=lambda source: source[1])
+
+            # Bytecode found along the project files is not shipped, it may be stale
+            bytecode_dir = Path(tempd) / "bytecode"
+            if precompile:
+                sources.extend(compile_sources(sources, bytecode_dir))
+
+            # Describe the model before creating the archive, a model failing to be
+            # described must not leave a truncated FMU behind
+            description_file = Path(tempd) / "modelDescription.xml"
+            with description_file.open("wb") as description:
+                instance.write_xml(description, model_options)
+
+            # Builds of a script with the same compression policy reuse the unchanged deflated entries of the
+            # last one, the digests of the files outside of the build folder are known from the cache key
+            lineage = repr((str(script_file.resolve()), compression_policy))
+            last = cache.previous(lineage) if cache is not None else None
+            digests: Dict[str, str] = dict()
+
+            def entry(arcname: str, source: Union[Path, bytes]) -> Entry:
+                method, level = compression_for(arcname, compression_policy)
+                digest = None
+                if (
+                    cache is not None
+                    and method == zipfile.ZIP_DEFLATED
+                    and isinstance(source, Path)
+                    and Path(tempd) not in source.parents
                 ):
-                    relative_f = f.relative_to(src_binaries)
-                    arcname = (
-                        binaries
-                        / relative_f.parent
-                        / f"{model_identifier}{relative_f.suffix}"
-                    )
-                    zip_fmu.write(f, arcname=arcname)
-
-                # Add the documentation folder
-                if documentation_folder is not None:
-                    documentation = Path("documentation")
-                    for f in documentation_folder.rglob("*"):
-                        if f.is_file():
-                            relative_f = f.relative_to(documentation_folder)
-                            zip_fmu.write(f, arcname=(documentation / relative_f))
-
-                # Add the model description
-                xml_str = parseString(tostring(xml, "UTF-8"))
-                zip_fmu.writestr(
-                    "modelDescription.xml", xml_str.toprettyxml(encoding="UTF-8")
-                )
+                    digest = digests[arcname] = cache.file_digest(source)
+                return Entry(arcname, source, method, level, digest)
+
+            entries = [entry(f"resources/{name}", f) for f, name in sources]
+            # Add information for the Python loader
+            entries.append(entry("resources/slavemodule.txt", module_name.encode()))
+            # The loader imports the class directly instead of discovering it
+            entries.append(entry("resources/slaveclass.txt", f"{module_name}.{model_class.__name__}".encode()))
+
+            # Add FMI API wrapping Python class library
+            src_binaries = HERE / "resources" / "binaries"
+            for f in itertools.chain(
+                src_binaries.rglob("*.dll"),
+                src_binaries.rglob("*.so"),
+                src_binaries.rglob("*.dylib"),
+            ):
+                relative_f = f.relative_to(src_binaries)
+                entries.append(entry(f"binaries/{relative_f.parent.as_posix()}/{model_identifier}{relative_f.suffix}", f))
+
+            # Add the documentation folder
+            if documentation_folder is not None:
+                for f in documentation_folder.rglob("*"):
+                    if f.is_file():
+                        entries.append(entry(f"documentation/{f.relative_to(documentation_folder).as_posix()}", f))
+
+            # Add the model description
+            entries.append(entry("modelDescription.xml", description_file))
+
+            try:
+                previous = PreviousArchive(*last) if last is not None else None
+                try:
+                    with zipfile.ZipFile(dest_file, "w") as zip_fmu:
+                        write_entries(zip_fmu, entries, previous)
+                finally:
+                    if previous is not None:
+                        previous.close()
+            except BaseException:
+                # Do not leave a partial archive behind
+                Path(dest_file).unlink(missing_ok=True)
+                raise
             if newargs is not None:
                 sys.modules.pop(Path(script_file).stem)  # otherwise old script may be active when loading the FMU!
+            if cache is not None:
+                cache.put(cache_key, dest_file, lineage, digests)
 
             return dest_file
 
@@ -349,6 +589,13 @@ class FmuBuilder:
         return src_binaries.exists() and len(list(src_binaries.glob(f"*.{lib_ext}"))) >= 1
 
 
+def parse_compression_argument(value: str) -> Tuple[str, str]:
+    pattern, sep, method = value.rpartition("=")
+    if not sep or not pattern:
+        raise argparse.ArgumentTypeError(f"Expected PATTERN=METHOD, got '{value}'")
+    return pattern, method
+
+
 def create_command_parser(parser: argparse.ArgumentParser):
     parser.add_argument(
         "-f",
@@ -378,6 +625,31 @@ def create_command_parser(parser: argparse.ArgumentParser):
             action=action
         )
 
+    parser.add_argument(
+        "--precompile",
+        dest="precompile",
+        help="If given, add the bytecode of the Python sources for the running interpreter version.",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--cache",
+        dest="cache_dir",
+        help="Build cache folder, unchanged FMUs are copied from it instead of built.",
+        default=None
+    )
+
+    parser.add_argument(
+        "--compress",
+        dest="compression",
+        metavar="PATTERN=METHOD",
+        type=parse_compression_argument,
+        action="append",
+        help="Compression of the FMU entries matching PATTERN: 'stored' or 'deflated', optionally followed by "
+             "':level' (e.g. '*.py=deflated:9'). The first matching pattern applies, entries are stored by default.",
+        default=None
+    )
+
     parser.add_argument(
         "project_files",
         metavar="Project files",
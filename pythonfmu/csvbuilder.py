@@ -1,166 +1,277 @@
 import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
 import tempfile
+from array import array
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Union
+from typing import IO, Any, Iterable, Iterator, Optional, Tuple, Union
+from .csvslave import FORMAT_VERSION, INTERPOLATIONS, MAGIC, PREAMBLE, TYPECODES, aligned
+from .enums import Fmi2Type
 from .fmi2slave import FMI2_MODEL_OPTIONS
-from .builder import FmuBuilder
+from ._version import __version__
+from .buildcache import BuildCache
+from .builder import FmuBuilder, copy_cached, parse_compression, parse_compression_argument, runtime_files, split_destination
 
 FilePath = Union[str, Path]
 
 
-def create_csv_slave(csv_file: FilePath):
-    classname = csv_file.stem.capitalize()
-    filename = csv_file.name
-    return f"""
-import re
-import csv
-from math import isclose  # requires >= python 3.5
-from pythonfmu.fmi2slave import Fmi2Type, Fmi2Slave, Fmi2Causality, Fmi2Variability, Integer, Real, Boolean, String
+# Rows converted between two writes of the column arrays
+CHUNK_ROWS = 1 << 16
 
-def lerp(v0: float, v1: float, t: float) -> float:
-    return (1 - t) * v0 + t * v1
-
-def normalize(x: float, in_min: float, in_max: float, out_min: float, out_max: float) -> float:
-    x = max(min(x, in_max), in_min)
-    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
 def get_fmi2_type(s: str) -> Fmi2Type:
     s_lower = s.lower()
     for type in Fmi2Type:
         if type.name in s_lower:
             if type == Fmi2Type.enumeration:
-                raise NotImplementedError(f"Unsupported type: {{Fmi2Type.enumeration.name}}")
+                raise NotImplementedError(f"Unsupported type: {Fmi2Type.enumeration.name}")
             else:
                 return type
-    raise TypeError(f"Could not process type from input string: {{s}}")
-
-TYPE2OBJ = {{
-    Fmi2Type.integer: Integer,
-    Fmi2Type.real: Real,
-    Fmi2Type.boolean: Boolean,
-    Fmi2Type.string: String
-    }}
-
-class Header:
-
-    def __init__(self, s):
-        matches = re.findall(r"\\[(.*?)\\]", s)
-        if len(matches) > 0:
-            match = matches[-1]
-            self.name = s.replace("[" + match + "]", "").rstrip()
-            self.type = get_fmi2_type(match)
-        else:
-            self.name = s
-            self.type = Fmi2Type.real
-        
-
-    def __repr__(self):
-        return f"Header(name={{self.name}}, type={{self.type.name}})"
-
-
-class {classname}(Fmi2Slave):
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-        self.current_index = 0
-        self.next_index = None
-        self.current_time = 0.0
-        self.interpolate = True
-        data = dict()
-
-        def read_csv():
-            with open(self.resources + '/' + "{filename}") as f:
-                return list(csv.reader(f, skipinitialspace=True, delimiter=',', quotechar='"'))
-
-        read = read_csv()
-        header_row = read[0]
-        headers = list(map(lambda h: Header(h.strip()), header_row[1:len(header_row)]))
-        rows = read[1:len(read)]
-        self.num_rows = len(rows)
-        self.times = []
-
-        for header in headers:
-            data[header.name] = []
-
-            def get_value(header):
-                current_value = data[header.name][self.current_index]
-                if self.next_index is None or header.type is not Fmi2Type.real:
-                    return current_value
-
-                next_value = data[header.name][self.next_index]
-                
-                if current_value == next_value:
-                    return current_value
-                
-                current_value_t = self.times[self.current_index]
-                next_value_t = self.times[self.next_index]
-
-                t = normalize(self.current_time, current_value_t, next_value_t, 0, 1)
-                return lerp(current_value, next_value, t)
-
-            self.register_variable(
-                TYPE2OBJ[header.type](header.name,
-                     causality=Fmi2Causality.output,
-                     variability=Fmi2Variability.constant,
-                     getter=lambda header=header: get_value(header)), nested=False)
-
-        for i in range(0, self.num_rows):
-            row = rows[i]
-            self.times.append(float(row[0]))
-
-            for j in range(1, len(row)):
-                header = headers[j-1]
-                if header.type == Fmi2Type.integer:
-                    data[header.name].append(int(row[j]))
-                elif header.type == Fmi2Type.real:
-                    data[header.name].append(float(row[j]))
-                elif header.type == Fmi2Type.boolean:
-                    data[header.name].append(row[j] == 'true')
-                elif header.type == Fmi2Type.string:
-                    data[header.name].append(row[j])
-
-        self.register_variable(Integer("num_rows",
-                                    causality=Fmi2Causality.output,
-                                    variability=Fmi2Variability.constant))
-        self.register_variable(Real("end_time",
-                                    causality=Fmi2Causality.output,
-                                    variability=Fmi2Variability.constant,
-                                    getter=lambda: self.times[-1]))
-        self.register_variable(Boolean("interpolate",
-                                    causality=Fmi2Causality.parameter,
-                                    variability=Fmi2Variability.tunable))
-
-    def find_indices(self, t, dt):
-        current_t = self.times[self.current_index]
-        while current_t < t:
-            if self.current_index == self.num_rows-1:
-                break
-            self.current_index += 1
-            current_t = self.times[self.current_index]
-        if current_t > t and not isclose(current_t, t, rel_tol=1e-6):
-            self.current_index -= 1
-            current_t = self.times[self.current_index]
-
-        if self.interpolate and self.current_index <= self.num_rows-2:
-            self.next_index = self.current_index+1
-            next_t = self.times[self.next_index]
-            while t+dt >= next_t and not isclose(t+dt, next_t, abs_tol=1e-6):
-                if self.next_index + 1 < self.num_rows:
-                    self.next_index += 1
-                    next_t = self.times[self.next_index]
-
-    def setup_experiment(self, start_time: float, stop_time, tolerance):
-        self.current_time = start_time
-        self.find_indices(start_time, 0)
-
-    def do_step(self, current_time: float, step_size: float) -> bool:
-        if (self.current_index == self.num_rows):
-            return False
-        self.current_time = current_time + step_size
-        self.find_indices(self.current_time, step_size)
-        return True
+    raise TypeError(f"Could not process type from input string: {s}")
+
+
+def parse_header(s: str) -> Tuple[str, Fmi2Type, Optional[str]]:
+    """Name, type and interpolation of a column, from a header like `name [TYPE INTERPOLATION]`.
+
+    The type is Real by default, the interpolation is None when not given.
+    """
+    matches = re.findall(r"\[(.*?)\]", s)
+    if len(matches) > 0:
+        match = matches[-1]
+        words = match.lower().replace(",", " ").split()
+        interpolation = next((word for word in words if word in INTERPOLATIONS), None)
+        spec = " ".join(word for word in words if word != interpolation)
+        type_ = get_fmi2_type(spec) if spec or interpolation is None else Fmi2Type.real
+        return s.replace("[" + match + "]", "").rstrip(), type_, interpolation
+    return s, Fmi2Type.real, None
+
+
+def parse_value(type_: Fmi2Type, s: str) -> Any:
+    if type_ == Fmi2Type.integer:
+        return int(s)
+    elif type_ == Fmi2Type.real:
+        return float(s)
+    elif type_ == Fmi2Type.boolean:
+        return s == "true"
+    return s.encode("utf-8")
+
+
+def flush_array(values: array, spilled: IO[bytes]):
+    """Append the values to a spilled array and clear them."""
+    if sys.byteorder != "little":
+        values.byteswap()
+    values.tofile(spilled)
+    del values[:]
+
+
+def read_array(spilled: IO[bytes], typecode: str) -> Iterator[Any]:
+    """Values of a spilled array, read back in chunks."""
+    spilled.seek(0)
+    while True:
+        values = array(typecode)
+        try:
+            values.fromfile(spilled, CHUNK_ROWS)
+        except EOFError:
+            pass
+        if sys.byteorder != "little":
+            values.byteswap()
+        yield from values
+        if len(values) < CHUNK_ROWS:
+            return
+
+
+def pchip_slope(h0: Optional[float], d0: Optional[float], h1: Optional[float], d1: Optional[float]) -> float:
+    """Slope at a point of a monotone cubic Hermite interpolation (Fritsch-Carlson, as PCHIP).
+
+    Args:
+        h0 (float): Length of the interval before the point, None at the start or after an event
+        d0 (float): Mean slope of the interval before the point
+        h1 (float): Length of the interval after the point, None at the end or before an event
+        d1 (float): Mean slope of the interval after the point
     """
+    if d0 is None and d1 is None:
+        return 0.0
+    if d0 is None or d1 is None:
+        return d1 if d0 is None else d0
+    if d0 * d1 <= 0:
+        return 0.0
+    w0, w1 = 2 * h1 + h0, h1 + 2 * h0
+    return (w0 + w1) / (w0 / d0 + w1 / d1)
+
+
+def hermite(t0: float, v0: float, m0: float, t1: float, v1: float, m1: float) -> Tuple[float, float, float, float]:
+    h = t1 - t0
+    if h <= 0:
+        return v0, 0.0, 0.0, 0.0
+    d = (v1 - v0) / h
+    return v0, m0, (3 * d - 2 * m0 - m1) / h, (m0 + m1 - 2 * d) / (h * h)
+
+
+def cubic_coefficients(times: Iterable[float], values: Iterable[float]) -> Iterator[Tuple[float, float, float, float]]:
+    """Coefficients (c0, c1, c2, c3) of the monotone cubic Hermite interpolation on each interval.
+
+    On the interval starting at row i, the value at time t is `c0 + s*(c1 + s*(c2 + s*c3))` with
+    `s = t - times[i]`. Rows sharing their time mark an event: the value steps there, and the
+    slopes on each side only use that side. The coefficients of the last row hold its value.
+
+    Args:
+        times (Iterable[float]): Time of each row, non-decreasing
+        values (Iterable[float]): Value of each row
+
+    Returns:
+        Iterator[Tuple[float, float, float, float]]: Coefficients of each row
+    """
+    # Rows with their interval to the next one (length, mean slope or None if empty)
+    points = list()
+    h0 = d0 = None
+    for t1, v1 in zip(times, values):
+        if points:
+            t0, v0 = points[-1][:2]
+            h = t1 - t0
+            d = (v1 - v0) / h if h > 0 else None
+            points[-1] = (t0, v0, pchip_slope(h0, d0, h, d))
+            h0, d0 = (h, d) if d is not None else (None, None)
+            if len(points) == 2:
+                yield hermite(*points[0], *points[1])
+                del points[0]
+        points.append((t1, v1, None))
+    if points:
+        t0, v0 = points[-1][:2]
+        points[-1] = (t0, v0, pchip_slope(h0, d0, None, None))
+        if len(points) == 2:
+            yield hermite(*points[0], *points[1])
+        yield v0, 0.0, 0.0, 0.0
+
+
+def write_columns(csv_file: FilePath, dest: FilePath, interpolation: str = "linear") -> Path:
+    """Convert a CSV file into the columnar file played back by `csvslave.CsvSlave`.
+
+    The first column holds the time, the header of the other ones may give their type and, for
+    Real columns, their interpolation (`name [TYPE INTERPOLATION]`, e.g. `mode [hold]`). The CSV
+    file is read once, in chunks of rows, so converting it needs little memory whatever its size.
+
+    Args:
+        csv_file (FilePath): The CSV file
+        dest (FilePath): The columnar file to write
+        interpolation (str): Optional interpolation of the Real columns not setting theirs, linear by default
+
+    Returns:
+        pathlib.Path: The columnar file
+    """
+    csv_file, dest = Path(csv_file), Path(dest)
+    with open(csv_file, newline="") as f, ExitStack() as stack:
+        reader = csv.reader(f, skipinitialspace=True, delimiter=",", quotechar='"')
+        header_row = next(reader)
+        headers = list(map(lambda h: parse_header(h.strip()), header_row[1:]))
+        interpolations = list()
+        for name, type_, column_interpolation in headers:
+            if type_ != Fmi2Type.real and column_interpolation not in (None, "hold"):
+                raise ValueError(f"Column {name} of type {type_.name} can not be interpolated")
+            if type_ == Fmi2Type.real:
+                column_interpolation = column_interpolation or interpolation
+            interpolations.append(column_interpolation or "hold")
+        headers = [(name, type_) for name, type_, _ in headers]
+
+        # Each array is spilled to its own temporary file, then copied after the header
+        def spill():
+            return stack.enter_context(tempfile.TemporaryFile())
+
+        times = (array("d"), spill())
+        columns = [(array(TYPECODES[type_]), spill()) for _, type_ in headers]
+        strings = {j: (bytearray(), spill()) for j, (_, type_) in enumerate(headers) if type_ == Fmi2Type.string}
+        string_sizes = dict.fromkeys(strings, 0)
+        for j in strings:
+            columns[j][0].append(0)
+
+        def flush():
+            for values, spilled in itertools.chain([times], columns):
+                flush_array(values, spilled)
+            for data, spilled in strings.values():
+                spilled.write(data)
+                del data[:]
+
+        rows = 0
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(headers) + 1:
+                raise ValueError(f"Row {rows + 1} of {csv_file!s} has {len(row)} values, expected {len(headers) + 1}")
+            times[0].append(float(row[0]))
+            for j, (_, type_) in enumerate(headers):
+                value = parse_value(type_, row[j + 1])
+                if type_ == Fmi2Type.string:
+                    strings[j][0].extend(value)
+                    string_sizes[j] += len(value)
+                    value = string_sizes[j]
+                columns[j][0].append(value)
+            rows += 1
+            if rows % CHUNK_ROWS == 0:
+                flush()
+        flush()
+
+        coefficients = dict()
+        for j, column_interpolation in enumerate(interpolations):
+            if column_interpolation == "cubic":
+                coefficients[j] = spill()
+                values = array("d")
+                for c in cubic_coefficients(read_array(times[1], "d"), read_array(columns[j][1], "d")):
+                    values.extend(c)
+                    if len(values) >= 4 * CHUNK_ROWS:
+                        flush_array(values, coefficients[j])
+                flush_array(values, coefficients[j])
+
+        # Layout of the arrays after the header
+        sections = list()
+        offset = 0
+
+        def section(spilled):
+            nonlocal offset
+            sections.append((offset, spilled))
+            start = offset
+            offset = aligned(offset + spilled.seek(0, os.SEEK_END))
+            return start
+
+        header = {"rows": rows, "time": {"offset": section(times[1])}, "columns": list()}
+        for j, (name, type_) in enumerate(headers):
+            entry = {"name": name, "type": type_.name, "offset": section(columns[j][1])}
+            if type_ == Fmi2Type.string:
+                entry["size"] = string_sizes[j]
+                entry["data"] = section(strings[j][1])
+            if type_ == Fmi2Type.real:
+                entry["interpolation"] = interpolations[j]
+            if j in coefficients:
+                entry["coefficients"] = section(coefficients[j])
+            header["columns"].append(entry)
+
+        encoded_header = json.dumps(header).encode("utf-8")
+        with open(dest, "wb") as out:
+            out.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded_header)))
+            out.write(encoded_header)
+            base = aligned(out.tell())
+            for start, spilled in sections:
+                out.write(bytes(base + start - out.tell()))
+                spilled.seek(0)
+                shutil.copyfileobj(spilled, out)
+    return dest
+
+
+def create_csv_slave(csv_file: FilePath, data_file: FilePath, chunk_rows: int = 0):
+    classname = csv_file.stem.capitalize()
+    return f"""
+from pythonfmu.csvslave import CsvSlave
+
+
+class {classname}(CsvSlave):
+
+    data_file = "{Path(data_file).name}"
+    chunk_rows = {chunk_rows}
+"""
 
 
 class CsvFmuBuilder:
@@ -169,24 +280,77 @@ class CsvFmuBuilder:
     def build_FMU(
         csv_file: FilePath,
         dest: FilePath = ".",
+        chunk_rows: int = 0,
+        interpolation: str = "linear",
         **options,
     ) -> Path:
+        """Build an FMU playing back a CSV file.
+
+        Args:
+            csv_file (FilePath): The CSV file, its first column holds the time
+            dest (FilePath): Optional destination, the current folder by default
+            chunk_rows (int): Optional number of rows per chunk to stream the data (see `CsvSlave.chunk_rows`),
+                by default the whole data is memory-mapped
+            interpolation (str): Optional interpolation of the Real columns not setting theirs in the header,
+                among `csvslave.INTERPOLATIONS` (linear by default)
+            **options: Other options of `FmuBuilder.build_FMU`
+
+        Returns:
+            pathlib.Path: The FMU
+        """
         csv_file = Path(csv_file)
         if not csv_file.exists():
             raise ValueError(f"No such file {csv_file!s}")
         if not csv_file.suffix.endswith(".csv"):
             raise ValueError(f"File {csv_file!s} must have extension '.csv'!")
-
-        options["dest"] = dest
-        options["project_files"] = {csv_file}
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unsupported interpolation '{interpolation}', expected one of {', '.join(INTERPOLATIONS)}")
+        if chunk_rows < 0:
+            raise ValueError(f"The number of rows per chunk must be positive, got {chunk_rows}")
+
+        dest, dest_file = split_destination(dest)
+        options["dest"] = dest if dest_file == "" else dest_file
+
+        # Keyed on the CSV file rather than on its conversion, so that cached FMUs are not converted again
+        cache = cache_key = None
+        cache_dir = options.pop("cache_dir", None)
+        if cache_dir is not None:
+            cache = BuildCache(cache_dir)
+            documentation_folder = options.get("documentation_folder")
+            cache_key = cache.key(
+                itertools.chain(
+                    [csv_file],
+                    [] if documentation_folder is None else [documentation_folder],
+                    runtime_files(),
+                ),
+                version=__version__,
+                dest_name=dest_file.name if dest_file != "" else "",
+                chunk_rows=chunk_rows,
+                interpolation=interpolation,
+                precompile=sys.implementation.cache_tag if options.get("precompile") else None,
+                compression=parse_compression(options.get("compression")),
+                options=sorted(
+                    (name, value) for name, value in options.items()
+                    if name not in ("dest", "documentation_folder", "precompile", "compression")
+                ),
+            )
+            cached = copy_cached(cache, cache_key, dest, dest_file)
+            if cached is not None:
+                return cached
 
         with tempfile.TemporaryDirectory(prefix="pythonfmu_") as tempd:
             temp_dir = Path(tempd)
+            data_file = write_columns(csv_file, temp_dir / (csv_file.stem + ".columns"), interpolation)
+            # The CSV file is still shipped along its conversion, as by the FMUs reading it at runtime
+            options["project_files"] = {csv_file, data_file}
             script_file = temp_dir / (csv_file.stem + ".py")
             with open(script_file, "+w") as f:
-                f.write(create_csv_slave(csv_file))
+                f.write(create_csv_slave(csv_file, data_file, chunk_rows))
             options["script_file"] = script_file
-            return FmuBuilder.build_FMU(**options)
+            fmu = FmuBuilder.build_FMU(**options)
+        if cache is not None:
+            cache.put(cache_key, fmu)
+        return fmu
 
 
 def create_command_parser(parser: argparse.ArgumentParser):
@@ -203,6 +367,22 @@ def create_command_parser(parser: argparse.ArgumentParser):
         "-d", "--dest", dest="dest", help="Where to save the FMU.", default="."
     )
 
+    parser.add_argument(
+        "--interpolation",
+        dest="interpolation",
+        choices=INTERPOLATIONS,
+        help="Interpolation of the Real columns not setting theirs in the header (default: linear).",
+        default="linear"
+    )
+
+    parser.add_argument(
+        "--chunk-rows",
+        dest="chunk_rows",
+        type=int,
+        help="Stream the data by chunks of this number of rows, with the next chunk loaded in the background.",
+        default=0
+    )
+
     parser.add_argument(
         "--doc",
         dest="documentation_folder",
@@ -219,4 +399,29 @@ def create_command_parser(parser: argparse.ArgumentParser):
             action=action
         )
 
+    parser.add_argument(
+        "--precompile",
+        dest="precompile",
+        help="If given, add the bytecode of the Python sources for the running interpreter version.",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--cache",
+        dest="cache_dir",
+        help="Build cache folder, unchanged FMUs are copied from it instead of built.",
+        default=None
+    )
+
+    parser.add_argument(
+        "--compress",
+        dest="compression",
+        metavar="PATTERN=METHOD",
+        type=parse_compression_argument,
+        action="append",
+        help="Compression of the FMU entries matching PATTERN: 'stored' or 'deflated', optionally followed by "
+             "':level' (e.g. '*.csv=deflated'). The first matching pattern applies, entries are stored by default.",
+        default=None
+    )
+
     parser.set_defaults(execute=CsvFmuBuilder.build_FMU)
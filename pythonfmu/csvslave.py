@@ -0,0 +1,348 @@
+"""Playback of the CSV files converted by `pythonfmu buildcsv`.
+
+At build time the CSV file is converted into a columnar binary file (see `csvbuilder.write_columns`):
+a preamble, a JSON header describing the columns, then each column as a contiguous little-endian
+array. The slave memory-maps it, so instantiating it does not depend on the size of the data and
+the instances of a model share the data pages through the OS.
+
+For files larger than memory, the slave may stream the data instead (`CsvSlave.chunk_rows`): a
+background thread loads the chunk of rows following the current one, and the chunks left behind
+are released, so only a window of rows around the simulation time stays in memory.
+"""
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import Any, ClassVar, Iterator, List, Optional, Tuple, Union
+
+from .enums import Fmi2Causality, Fmi2Type, Fmi2Variability
+from .fmi2slave import Fmi2Slave
+from .variables import Boolean, Integer, Real, String
+
+# Magic bytes, format version and header size
+PREAMBLE = struct.Struct("<8sII")
+MAGIC = b"PFMUCSV\0"
+FORMAT_VERSION = 1
+# Alignment of the header end and of the arrays in the file
+ALIGNMENT = 8
+# Size of the reads loading the pages of a chunk of rows
+READ_SIZE = 1 << 20
+# Interval (s) at which an idle prefetch thread checks if the interpreter is shutting down
+PREFETCH_POLL = 0.5
+
+# Array type code of the values of each column type, string columns hold the offsets of their values
+TYPECODES = {
+    Fmi2Type.real: "d",
+    Fmi2Type.integer: "i",
+    Fmi2Type.boolean: "B",
+    Fmi2Type.string: "Q",
+}
+
+# Interpolations of the Real columns between the rows: zero-order hold, linear and monotone cubic
+# Hermite, whose coefficients are computed at build time (see `csvbuilder.cubic_coefficients`)
+INTERPOLATIONS = ("hold", "linear", "cubic")
+
+TYPE2OBJ = {
+    Fmi2Type.integer: Integer,
+    Fmi2Type.real: Real,
+    Fmi2Type.boolean: Boolean,
+    Fmi2Type.string: String
+}
+
+Column = namedtuple("Column", ["name", "type", "values", "interpolation", "coefficients"], defaults=["hold", None])
+
+
+def aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def lerp(v0: float, v1: float, t: float) -> float:
+    return (1 - t) * v0 + t * v1
+
+
+def normalize(x: float, in_min: float, in_max: float, out_min: float, out_max: float) -> float:
+    x = max(min(x, in_max), in_min)
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+
+class StringColumn:
+    """Strings of a column, decoded from the UTF-8 data of the file on access."""
+
+    def __init__(self, offsets, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+class CsvData:
+    """Memory-mapped columnar CSV data.
+
+    Args:
+        path (str): The columnar file
+    """
+
+    def __init__(self, path: str):
+        import json
+
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size = PREAMBLE.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a CSV data file of version {FORMAT_VERSION}")
+        header = json.loads(self._map[PREAMBLE.size:PREAMBLE.size + header_size].decode("utf-8"))
+
+        self._view = memoryview(self._map)
+        self._base = aligned(PREAMBLE.size + header_size)
+        self.rows: int = header["rows"]
+        self.times = self._array(header["time"]["offset"], "d", self.rows)
+        self.columns: List[Column] = list()
+        # (offset, item size) of the arrays, and (offsets, data offset) of the strings
+        self._arrays = [(header["time"]["offset"], 8)]
+        self._strings = list()
+        for entry in header["columns"]:
+            type_ = Fmi2Type[entry["type"]]
+            if type_ is Fmi2Type.string:
+                offsets = self._array(entry["offset"], "Q", self.rows + 1)
+                start = self._base + entry["data"]
+                values = StringColumn(offsets, self._view[start:start + entry["size"]])
+                self._strings.append((offsets, entry["data"]))
+            else:
+                values = self._array(entry["offset"], TYPECODES[type_], self.rows)
+            self._arrays.append((entry["offset"], struct.calcsize(TYPECODES[type_])))
+            coefficients = None
+            if "coefficients" in entry:
+                coefficients = self._array(entry["coefficients"], "d", 4 * self.rows)
+                self._arrays.append((entry["coefficients"], 32))
+            interpolation = entry.get("interpolation", "linear" if type_ is Fmi2Type.real else "hold")
+            self.columns.append(Column(entry["name"], type_, values, interpolation, coefficients))
+
+    def _array(self, offset: int, typecode: str, count: int) -> Union[memoryview, array]:
+        start = self._base + offset
+        values = self._view[start:start + count * struct.calcsize(typecode)].cast(typecode)
+        if sys.byteorder != "little":
+            values = array(typecode, values)
+            values.byteswap()
+        return values
+
+    def _ranges(self, first: int, last: int) -> Iterator[Tuple[int, int]]:
+        """(start, end) positions in the file of the values of the rows [first, last)."""
+        first, last = max(first, 0), min(last, self.rows)
+        if first >= last:
+            return
+        for offset, size in self._arrays:
+            yield self._base + offset + first * size, self._base + offset + last * size
+        for offsets, data in self._strings:
+            yield self._base + data + offsets[first], self._base + data + offsets[last]
+
+    def load(self, first: int, last: int):
+        """Load the pages holding the rows [first, last) by reading them from the file.
+
+        The reads release the GIL, so calling this from another thread does not block the
+        slave while the data comes from the disk.
+        """
+        ranges = list(self._ranges(first, last))
+        if hasattr(self._map, "madvise"):
+            for start, end in ranges:
+                aligned_start = start - start % mmap.PAGESIZE
+                self._map.madvise(mmap.MADV_WILLNEED, aligned_start, end - aligned_start)
+        buffer = bytearray(READ_SIZE)
+        with open(self.path, "rb", buffering=0) as f:
+            for start, end in ranges:
+                f.seek(start)
+                while start < end:
+                    read = f.readinto(memoryview(buffer)[:min(READ_SIZE, end - start)])
+                    if not read:
+                        break
+                    start += read
+
+    def release(self, first: int, last: int):
+        """Release the memory of the pages only holding rows in [first, last), where supported."""
+        if not hasattr(self._map, "madvise") or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        for start, end in self._ranges(first, last):
+            start = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE
+            end -= end % mmap.PAGESIZE
+            if start < end:
+                self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+class Prefetcher:
+    """Background thread loading chunks of rows of a `CsvData` (see `CsvData.load`).
+
+    The thread is not a daemon, sub-interpreters do not allow them. It ends when stopped, or when
+    the main thread of the interpreter is done, since the interpreter waits for it before running
+    the finalizers stopping it.
+    """
+
+    def __init__(self, data: CsvData):
+        self._requests: "queue.Queue[Optional[Tuple[int, int]]]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, args=(data, self._requests), name="pythonfmu-csv-prefetch"
+        )
+        self._thread.start()
+
+    def request(self, first: int, last: int):
+        """Load the rows [first, last) in the background."""
+        self._requests.put((first, last))
+
+    def stop(self):
+        """Stop the thread once the pending requests are done."""
+        self._requests.put(None)
+
+    def join(self):
+        self._thread.join()
+
+    @staticmethod
+    def _run(data: CsvData, requests: "queue.Queue[Optional[Tuple[int, int]]]"):
+        main = threading.main_thread()
+        while True:
+            try:
+                request = requests.get(timeout=PREFETCH_POLL)
+            except queue.Empty:
+                if not main.is_alive():
+                    return
+                continue
+            if request is None:
+                return
+            data.load(*request)
+
+
+class CsvSlave(Fmi2Slave):
+    """Slave playing back the columns of a CSV file converted at build time.
+
+    Each column is an output. While the `interpolate` parameter is set, the Real columns are
+    interpolated between the rows as chosen at build time (see `INTERPOLATIONS`), otherwise all the
+    columns hold the value of the last row. The rows around the current time are found by bisection, so
+    steps of any size and jumps back in time cost the same.
+    """
+
+    # Name of the columnar file in the resources folder
+    data_file: ClassVar[str] = ""
+    # Rows per chunk when streaming the data, 0 leaves the paging of the whole file to the OS
+    chunk_rows: ClassVar[int] = 0
+    # All the variables are registered by the constructor
+    compiled_accessors = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.current_index = 0
+        self.next_index = None
+        self.current_time = 0.0
+        self._step_size = 0.0
+        self._interpolate = True
+        self._values: Optional[List[Any]] = None
+
+        self.data = CsvData(os.path.join(self.resources, self.data_file))
+        self.num_rows = self.data.rows
+        self.times = self.data.times
+        self._linear_columns = [i for i, column in enumerate(self.data.columns) if column.interpolation == "linear"]
+        self._cubic_columns = [i for i, column in enumerate(self.data.columns) if column.interpolation == "cubic"]
+        self._chunk: Optional[int] = None
+        self._prefetcher: Optional[Prefetcher] = None
+        if self.chunk_rows > 0:
+            self._prefetcher = Prefetcher(self.data)
+            weakref.finalize(self, self._prefetcher.stop)
+
+        for i, column in enumerate(self.data.columns):
+            self.register_variable(
+                TYPE2OBJ[column.type](column.name,
+                                      causality=Fmi2Causality.output,
+                                      variability=Fmi2Variability.constant,
+                                      getter=lambda i=i: self.values()[i]), nested=False)
+
+        self.register_variable(Integer("num_rows",
+                                       causality=Fmi2Causality.output,
+                                       variability=Fmi2Variability.constant))
+        self.register_variable(Real("end_time",
+                                    causality=Fmi2Causality.output,
+                                    variability=Fmi2Variability.constant,
+                                    getter=lambda: self.times[-1]))
+        self.register_variable(Boolean("interpolate",
+                                       causality=Fmi2Causality.parameter,
+                                       variability=Fmi2Variability.tunable))
+
+    @property
+    def interpolate(self) -> bool:
+        return self._interpolate
+
+    @interpolate.setter
+    def interpolate(self, value: bool):
+        # The rows and values at the current time depend on the interpolation
+        self._interpolate = value
+        self.find_indices(self.current_time, self._step_size)
+
+    def values(self) -> List[Any]:
+        """Values of all the columns at the current time, computed once per step."""
+        if self._values is None:
+            i, j = self.current_index, self.next_index
+            columns = self.data.columns
+            self._values = [column.values[i] for column in columns]
+            if j is not None and self.times[j] != self.times[i]:
+                t = normalize(self.current_time, self.times[i], self.times[j], 0, 1)
+                for k in self._linear_columns:
+                    v0, v1 = self._values[k], columns[k].values[j]
+                    if v0 != v1:
+                        self._values[k] = lerp(v0, v1, t)
+            if self.interpolate and self._cubic_columns:
+                s = max(self.current_time - self.times[i], 0.0)
+                for k in self._cubic_columns:
+                    c = columns[k].coefficients
+                    n = 4 * i
+                    self._values[k] = c[n] + s * (c[n + 1] + s * (c[n + 2] + s * c[n + 3]))
+        return self._values
+
+    def find_indices(self, t, dt):
+        # Last row at or before t, the rows within a relative tolerance of t are reached
+        self.current_index = max(bisect_right(self.times, t + abs(t) * 1e-6) - 1, 0)
+        self.next_index = None
+        self._step_size = dt
+        if self.interpolate and self.current_index <= self.num_rows-2:
+            # First row after t + dt, the rows within an absolute tolerance of it are after
+            self.next_index = min(bisect_left(self.times, t + dt - 1e-6, self.current_index + 1), self.num_rows-1)
+        self._values = None
+        if self._prefetcher is not None:
+            self._stream(self.current_index // self.chunk_rows)
+
+    def _stream(self, chunk: int):
+        """Move the window of loaded rows to a chunk and its neighbours."""
+        if chunk == self._chunk:
+            return
+        size = self.chunk_rows
+        if self._chunk is not None:
+            for previous in range(max(self._chunk - 1, 0), self._chunk + 2):
+                if abs(previous - chunk) > 1:
+                    self.data.release(previous * size, (previous + 1) * size)
+        if self._chunk is None or abs(chunk - self._chunk) > 1:
+            self._prefetcher.request(chunk * size, (chunk + 1) * size)
+        self._prefetcher.request((chunk + 1) * size, (chunk + 2) * size)
+        self._chunk = chunk
+
+    def terminate(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher.join()
+            self._prefetcher = None
+
+    def setup_experiment(self, start_time: float, stop_time, tolerance):
+        self.current_time = start_time
+        self.find_indices(start_time, 0)
+
+    def do_step(self, current_time: float, step_size: float) -> bool:
+        if (self.current_index == self.num_rows):
+            return False
+        self.current_time = current_time + step_size
+        self.find_indices(self.current_time, step_size)
+        return True
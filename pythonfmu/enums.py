@@ -32,6 +32,14 @@ class Fmi2Variability(Enum):
     continuous = 4
 
 
+class Fmi2DependencyKind(Enum):
+    dependent = 0
+    constant = 1
+    fixed = 2
+    tunable = 3
+    discrete = 4
+
+
 class Fmi2Status(IntEnum):
     ok = 0
     warning = 1
@@ -1,19 +1,27 @@
-"""Define the abstract facade class."""
-import json
-import datetime
+"""Define the abstract facade class.
+
+Only the modules needed to run a slave are imported here, the ones generating the model description
+(`datetime`, `uuid`, `xml`) are imported when building the FMU.
+"""
 from abc import ABC, abstractmethod
+from bisect import bisect_right
 from collections import OrderedDict, namedtuple
-from pathlib import Path
-from typing import Any, ClassVar, Dict, List, Optional
-from uuid import uuid1
-from xml.etree.ElementTree import Element, SubElement
+from functools import partial
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, ClassVar, Dict, Iterable, List, Optional, Sequence, Tuple, Type
 
-from .logmsg import LogMsg
+from .fmustate import MAX_SNAPSHOT_DEPTH, FmuStateSnapshot, JsonEncoder, changed_entries, decode_state, encode_state
+from .logmsg import LogMsg, pack_log_messages
 from .default_experiment import DefaultExperiment
 from ._version import __version__ as VERSION
-from .enums import Fmi2Type, Fmi2Status, Fmi2Causality, Fmi2Initial, Fmi2Variability
+from .enums import Fmi2Type, Fmi2Status, Fmi2Causality, Fmi2DependencyKind, Fmi2Initial, Fmi2Variability
+from .modelstructure import INITIAL_DEPENDENCY_KINDS, AccessTracer, Dependencies, initial_of, unknown_attrib
+from .storage import ArrayBinding, StateArrays
 from .variables import Boolean, Integer, Real, ScalarVariable, String
 
+if TYPE_CHECKING:
+    from uuid import UUID
+    from xml.etree.ElementTree import Element
+
 ModelOptions = namedtuple("ModelOptions", ["name", "value", "cli"])
 
 FMI2_MODEL_OPTIONS: List[ModelOptions] = [
@@ -25,6 +33,26 @@ FMI2_MODEL_OPTIONS: List[ModelOptions] = [
     ModelOptions("canSerializeFMUstate", False, "serialize-state")
 ]
 
+FMI2_TYPES = (Integer, Real, Boolean, String)
+
+# State entry holding the copy of the state arrays
+STATE_ARRAYS_KEY = "__state_arrays__"
+
+AccessorTables = Dict[type, Tuple[Dict[int, Callable[[], Any]], Dict[int, Callable[[Any], None]]]]
+
+# Variable classes written by `Fmi2Slave.write_xml` from their attributes, others through their `to_xml`
+BUILTIN_TO_XML = frozenset(var_type.to_xml for var_type in FMI2_TYPES)
+
+# Characters escaped in the XML attribute values, besides &, < and >, as by `xml.etree.ElementTree`
+XML_ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"}
+
+
+def xml_attributes(attrib: Dict[str, str]) -> str:
+    """XML attributes of a node, each preceded by a space."""
+    from xml.sax.saxutils import escape
+
+    return "".join(f' {key}="{escape(str(value), XML_ATTRIBUTE_ENTITIES)}"' for key, value in attrib.items())
+
 
 class Fmi2Slave(ABC):
     """Abstract facade class to execute Python through FMI standard."""
@@ -38,14 +66,38 @@ class Fmi2Slave(ABC):
         "logAll": "Log all messages."
     }
 
+    # Freeze the variable registry into accessor tables on first get/set (see `compile_accessors`)
+    compiled_accessors: ClassVar[bool] = False
+    # Store Real, Integer and Boolean variables in contiguous typed arrays (see `StateArrays`)
+    array_storage: ClassVar[bool] = False
+    # Only record the variables changed since the previous FMU state snapshot
+    incremental_snapshots: ClassVar[bool] = False
+    # Encoder (object with dumps/loads) for the state values without a native binary encoding. Setting `pickle`
+    # serializes any picklable value, but fmi2DeSerializeFMUstate may then run code hidden in the state bytes
+    state_encoder: ClassVar[Any] = JsonEncoder
+
     def __init__(self, **kwargs):
         self.vars = OrderedDict()
+        self._accessors: Optional[AccessorTables] = None
+        self.state_arrays: Optional[StateArrays] = StateArrays() if self.array_storage else None
+        self._vars_by_name: Optional[Dict[str, ScalarVariable]] = None
+        # Blocks of variables registered by `register_array`, by increasing value references
+        self._array_bindings: List[ArrayBinding] = list()
+        self._array_starts: List[int] = list()
+        # Dependencies of the unknowns of the ModelStructure by value reference (see `declare_dependencies`)
+        self._dependencies: Dict[int, Dependencies] = dict()
+        self._initial_dependencies: Dict[int, Dependencies] = dict()
+        self._last_snapshot: Optional[FmuStateSnapshot] = None
+        self._last_snapshot_values: Dict[str, Any] = dict()
         self.instance_name = kwargs["instance_name"]
         self.resources = kwargs.get("resources", None)
         self.visible = kwargs.get("visible", False)
         self.log_queue = []
+        # Debug logging state set through fmi2SetDebugLogging, messages filtered out are dropped by `log`
+        self.debug_logging: bool = True
+        self.debug_logging_categories: Tuple[str, ...] = tuple()
 
-        self.guid = uuid1()
+        self._guid: Optional["UUID"] = None
         self.author: Optional[str] = None
         self.license: Optional[str] = None
         self.version: Optional[str] = None
@@ -54,15 +106,22 @@ class Fmi2Slave(ABC):
         self.description: Optional[str] = None
         self.default_experiment: Optional[DefaultExperiment] = None
 
-    def to_xml(self, model_options: Dict[str, str] = dict()) -> Element:
-        """Build the XML representation of the model.
-        
-        Args:
-            model_options (Dict[str, str]) : FMU model options
-        
-        Returns:
-            (xml.etree.TreeElement.Element) XML description of the FMU
-        """
+    @property
+    def guid(self) -> "UUID":
+        """Unique identifier of the model description, generated on first use."""
+        if self._guid is None:
+            from uuid import uuid1
+
+            self._guid = uuid1()
+        return self._guid
+
+    @guid.setter
+    def guid(self, value: "UUID"):
+        self._guid = value
+
+    def _description_attributes(self, model_options: Dict[str, str]) -> Tuple[Dict[str, str], ...]:
+        """Attributes of the fmiModelDescription, CoSimulation and DefaultExperiment (None if unset) nodes."""
+        import datetime
 
         t = datetime.datetime.now(datetime.timezone.utc)
         date_str = t.isoformat(timespec="seconds")
@@ -81,8 +140,6 @@ class Fmi2Slave(ABC):
             if value is not None:
                 attrib[attr] = value
 
-        root = Element("fmiModelDescription", attrib)
-
         options = dict()
         for option in FMI2_MODEL_OPTIONS:
             value = model_options.get(option.name, option.value)
@@ -90,6 +147,228 @@ class Fmi2Slave(ABC):
         options["modelIdentifier"] = self.modelName
         options["canNotUseMemoryManagementFunctions"] = "true"
 
+        experiment = None
+        def_ex = getattr(self.__class__, "default_experiment", getattr(self, "default_experiment", None))
+        if def_ex is not None:
+            experiment = dict()
+            if def_ex.start_time is not None:
+                experiment["startTime"] = str(def_ex.start_time)
+            if def_ex.stop_time is not None:
+                experiment["stopTime"] = str(def_ex.stop_time)
+            if def_ex.step_size is not None:
+                experiment["stepSize"] = str(def_ex.step_size)
+            if def_ex.tolerance is not None:
+                experiment["tolerance"] = str(def_ex.tolerance)
+
+        return attrib, options, experiment
+
+    def _apply_start_values(self):
+        """Set the start attribute of the variables requiring one, getting the values in bulk by type."""
+        getters = {Integer: self.get_integer, Real: self.get_real, Boolean: self.get_boolean, String: self.get_string}
+        pending = dict((var_type, list()) for var_type in FMI2_TYPES)
+        for v in self.vars.values():
+            if ScalarVariable.requires_start(v):
+                for var_type in FMI2_TYPES:
+                    if isinstance(v, var_type):
+                        pending[var_type].append(v)
+                        break
+                else:
+                    raise Exception(f"Unsupported type {type(v).__name__} of variable {v.name}!")
+
+        for var_type, variables in pending.items():
+            if variables:
+                values = getters[var_type]([v.value_reference for v in variables])
+                for v, value in zip(variables, values):
+                    v.start = value
+
+    def _model_structure(self) -> List[Tuple[str, List[Dict[str, str]]]]:
+        """Attributes of the Unknown nodes of the ModelStructure, by section.
+
+        Returns:
+            List[Tuple[str, List[Dict[str, str]]]]: Tag of the non empty sections and attributes of their unknowns
+        """
+        states = self._states()
+        outputs = list()
+        derivatives = list()
+        initial_unknowns = list()
+        for v in self.vars.values():
+            vr = v.value_reference
+            if v.causality == Fmi2Causality.output:
+                outputs.append(unknown_attrib(vr + 1, self._dependencies.get(vr)))
+            if isinstance(v, Real) and v.derivative is not None:
+                derivatives.append(unknown_attrib(vr + 1, self._dependencies.get(vr)))
+            if self._is_initial_unknown(v, states):
+                initial_unknowns.append(unknown_attrib(vr + 1, self._initial_dependencies.get(vr)))
+        sections = [("Outputs", outputs), ("Derivatives", derivatives), ("InitialUnknowns", initial_unknowns)]
+        return [(tag, unknowns) for tag, unknowns in sections if unknowns]
+
+    def _states(self) -> frozenset:
+        """Value references of the state variables, the ones with a declared derivative."""
+        return frozenset(
+            v.derivative for v in self.vars.values() if isinstance(v, Real) and v.derivative is not None
+        )
+
+    def _is_initial_unknown(self, v: ScalarVariable, states: frozenset) -> bool:
+        """Test if a variable is computed in initialization mode (InitialUnknowns of the ModelStructure)."""
+        if initial_of(v) not in (Fmi2Initial.approx, Fmi2Initial.calculated):
+            return False
+        return (
+            v.causality in (Fmi2Causality.output, Fmi2Causality.calculatedParameter)
+            or v.value_reference in states
+            or (isinstance(v, Real) and v.derivative is not None)
+        )
+
+    def _variable(self, name: str) -> ScalarVariable:
+        if self._vars_by_name is None:
+            self._vars_by_name = dict([(v.name, v) for v in self.vars.values()])
+        try:
+            return self._vars_by_name[name]
+        except KeyError:
+            raise ValueError(f"Unknown variable '{name}'") from None
+
+    def declare_dependencies(
+        self,
+        unknown: str,
+        dependencies: Iterable[str],
+        kinds: Optional[Iterable[Fmi2DependencyKind]] = None,
+        initial: bool = False
+    ):
+        """Declare the variables an output or a derivative depends on, written in the ModelStructure.
+
+        Without declaration, importers assume an unknown depends on all the inputs (and states). An empty
+        list of dependencies declares it does not depend on any of them, so importers may e.g. break
+        algebraic loops or step the FMU in parallel with the ones it feeds.
+
+        Args:
+            unknown (str): Name of the output or derivative (or of the initial unknown if `initial` is set)
+            dependencies (Iterable[str]): Names of the inputs or states (or, if `initial` is set, inputs and
+                variables with initial `exact`) the unknown depends on
+            kinds (Iterable[Fmi2DependencyKind]): Optional, kind of each dependency, all `dependent` by default
+            initial (bool): Optional, declare the dependencies in initialization mode (InitialUnknowns) instead
+        """
+        var = self._variable(unknown)
+        references = [self._variable(name).value_reference for name in dependencies]
+        kinds = None if kinds is None else list(kinds)
+        if kinds is not None and len(kinds) != len(references):
+            raise ValueError(f"{len(kinds)} dependency kinds given for the {len(references)} dependencies of '{unknown}'")
+
+        # The states are only needed for the initial unknowns and the dependencies other than inputs
+        if initial or any(self.vars[vr].causality != Fmi2Causality.input for vr in references):
+            states = self._states()
+        else:
+            states = frozenset()
+        if initial:
+            if not self._is_initial_unknown(var, states):
+                raise ValueError(f"'{unknown}' is not an initial unknown")
+            if kinds is not None and not INITIAL_DEPENDENCY_KINDS.issuperset(kinds):
+                raise ValueError(f"The initial unknown '{unknown}' may only have dependent or constant dependencies")
+        elif var.causality != Fmi2Causality.output and not (isinstance(var, Real) and var.derivative is not None):
+            raise ValueError(f"'{unknown}' is neither an output nor a derivative")
+
+        for vr in references:
+            v = self.vars[vr]
+            if v.causality == Fmi2Causality.input:
+                continue
+            if initial and initial_of(v) != Fmi2Initial.exact:
+                raise ValueError(f"'{unknown}' may only depend on inputs and variables with exact initial value, not on '{v.name}'")
+            if not initial and vr not in states:
+                raise ValueError(f"'{unknown}' may only depend on inputs and states, not on '{v.name}'")
+
+        entries = sorted(zip(references, kinds or references))
+        declared = Dependencies(
+            tuple(vr for vr, _ in entries), None if kinds is None else tuple(kind for _, kind in entries)
+        )
+        if initial:
+            self._initial_dependencies[var.value_reference] = declared
+        else:
+            self._dependencies[var.value_reference] = declared
+
+    def trace_dependencies(self, samples: Iterable[Tuple[float, float]]) -> Dict[str, List[str]]:
+        """Suggest the dependencies of the outputs from the attributes accessed by steps of `do_step`.
+
+        This is a heuristic, nothing is declared: check the result and pass it to `declare_dependencies`.
+        Each sample runs one step from the current state while recording the attributes of the slave
+        read and assigned, then the registered variables are restored (see `_get_fmu_state`) and the
+        attributes assigned during the step are set back. Objects changed in place (e.g. lists or arrays
+        not registered) and state held outside of the slave are not restored.
+
+        A step only shows the inputs read along the path it took, e.g. `self.y = self.u1 if t < 1 else
+        self.u2` reads `u1` alone at t=0, so the samples should cover the branches of the model. Every
+        output assigned in a sample is suggested to depend on all the inputs read in any sample and on
+        all the states. No output is suggested when no sample reads an input, nor the outputs not
+        assigned as attributes of the slave (e.g. nested or changed in place) or already declared.
+        Declaring too few dependencies is worse than declaring none, importers could miss an algebraic
+        loop.
+
+        Args:
+            samples (Iterable[Tuple[float, float]]): Time and step size of each traced step
+
+        Returns:
+            Dict[str, List[str]]: Names of the inputs and states each output may depend on
+        """
+        read = set()
+        written = set()
+        attributes = vars(self)
+        for current_time, step_size in samples:
+            saved = dict(attributes)
+            state = self._get_fmu_state()
+            tracer = AccessTracer(self)
+            try:
+                with tracer:
+                    self.do_step(current_time, step_size)
+            finally:
+                for name in tracer.written:
+                    if name in saved:
+                        attributes[name] = saved[name]
+                    else:
+                        attributes.pop(name, None)
+                self._set_fmu_state(state)
+                # The snapshot taken for the trace is not one of the importer
+                self._last_snapshot = saved["_last_snapshot"]
+                self._last_snapshot_values = saved["_last_snapshot_values"]
+            read |= tracer.read
+            written |= tracer.written
+
+        # Attribute of the slave holding each variable, None if it can not be traced
+        def root(v: ScalarVariable) -> Optional[str]:
+            binding = self._array_binding(v.value_reference)
+            name = binding.name if binding is not None else v.name
+            name = name.split(".")[0]
+            return name if hasattr(self, name) else None
+
+        inputs = [v.name for v in self.vars.values() if v.causality == Fmi2Causality.input and (
+            root(v) is None or root(v) in read or "state_arrays" in read
+        )]
+        traced = dict()
+        if not inputs:
+            # Not reading any input in the samples does not make the outputs independent of them
+            return traced
+        dependencies = inputs + [self.vars[vr].name for vr in sorted(self._states())]
+        for v in self.vars.values():
+            if (
+                v.causality == Fmi2Causality.output
+                and v.value_reference not in self._dependencies
+                and root(v) in written
+                and (v.name == root(v) or self._array_binding(v.value_reference) is not None)
+            ):
+                traced[v.name] = list(dependencies)
+        return traced
+
+    def to_xml(self, model_options: Dict[str, str] = dict()) -> "Element":
+        """Build the XML representation of the model.
+
+        See `write_xml` to write it without building a tree of the whole document.
+
+        Args:
+            model_options (Dict[str, str]) : FMU model options
+
+        Returns:
+            (xml.etree.TreeElement.Element) XML description of the FMU
+        """
+        from xml.etree.ElementTree import Element, SubElement
+
+        attrib, options, experiment = self._description_attributes(model_options)
+        root = Element("fmiModelDescription", attrib)
         SubElement(root, "CoSimulation", attrib=options)
 
         if len(self.log_categories) > 0:
@@ -102,65 +381,101 @@ class Fmi2Slave(ABC):
                     )
                 )
 
-        def_ex = getattr(self.__class__, "default_experiment", getattr(self, "default_experiment", None))
-        if def_ex is not None:
-            attrib = dict()
-            if def_ex.start_time is not None:
-                attrib["startTime"] = str(def_ex.start_time)
-            if def_ex.stop_time is not None:
-                attrib["stopTime"] = str(def_ex.stop_time)
-            if def_ex.step_size is not None:
-                attrib["stepSize"] = str(def_ex.step_size)
-            if def_ex.tolerance is not None:
-                attrib["tolerance"] = str(def_ex.tolerance)
-            SubElement(root, "DefaultExperiment", attrib)
+        if experiment is not None:
+            SubElement(root, "DefaultExperiment", experiment)
 
+        self._apply_start_values()
         variables = SubElement(root, "ModelVariables")
         for v in self.vars.values():
-            if ScalarVariable.requires_start(v):
-                self.__apply_start_value(v)
             variables.append(v.to_xml())
 
         structure = SubElement(root, "ModelStructure")
-        outputs = list(
-            filter(lambda v: v.causality == Fmi2Causality.output, self.vars.values())
-        )
-
-        if outputs:
-            outputs_node = SubElement(structure, "Outputs")
-            for i, v in enumerate(self.vars.values()):
-                if v.causality == Fmi2Causality.output:
-                    SubElement(outputs_node, "Unknown", attrib=dict(index=str(i + 1)))
+        for tag, unknowns in self._model_structure():
+            section = SubElement(structure, tag)
+            for unknown in unknowns:
+                SubElement(section, "Unknown", attrib=unknown)
 
         return root
 
-    def __apply_start_value(self, var: ScalarVariable):
-        vrs = [var.value_reference]
-
-        if isinstance(var, Integer):
-            refs = self.get_integer(vrs)
-        elif isinstance(var, Real):
-            refs = self.get_real(vrs)
-        elif isinstance(var, Boolean):
-            refs = self.get_boolean(vrs)
-        elif isinstance(var, String):
-            refs = self.get_string(vrs)
-        else:
-            raise Exception(f"Unsupported type!")
+    def write_xml(self, stream: BinaryIO, model_options: Dict[str, str] = dict()):
+        """Write the model description (modelDescription.xml) to a binary stream.
+
+        The document is written as it goes, without the tree `to_xml` builds, so describing
+        models with many variables takes little time and memory.
+
+        Args:
+            stream (BinaryIO): Output stream, e.g. a file opened in binary mode
+            model_options (Dict[str, str]) : FMU model options
+        """
+        from io import TextIOWrapper
+        from xml.etree.ElementTree import tostring
+
+        attrib, options, experiment = self._description_attributes(model_options)
+        self._apply_start_values()
+        structure = self._model_structure()
+        out = TextIOWrapper(stream, encoding="utf-8", newline="\n")
+        write = out.write
+        write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        write(f"<fmiModelDescription{xml_attributes(attrib)}>\n")
+        write(f"\t<CoSimulation{xml_attributes(options)}/>\n")
+        if len(self.log_categories) > 0:
+            write("\t<LogCategories>\n")
+            for category, description in self.log_categories.items():
+                write(f"\t\t<Category{xml_attributes(dict(name=category, description=description))}/>\n")
+            write("\t</LogCategories>\n")
+        if experiment is not None:
+            write(f"\t<DefaultExperiment{xml_attributes(experiment)}/>\n")
 
-        var.start = refs[0]
+        write("\t<ModelVariables>\n")
+        for v in self.vars.values():
+            if type(v).to_xml in BUILTIN_TO_XML:
+                write(
+                    f"\t\t<ScalarVariable{xml_attributes(v.xml_attrib())}>\n"
+                    f"\t\t\t<{v.xml_type}{xml_attributes(v.type_attrib())}/>\n"
+                    "\t\t</ScalarVariable>\n"
+                )
+            else:
+                # Variable class with its own XML representation
+                write(f"\t\t{tostring(v.to_xml(), encoding='unicode')}\n")
+        write("\t</ModelVariables>\n")
+
+        if structure:
+            write("\t<ModelStructure>\n")
+            for tag, unknowns in structure:
+                write(f"\t\t<{tag}>\n")
+                out.writelines(f"\t\t\t<Unknown{xml_attributes(unknown)}/>\n" for unknown in unknowns)
+                write(f"\t\t</{tag}>\n")
+            write("\t</ModelStructure>\n")
+        else:
+            write("\t<ModelStructure/>\n")
+        write("</fmiModelDescription>\n")
+        out.flush()
+        out.detach()
 
     def register_variable(self, var: ScalarVariable, nested: bool = True):
         """Register a variable as FMU interface.
         
+        In `array_storage` mode, Real, Integer and Boolean variables backed by a plain attribute
+        of the slave are moved into `state_arrays`; the attribute stays accessible as before.
+
         Args:
             var (ScalarVariable): The variable to be registered
             nested (bool): Optional, does the "." in the variable name reflect an object hierarchy to access it? Default True
         """
         variable_reference = len(self.vars)
         self.vars[variable_reference] = var
+        self._accessors = None
+        self._vars_by_name = None
         # Set the unique value reference
         var.value_reference = variable_reference
+        if (
+            self.state_arrays is not None
+            and var.getter is None
+            and var.setter is None
+            and "." not in var.name
+            and self.state_arrays.bind(self, var)
+        ):
+            return
         owner = self
         if var.getter is None and nested and "." in var.name:
             split = var.name.split(".")
@@ -172,6 +487,120 @@ class Fmi2Slave(ABC):
         if var.setter is None and hasattr(owner, var.local_name) and var.variability != Fmi2Variability.constant:
             var.setter = lambda v: setattr(owner, var.local_name, v)
 
+    def register_array(
+        self, name: str, var_type: Type[ScalarVariable] = Real, size: Optional[int] = None, **kwargs
+    ) -> range:
+        """Register the elements of a sequence attribute as a block of variables.
+
+        The elements are registered as variables named `name[i]` (from 0) with contiguous value
+        references. Getting or setting a run of them is a single slice of the sequence, e.g. a
+        list, an `array.array` or a NumPy array, instead of a call per element. The attribute
+        may be replaced by another sequence of the same length.
+
+        Args:
+            name (str): Name of the attribute, the "." reflect an object hierarchy to access it
+            var_type (type): Optional, type of the element variables (default Real)
+            size (int): Optional, number of elements, by default the length of the sequence
+            **kwargs: Other arguments of the element variables, e.g. causality
+
+        Returns:
+            range: Value references of the elements
+        """
+        owner = self
+        path = name.split(".")
+        for s in path[:-1]:
+            owner = getattr(owner, s)
+        if size is None:
+            size = len(getattr(owner, path[-1]))
+
+        start = len(self.vars)
+        settable = kwargs.get("variability") != Fmi2Variability.constant
+        binding = ArrayBinding(owner, path[-1], name, var_type, start, size, settable)
+        for i in range(size):
+            self.register_variable(
+                var_type(
+                    f"{name}[{i}]",
+                    getter=partial(binding.get_item, i),
+                    setter=partial(binding.set_item, i) if settable else None,
+                    **kwargs
+                ),
+                nested=False
+            )
+        self._array_bindings.append(binding)
+        self._array_starts.append(start)
+        return range(start, start + size)
+
+    def _array_binding(self, vr: int) -> Optional[ArrayBinding]:
+        i = bisect_right(self._array_starts, vr) - 1
+        if i >= 0 and vr < self._array_starts[i] + self._array_bindings[i].size:
+            return self._array_bindings[i]
+        return None
+
+    def _array_slice(self, vrs: Sequence[int], var_type: type) -> Optional[Tuple[ArrayBinding, int, int]]:
+        """Binding and element range of value references forming a run within a block, if so."""
+        if not vrs:
+            return None
+        binding = self._array_binding(vrs[0])
+        if binding is None or binding.var_type is not var_type:
+            return None
+        first = vrs[0] - binding.start
+        last = first + len(vrs)
+        if last > binding.size or (len(vrs) > 1 and list(vrs) != list(range(vrs[0], vrs[0] + len(vrs)))):
+            return None
+        return binding, first, last
+
+    def _get_array(self, vrs: Sequence[int], var_type: type) -> Optional[List[Any]]:
+        run = self._array_slice(vrs, var_type)
+        if run is None:
+            return None
+        binding, first, last = run
+        return binding.get(first, last)
+
+    def _set_array(self, vrs: Sequence[int], values: Sequence[Any], var_type: type) -> bool:
+        run = self._array_slice(vrs, var_type)
+        if run is None or not run[0].settable:
+            return False
+        binding, first, last = run
+        binding.set(first, last, values)
+        return True
+
+    def compile_accessors(self):
+        """Freeze the registered variables into per-type accessor tables.
+
+        The variable types are validated once here; the bulk getters and setters then
+        dispatch through value reference tables of prebuilt callables. Calling this enables
+        the `compiled_accessors` mode for the instance: the tables are rebuilt on demand
+        when another variable is registered, but getters and setters replaced on an
+        already registered variable are only picked up by calling this again.
+        """
+        self.compiled_accessors = True
+        accessors = dict((t, (dict(), dict())) for t in FMI2_TYPES)
+        for vr, var in self.vars.items():
+            for var_type in FMI2_TYPES:
+                if isinstance(var, var_type):
+                    getters, setters = accessors[var_type]
+                    getters[vr] = var.getter
+                    if var.setter is not None:
+                        setters[vr] = var.setter
+                    break
+        self._accessors = accessors
+
+    def _accessor_table(self, var_type: type, index: int) -> Optional[Dict[int, Callable]]:
+        if self._accessors is None:
+            if not self.compiled_accessors:
+                return None
+            self.compile_accessors()
+        return self._accessors[var_type][index]
+
+    def _check_accessors(self, table: Dict[int, Callable], vrs: List[int], var_type: type):
+        for vr in vrs:
+            if vr not in table:
+                if isinstance(self.vars.get(vr), var_type):
+                    raise TypeError(f"Variable with valueReference={vr} cannot be set!")
+                raise TypeError(
+                    f"Variable with valueReference={vr} is not of type {var_type.__name__}!"
+                )
+
     def setup_experiment(self, start_time: float, stop_time: Optional[float], tolerance: Optional[float]):
         pass
 
@@ -189,6 +618,18 @@ class Fmi2Slave(ABC):
         pass
 
     def get_integer(self, vrs: List[int]) -> List[int]:
+        if self._array_bindings:
+            values = self._get_array(vrs, Integer)
+            if values is not None:
+                return values
+        getters = self._accessor_table(Integer, 0)
+        if getters is not None:
+            try:
+                return [int(getters[vr]()) for vr in vrs]
+            except KeyError:
+                self._check_accessors(getters, vrs, Integer)
+                raise
+
         refs = list()
         for vr in vrs:
             var = self.vars[vr]
@@ -201,6 +642,18 @@ class Fmi2Slave(ABC):
         return refs
 
     def get_real(self, vrs: List[int]) -> List[float]:
+        if self._array_bindings:
+            values = self._get_array(vrs, Real)
+            if values is not None:
+                return values
+        getters = self._accessor_table(Real, 0)
+        if getters is not None:
+            try:
+                return [float(getters[vr]()) for vr in vrs]
+            except KeyError:
+                self._check_accessors(getters, vrs, Real)
+                raise
+
         refs = list()
         for vr in vrs:
             var = self.vars[vr]
@@ -213,6 +666,18 @@ class Fmi2Slave(ABC):
         return refs
 
     def get_boolean(self, vrs: List[int]) -> List[bool]:
+        if self._array_bindings:
+            values = self._get_array(vrs, Boolean)
+            if values is not None:
+                return values
+        getters = self._accessor_table(Boolean, 0)
+        if getters is not None:
+            try:
+                return [bool(getters[vr]()) for vr in vrs]
+            except KeyError:
+                self._check_accessors(getters, vrs, Boolean)
+                raise
+
         refs = list()
         for vr in vrs:
             var = self.vars[vr]
@@ -225,6 +690,18 @@ class Fmi2Slave(ABC):
         return refs
 
     def get_string(self, vrs: List[int]) -> List[str]:
+        if self._array_bindings:
+            values = self._get_array(vrs, String)
+            if values is not None:
+                return values
+        getters = self._accessor_table(String, 0)
+        if getters is not None:
+            try:
+                return [str(getters[vr]()) for vr in vrs]
+            except KeyError:
+                self._check_accessors(getters, vrs, String)
+                raise
+
         refs = list()
         for vr in vrs:
             var = self.vars[vr]
@@ -237,6 +714,18 @@ class Fmi2Slave(ABC):
         return refs
 
     def set_integer(self, vrs: List[int], values: List[int]):
+        if self._array_bindings and self._set_array(vrs, values, Integer):
+            return
+        setters = self._accessor_table(Integer, 1)
+        if setters is not None:
+            try:
+                for vr, value in zip(vrs, values):
+                    setters[vr](value)
+            except KeyError:
+                self._check_accessors(setters, vrs, Integer)
+                raise
+            return
+
         for vr, value in zip(vrs, values):
             var = self.vars[vr]
             if isinstance(var, Integer):
@@ -247,6 +736,18 @@ class Fmi2Slave(ABC):
                 )
 
     def set_real(self, vrs: List[int], values: List[float]):
+        if self._array_bindings and self._set_array(vrs, values, Real):
+            return
+        setters = self._accessor_table(Real, 1)
+        if setters is not None:
+            try:
+                for vr, value in zip(vrs, values):
+                    setters[vr](value)
+            except KeyError:
+                self._check_accessors(setters, vrs, Real)
+                raise
+            return
+
         for vr, value in zip(vrs, values):
             var = self.vars[vr]
             if isinstance(var, Real):
@@ -257,6 +758,18 @@ class Fmi2Slave(ABC):
                 )
 
     def set_boolean(self, vrs: List[int], values: List[bool]):
+        if self._array_bindings and self._set_array(vrs, values, Boolean):
+            return
+        setters = self._accessor_table(Boolean, 1)
+        if setters is not None:
+            try:
+                for vr, value in zip(vrs, values):
+                    setters[vr](value)
+            except KeyError:
+                self._check_accessors(setters, vrs, Boolean)
+                raise
+            return
+
         for vr, value in zip(vrs, values):
             var = self.vars[vr]
             if isinstance(var, Boolean):
@@ -267,6 +780,18 @@ class Fmi2Slave(ABC):
                 )
 
     def set_string(self, vrs: List[int], values: List[str]):
+        if self._array_bindings and self._set_array(vrs, values, String):
+            return
+        setters = self._accessor_table(String, 1)
+        if setters is not None:
+            try:
+                for vr, value in zip(vrs, values):
+                    setters[vr](value)
+            except KeyError:
+                self._check_accessors(setters, vrs, String)
+                raise
+            return
+
         for vr, value in zip(vrs, values):
             var = self.vars[vr]
             if isinstance(var, String):
@@ -276,33 +801,136 @@ class Fmi2Slave(ABC):
                     f"Variable with valueReference={vr} is not of type String!"
                 )
 
+    def get_real_buffer(self, vrs: memoryview, values: memoryview):
+        """Write the Real values of the given value references into a buffer.
+
+        Args:
+            vrs (memoryview): Value references, flat buffer of format "I"
+            values (memoryview): Writable output buffer of format "d", same length as vrs
+
+        Both buffers are the arrays of the FMI call, not copies, and only valid during the call.
+        Override this to fill outputs without boxing each value, e.g. through `numpy.frombuffer(values)`.
+        The default implementation delegates to `get_real`.
+        """
+        for i, value in enumerate(self.get_real(vrs.tolist())):
+            values[i] = value
+
+    def set_real_buffer(self, vrs: memoryview, values: memoryview):
+        """Read the Real values of the given value references from a buffer.
+
+        Args:
+            vrs (memoryview): Value references, flat buffer of format "I"
+            values (memoryview): Read-only input buffer of format "d", same length as vrs
+
+        See `get_real_buffer`. The default implementation delegates to `set_real`.
+        """
+        self.set_real(vrs.tolist(), values.tolist())
+
+    def _get_real_buffer(self, vrs: memoryview, values: memoryview):
+        self.get_real_buffer(memoryview(vrs).cast("I"), memoryview(values).cast("d"))
+
+    def _set_real_buffer(self, vrs: memoryview, values: memoryview):
+        self.set_real_buffer(memoryview(vrs).cast("I"), memoryview(values).cast("d"))
+
+    def _snapshot_values(self, into: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        state = dict() if into is None else into
+        arrays = self.state_arrays
+        bindings = self._array_bindings
+        for vr, var in self.vars.items():
+            if bindings and self._array_binding(vr) is not None:
+                continue
+            if arrays is None or var.name not in arrays.slots:
+                state[var.name] = var.getter()
+        if arrays is not None:
+            state[STATE_ARRAYS_KEY] = arrays.copy(state.get(STATE_ARRAYS_KEY))
+        for binding in bindings:
+            state[binding.name] = binding.copy()
+        return state
+
     def _get_fmu_state(self) -> Dict[str, Any]:
-        state = dict()
-        for var in self.vars.values():
-            state[var.name] = var.getter()
+        values = self._snapshot_values()
+        base = self._last_snapshot
+        if self.incremental_snapshots and base is not None and base.depth < MAX_SNAPSHOT_DEPTH:
+            snapshot = FmuStateSnapshot(changed_entries(values, self._last_snapshot_values), base)
+        else:
+            snapshot = FmuStateSnapshot(values)
+        if self.incremental_snapshots:
+            self._last_snapshot = snapshot
+            self._last_snapshot_values = values
+        return snapshot
+
+    def _update_fmu_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Overwrite a state previously returned by `_get_fmu_state` with the current state.
+
+        Returns:
+            The updated state, the given object unless it cannot be overwritten in place
+        """
+        if type(self)._get_fmu_state is not Fmi2Slave._get_fmu_state or not isinstance(state, FmuStateSnapshot):
+            return self._get_fmu_state()
+        state.detach()
+        self._snapshot_values(state)
+        if self.incremental_snapshots:
+            self._last_snapshot = state
+            self._last_snapshot_values = dict(state)
         return state
 
     def _set_fmu_state(self, state: Dict[str, Any]):
-        vars_by_name = dict([(v.name, v) for v in self.vars.values()])
+        if isinstance(state, FmuStateSnapshot):
+            state = state.resolve()
+        if self._vars_by_name is None:
+            self._vars_by_name = dict([(v.name, v) for v in self.vars.values()])
+        vars_by_name = self._vars_by_name
+        bindings = dict((binding.name, binding) for binding in self._array_bindings)
         for name, value in state.items():
-            if name not in vars_by_name:
+            if name == STATE_ARRAYS_KEY and self.state_arrays is not None:
+                self.state_arrays.restore(value)
+            elif name in bindings:
+                if bindings[name].settable:
+                    bindings[name].restore(value)
+            elif name not in vars_by_name:
                 setattr(self, name, value)
             else:
                 v = vars_by_name[name]
                 if v.setter is not None:
                     v.setter(value)
 
-    @staticmethod
-    def _fmu_state_to_bytes(state: Dict[str, Any]) -> bytes:
-        return json.dumps(state).encode("utf-8")
+    @classmethod
+    def _fmu_state_to_bytes(cls, state: Dict[str, Any]) -> bytes:
+        if isinstance(state, FmuStateSnapshot):
+            state = state.resolve()
+        return encode_state(state, cls.state_encoder)
 
-    @staticmethod
-    def _fmu_state_from_bytes(state: bytes) -> Dict[str, Any]:
-        return json.loads(state.decode("utf-8"))
+    @classmethod
+    def _fmu_state_from_bytes(cls, state: bytes) -> Dict[str, Any]:
+        return decode_state(state, cls.state_encoder)
 
     def _get_log_queue(self):
         return self.log_queue
 
+    def perf_stats(self) -> Optional[Dict[str, Dict[str, Dict[str, Any]]]]:
+        """Performance statistics recorded by the FMU wrapper.
+
+        The statistics are only recorded when the `PYTHONFMU_PERF_STATS` environment variable
+        is set (e.g. to 1) for the process loading the FMU.
+
+        Returns:
+            None if disabled, otherwise the statistics keyed by FMI call then by phase (total,
+            gil_wait, marshalling, python and log_drain). Each phase has a call count, the total
+            and max durations in seconds and a histogram where bin i counts durations in
+            [2^i, 2^(i+1)) nanoseconds.
+        """
+        provider = getattr(self, "_perf_stats_provider", None)
+        return None if provider is None else provider()
+
+    def _set_debug_logging(self, flag: bool, categories: Tuple[str, ...] = tuple()):
+        self.debug_logging = bool(flag)
+        self.debug_logging_categories = tuple(categories)
+
+    def _pack_log_queue(self) -> bytes:
+        packed = pack_log_messages(self.log_queue)
+        del self.log_queue[:]
+        return packed
+
     def log(
             self,
             msg: str,
@@ -311,6 +939,8 @@ class Fmi2Slave(ABC):
             debug=None
     ):
         """Log a message to the FMU logger.
+
+        The message is dropped right away if debug logging is off or its category is not enabled.
         
         Args:
             msg (str) : Log message
@@ -321,9 +951,13 @@ class Fmi2Slave(ABC):
         if debug is not None:
             print(f"WARNING: 'debug' argument is deprecated and has no effect.")
 
+        if not self.debug_logging:
+            return
         if category is None:
             category = f"logStatus{status.name.capitalize()}"
             if category not in self.log_categories:
                 category = "logAll"
+        if self.debug_logging_categories and category not in self.debug_logging_categories:
+            return
         log_msg = LogMsg(status, category, msg)
         self.log_queue.append(log_msg)
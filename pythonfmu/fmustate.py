@@ -0,0 +1,292 @@
+"""Binary serialization of the FMU state."""
+import struct
+import sys
+import weakref
+import zlib
+from array import array
+from typing import Any, Dict, Optional
+
+MAGIC = b"PFMS"
+VERSION = 1
+
+# Magic, format version, CRC32 of the schema block and number of entries
+HEADER = struct.Struct("<4sHII")
+# Value tag and length of the UTF-8 encoded name of one entry in the schema block
+SCHEMA_ENTRY = struct.Struct("<BH")
+CHUNK_SIZE = struct.Struct("<I")
+
+# Value tags; reals, integers and booleans are packed into one typed section each,
+# the other values are stored as length-prefixed chunks in schema order.
+REAL = 0
+INTEGER = 1
+BOOLEAN = 2
+STRING = 3
+ARRAY = 4
+STATE = 5
+OBJECT = 6
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# Longest chain of incremental snapshots before a full snapshot is taken again
+MAX_SNAPSHOT_DEPTH = 32
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+def _check_json(value: Any):
+    if value is None or type(value) in (bool, int, float, str):
+        return
+    if type(value) is list:
+        for item in value:
+            _check_json(item)
+    elif type(value) is dict and all(type(k) is str for k in value):
+        for item in value.values():
+            _check_json(item)
+    else:
+        raise TypeError(
+            f"a {type(value).__qualname__} can not be serialized as JSON without changing its type, "
+            "set `state_encoder = pickle` on the slave class to serialize it"
+        )
+
+
+class JsonEncoder:
+    """Default encoder of the state values without a native binary encoding.
+
+    Only None, booleans, numbers, strings, lists and dictionaries (of the exact built-in types)
+    are accepted, the other values would not come back as they were. Decoding JSON cannot run
+    code, unlike pickle, so states given by the importer are safe to load.
+    """
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        import json
+
+        _check_json(value)
+        return json.dumps(value).encode("utf-8")
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        import json
+
+        return json.loads(data.decode("utf-8"))
+
+
+def encode_state(state: Dict[str, Any], encoder: Any = JsonEncoder) -> bytes:
+    """Serialize an FMU state into the versioned binary format.
+
+    Float, integer and boolean values (including their subclasses, e.g. NumPy floats) are
+    packed into typed arrays by value. Strings, `array.array` values and nested states (plain
+    dictionaries keyed by strings) get a compact encoding. Any other value goes through the
+    encoder, the default one raises a TypeError for the values it can not restore as they were.
+
+    Args:
+        state (Dict[str, Any]): FMU state keyed by name
+        encoder (Any): Optional, object with `dumps`/`loads` for arbitrary values (default `JsonEncoder`)
+
+    Returns:
+        bytes: The serialized state
+    """
+    schema = bytearray()
+    reals = array("d")
+    integers = array("q")
+    booleans = bytearray()
+    chunks = list()
+
+    for name, value in state.items():
+        if isinstance(value, bool):
+            tag = BOOLEAN
+            booleans.append(value)
+        elif isinstance(value, int) and INT64_MIN <= value <= INT64_MAX:
+            tag = INTEGER
+            integers.append(value)
+        elif isinstance(value, float):
+            tag = REAL
+            reals.append(value)
+        elif type(value) is str:
+            tag = STRING
+            chunks.append(value.encode("utf-8"))
+        elif isinstance(value, array):
+            tag = ARRAY
+            chunks.append(value.typecode.encode("ascii") + _little_endian(value))
+        elif type(value) is dict and all(type(k) is str for k in value):
+            # Dictionary subclasses (e.g. OrderedDict) go through the encoder, which keeps or rejects their type
+            tag = STATE
+            chunks.append(encode_state(value, encoder))
+        else:
+            tag = OBJECT
+            try:
+                chunks.append(encoder.dumps(value))
+            except TypeError as e:
+                raise TypeError(f"FMU state entry '{name}': {e}") from None
+        encoded_name = name.encode("utf-8")
+        schema += SCHEMA_ENTRY.pack(tag, len(encoded_name))
+        schema += encoded_name
+
+    buffer = bytearray(HEADER.pack(MAGIC, VERSION, zlib.crc32(schema), len(state)))
+    buffer += schema
+    buffer += _little_endian(reals)
+    buffer += _little_endian(integers)
+    buffer += booleans
+    for chunk in chunks:
+        buffer += CHUNK_SIZE.pack(len(chunk))
+        buffer += chunk
+    return bytes(buffer)
+
+
+def decode_state(data: bytes, encoder: Any = JsonEncoder) -> Dict[str, Any]:
+    """Deserialize an FMU state produced by `encode_state`.
+
+    States serialized as JSON by earlier versions are still accepted. Values stored through
+    the encoder are trusted: with pickle as encoder, loading a state crafted by the importer
+    may run arbitrary code.
+
+    Args:
+        data (bytes): The serialized state
+        encoder (Any): Optional, object with `dumps`/`loads` for arbitrary values (default `JsonEncoder`)
+
+    Returns:
+        Dict[str, Any]: FMU state keyed by name
+    """
+    data = memoryview(data)
+    if data[:len(MAGIC)] != MAGIC:
+        # States serialized before the binary format
+        import json
+
+        return json.loads(bytes(data).decode("utf-8"))
+
+    _, version, checksum, size = HEADER.unpack_from(data)
+    if version > VERSION:
+        raise ValueError(f"Unsupported FMU state format version {version}")
+
+    offset = HEADER.size
+    entries = list()
+    for _ in range(size):
+        tag, length = SCHEMA_ENTRY.unpack_from(data, offset)
+        offset += SCHEMA_ENTRY.size
+        entries.append((tag, bytes(data[offset:offset + length]).decode("utf-8")))
+        offset += length
+    if zlib.crc32(data[HEADER.size:offset]) != checksum:
+        raise ValueError("Corrupted FMU state: schema checksum mismatch")
+
+    counts = dict((tag, 0) for tag in (REAL, INTEGER, BOOLEAN))
+    for tag, _ in entries:
+        if tag in counts:
+            counts[tag] += 1
+    sections = dict()
+    for tag, typecode in ((REAL, "d"), (INTEGER, "q"), (BOOLEAN, "B")):
+        length = counts[tag] * array(typecode).itemsize
+        sections[tag] = iter(_from_little_endian(typecode, data[offset:offset + length]))
+        offset += length
+
+    state = dict()
+    for tag, name in entries:
+        if tag == REAL:
+            state[name] = next(sections[REAL])
+        elif tag == INTEGER:
+            state[name] = next(sections[INTEGER])
+        elif tag == BOOLEAN:
+            state[name] = bool(next(sections[BOOLEAN]))
+        else:
+            (length,) = CHUNK_SIZE.unpack_from(data, offset)
+            offset += CHUNK_SIZE.size
+            chunk = data[offset:offset + length]
+            offset += length
+            if tag == STRING:
+                state[name] = bytes(chunk).decode("utf-8")
+            elif tag == ARRAY:
+                state[name] = _from_little_endian(chr(chunk[0]), chunk[1:])
+            elif tag == STATE:
+                state[name] = decode_state(chunk, encoder)
+            elif tag == OBJECT:
+                state[name] = encoder.loads(bytes(chunk))
+            else:
+                raise ValueError(f"Corrupted FMU state: unknown value tag {tag}")
+    return state
+
+
+def changed_entries(values: Dict[str, Any], previous: Dict[str, Any]) -> Dict[str, Any]:
+    """Select the entries of a state that differ from a previous one.
+
+    Args:
+        values (Dict[str, Any]): Current state
+        previous (Dict[str, Any]): State to compare with
+
+    Returns:
+        Dict[str, Any]: The changed or new entries
+    """
+    changed = dict()
+    for name, value in values.items():
+        if name in previous:
+            try:
+                if not value != previous[name]:
+                    continue
+            except (TypeError, ValueError):
+                pass  # Not comparable as a whole (e.g. NumPy arrays), assume it changed
+        changed[name] = value
+    return changed
+
+
+class FmuStateSnapshot(dict):
+    """FMU state taken by `Fmi2Slave._get_fmu_state`.
+
+    An incremental snapshot only holds the entries that changed since its base snapshot.
+    Snapshots are shared copy-on-write: before a snapshot is overwritten in place, its
+    previous content is handed over to the incremental snapshots built on top of it.
+
+    Args:
+        values (Dict[str, Any]): Optional, state entries
+        base (FmuStateSnapshot): Optional, snapshot the entries are relative to
+    """
+
+    def __init__(self, values: Dict[str, Any] = (), base: Optional["FmuStateSnapshot"] = None):
+        super().__init__(values)
+        self.dependents = weakref.WeakValueDictionary()
+        self._set_base(base)
+
+    def _set_base(self, base: Optional["FmuStateSnapshot"]):
+        self.base = base
+        self.depth = 0 if base is None else base.depth + 1
+        if base is not None:
+            base.dependents[id(self)] = self
+
+    def resolve(self) -> Dict[str, Any]:
+        """Build the full state by applying the chain of incremental snapshots."""
+        if self.base is None:
+            return self
+        chain = list()
+        snapshot = self
+        while snapshot is not None:
+            chain.append(snapshot)
+            snapshot = snapshot.base
+        values = dict()
+        for snapshot in reversed(chain):
+            values.update(snapshot)
+        return values
+
+    def detach(self):
+        """Prepare the snapshot to be overwritten as a full snapshot."""
+        dependents = list(self.dependents.values())
+        if dependents:
+            previous = FmuStateSnapshot(self, self.base)
+            for dependent in dependents:
+                dependent._set_base(previous)
+            self.dependents = weakref.WeakValueDictionary()
+            # The values are now shared with the copy and must not be overwritten in place
+            self.clear()
+        if self.base is not None:
+            self.base.dependents.pop(id(self), None)
+        self._set_base(None)
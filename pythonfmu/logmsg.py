@@ -1,3 +1,9 @@
+import struct
+from typing import Iterable, List
+
+# Status, byte length of the UTF-8 encoded category and of the UTF-8 encoded message
+LOG_RECORD = struct.Struct("=iII")
+
 
 class LogMsg:
 
@@ -10,4 +16,45 @@ class LogMsg:
         return "LogMsg(status={}, category={}, msg={}".format(self.status, self.category, self.msg)
 
 
+def pack_log_messages(messages: Iterable[LogMsg]) -> bytes:
+    """Pack log messages into one buffer for the FMU wrapper.
+
+    Each message is a `LOG_RECORD` header followed by the encoded category and message.
+
+    Args:
+        messages (Iterable[LogMsg]): Messages to pack
+
+    Returns:
+        bytes: The packed messages
+    """
+    buffer = bytearray()
+    for message in messages:
+        category = (message.category or "").encode("utf-8")
+        msg = str(message.msg).encode("utf-8")
+        buffer += LOG_RECORD.pack(int(message.status), len(category), len(msg))
+        buffer += category
+        buffer += msg
+    return bytes(buffer)
+
+
+def unpack_log_messages(data: bytes) -> List[LogMsg]:
+    """Unpack log messages packed by `pack_log_messages`.
+
+    Args:
+        data (bytes): The packed messages
 
+    Returns:
+        List[LogMsg]: The messages
+    """
+    messages = list()
+    data = memoryview(data)
+    offset = 0
+    while offset + LOG_RECORD.size <= len(data):
+        status, category_size, msg_size = LOG_RECORD.unpack_from(data, offset)
+        offset += LOG_RECORD.size
+        category = bytes(data[offset:offset + category_size]).decode("utf-8")
+        offset += category_size
+        msg = bytes(data[offset:offset + msg_size]).decode("utf-8")
+        offset += msg_size
+        messages.append(LogMsg(status, category, msg))
+    return messages
@@ -0,0 +1,84 @@
+"""Dependencies of the unknowns declared in the ModelStructure of the model description."""
+from collections import namedtuple
+from typing import Any, Dict, Optional, Set
+
+from .enums import Fmi2Causality, Fmi2DependencyKind, Fmi2Initial, Fmi2Variability
+from .variables import ScalarVariable
+
+# Value references of the variables an unknown depends on, by increasing value, and their
+# dependency kinds (None when all are `dependent`)
+Dependencies = namedtuple("Dependencies", ["references", "kinds"])
+
+# Kinds of the dependencies of the initial unknowns
+INITIAL_DEPENDENCY_KINDS = frozenset([Fmi2DependencyKind.dependent, Fmi2DependencyKind.constant])
+
+
+def initial_of(v: ScalarVariable) -> Optional[Fmi2Initial]:
+    """Initial status of a variable, its default one if not set (None for inputs)."""
+    if v.initial is not None:
+        return v.initial
+    if v.variability == Fmi2Variability.constant or v.causality == Fmi2Causality.parameter:
+        return Fmi2Initial.exact
+    if v.causality == Fmi2Causality.input:
+        return None
+    return Fmi2Initial.calculated
+
+
+def unknown_attrib(index: int, dependencies: Optional[Dependencies]) -> Dict[str, str]:
+    """Attributes of the Unknown node of a variable, without dependencies if they are not declared.
+
+    Args:
+        index (int): Index (from 1) of the unknown in the model variables
+        dependencies (Dependencies): Optional, declared dependencies of the unknown
+
+    Returns:
+        Dict[str, str]: Attributes of the node
+    """
+    attrib = dict(index=str(index))
+    if dependencies is not None:
+        # The indices are the value references shifted by one
+        attrib["dependencies"] = " ".join(str(vr + 1) for vr in dependencies.references)
+        if dependencies.kinds is not None:
+            attrib["dependenciesKind"] = " ".join(kind.name for kind in dependencies.kinds)
+    return attrib
+
+
+class AccessTracer:
+    """Record the attributes of an object read and written within a `with` block.
+
+    The object is given a subclass of its class recording the attribute accesses
+    for the duration of the block.
+
+    Args:
+        target (Any): Object to trace
+    """
+
+    def __init__(self, target: Any):
+        self.target = target
+        self.read: Set[str] = set()
+        self.written: Set[str] = set()
+
+    def __enter__(self) -> "AccessTracer":
+        cls = type(self.target)
+        read = self.read
+        written = self.written
+
+        def __getattribute__(obj, name):
+            read.add(name)
+            return cls.__getattribute__(obj, name)
+
+        def __setattr__(obj, name, value):
+            written.add(name)
+            cls.__setattr__(obj, name, value)
+
+        traced = type(cls)(cls.__name__, (cls,), dict(
+            __slots__=(),
+            __module__=cls.__module__,
+            __getattribute__=__getattribute__,
+            __setattr__=__setattr__,
+        ))
+        self.target.__class__ = traced
+        return self
+
+    def __exit__(self, *exc_info):
+        object.__setattr__(self.target, "__class__", type(self.target).__mro__[1])
@@ -1,5 +1,8 @@
+import os
 import sys
 import platform
+from pathlib import Path
+from typing import Iterator
 
 
 def get_platform() -> str:
@@ -15,3 +18,29 @@ def get_lib_extension() -> str:
     platforms = {"Darwin": "dylib", "Linux": "so", "Windows": "dll"}
     return platforms.get(platform.system(), "")
 
+
+
+def walk_files(folder: Path, followlinks: bool = True) -> Iterator[Path]:
+    """Files of a folder, skipping `__pycache__` folders.
+
+    Each folder is walked once, so links to a folder containing them do not loop.
+
+    Args:
+        folder (pathlib.Path) : the folder
+        followlinks (bool) : walk the linked folders, otherwise skip the linked files and folders
+
+    Returns:
+        Iterator[pathlib.Path] : the files, in a stable order
+    """
+    visited = set()
+    for root, dirs, files in os.walk(folder, followlinks=followlinks):
+        stat = os.stat(root)
+        if (stat.st_dev, stat.st_ino) in visited:
+            dirs[:] = []
+            continue
+        visited.add((stat.st_dev, stat.st_ino))
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            path = Path(root) / name
+            if followlinks or not path.is_symlink():
+                yield path
@@ -0,0 +1,454 @@
+"""Run a slave in a separate Python process.
+
+With the `PYTHONFMU_EXECUTION_MODE=process` environment variable, the FMU wrapper instantiates
+`RemoteSlave` instead of the slave class. The proxy starts one worker process per instance
+running the slave, forwards the FMI calls over the standard streams of the worker and exchanges
+the Real, Integer and Boolean values through a memory mapped file. Slaves then run on their own core and a crash of
+the Python code does not take the importer down.
+"""
+import importlib
+import mmap
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import tempfile
+import traceback
+import weakref
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from .logmsg import unpack_log_messages
+
+# Length of one pickled message on the channel
+FRAME = struct.Struct("<I")
+
+# Initial size of the shared buffer, grown on demand
+BUFFER_SIZE = 64 * 1024
+
+# Format of the Integer and Boolean values exchanged through the shared buffer, by variable type
+VALUE_FORMATS = {"integer": "i", "boolean": "?"}
+
+# Calls forwarded as is to the slave
+FORWARDED_CALLS = frozenset([
+    "setup_experiment",
+    "enter_initialization_mode",
+    "exit_initialization_mode",
+    "do_step",
+    "terminate",
+    "get_real",
+    "get_string",
+    "set_real",
+    "set_string",
+    "_set_debug_logging",
+])
+
+
+class RemoteError(RuntimeError):
+    """Error raised by the worker process or when it cannot be reached."""
+
+
+def python_executable() -> str:
+    """Python interpreter running the worker processes.
+
+    `sys.executable` is the importer when Python is embedded, so the interpreter is looked up
+    next to the Python installation unless set by the `PYTHONFMU_PYTHON` environment variable.
+    """
+    executable = os.environ.get("PYTHONFMU_PYTHON")
+    if executable:
+        return executable
+    if sys.executable and Path(sys.executable).name.lower().startswith("python"):
+        return sys.executable
+
+    version = sys.version_info
+    if os.name == "nt":
+        candidates = [Path(sys.exec_prefix) / "python.exe"]
+    else:
+        candidates = [
+            Path(sys.exec_prefix) / "bin" / name
+            for name in (f"python{version.major}.{version.minor}", f"python{version.major}", "python")
+        ]
+    for candidate in candidates:
+        if candidate.is_file():
+            return str(candidate)
+    raise RemoteError("No Python interpreter found for the worker process, set PYTHONFMU_PYTHON")
+
+
+def find_slave_class(module: Any) -> type:
+    """Find the slave class of a module, as the FMU wrapper does.
+
+    Args:
+        module (Any): The slave module
+
+    Returns:
+        type: The class deriving the deepest from Fmi2Slave
+    """
+    slave_class = None
+    deepest = 0
+    for value in vars(module).values():
+        if not isinstance(value, type):
+            continue
+        for depth, base in enumerate(value.__mro__):
+            if base.__name__ == "Fmi2Slave" and depth > deepest:
+                slave_class = value
+                deepest = depth
+    if slave_class is None:
+        raise RemoteError(f"No Fmi2Slave subclass found in module {module.__name__}")
+    return slave_class
+
+
+def _send(stream: BinaryIO, message: Any):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def _receive(stream: BinaryIO) -> Optional[Any]:
+    header = stream.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None
+    (size,) = FRAME.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+
+def _values_offset(size: int) -> int:
+    """Offset of the values of a call in the shared buffer, after its value references and 8-byte aligned."""
+    return (4 * size + 7) & ~7
+
+
+def _buffer_size(size: int, itemsize: int) -> int:
+    return _values_offset(size) + itemsize * size
+
+
+def _real_views(buffer: mmap.mmap, size: int) -> Tuple[memoryview, memoryview]:
+    """Value references then values of a Real call."""
+    offset = _values_offset(size)
+    view = memoryview(buffer)
+    return view[:4 * size], view[offset:offset + 8 * size]
+
+
+class SharedBuffer:
+    """Memory mapped file shared by the proxy and its worker process.
+
+    Args:
+        size (int): Size in bytes
+        path (str): Optional, existing file to map, a new one is created otherwise
+    """
+
+    def __init__(self, size: int, path: Optional[str] = None):
+        self.size = size
+        self.owner = path is None
+        if path is None:
+            shm = Path("/dev/shm")
+            fd, path = tempfile.mkstemp(prefix="pythonfmu-", dir=shm if shm.is_dir() else None)
+            os.ftruncate(fd, size)
+            os.close(fd)
+        self.path = path
+        with open(path, "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), size)
+
+    def close(self):
+        self.map.close()
+        if self.owner:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _shutdown(process: subprocess.Popen, buffers: List[SharedBuffer]):
+    try:
+        _send(process.stdin, ("_close", ()))
+        process.stdin.close()
+    except (OSError, ValueError):
+        pass
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    process.stdout.close()
+    for buffer in buffers:
+        buffer.close()
+
+
+class RemoteSlave:
+    """Proxy running the slave of the FMU resources in a worker process.
+
+    It has the interface the FMU wrapper expects from a slave. FMU states are the serialized
+    states of the slave, kept by the proxy.
+
+    Args:
+        instance_name (str): Name of the instance
+        resources (str): Folder holding the slave module and `slavemodule.txt`
+        visible (bool): Optional, passed to the slave
+    """
+
+    def __init__(self, **kwargs):
+        self.instance_name = kwargs["instance_name"]
+        self.resources = kwargs["resources"]
+        self.log_queue = []
+
+        resources = Path(self.resources)
+        module_name = (resources / "slavemodule.txt").read_text().splitlines()[0].strip()
+        # Recorded by the builder as module.ClassName, missing in FMUs built by older versions
+        class_file = resources / "slaveclass.txt"
+        class_name = class_file.read_text().strip() if class_file.is_file() else ""
+
+        # The worker imports the package and the slave module from the same places as the proxy
+        env = dict(os.environ)
+        path = [str(resources), str(Path(__file__).resolve().parent.parent)]
+        if env.get("PYTHONPATH"):
+            path.append(env["PYTHONPATH"])
+        env["PYTHONPATH"] = os.pathsep.join(path)
+        env.pop("PYTHONFMU_EXECUTION_MODE", None)
+
+        self._process = subprocess.Popen(
+            [python_executable(), "-m", "pythonfmu.remote"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env
+        )
+        self._buffer: Optional[SharedBuffer] = None
+        self._buffers: List[SharedBuffer] = list()
+        self._finalizer = weakref.finalize(self, _shutdown, self._process, self._buffers)
+
+        self._call("_instantiate", module_name, class_name, dict(
+            instance_name=self.instance_name,
+            resources=self.resources,
+            visible=kwargs.get("visible", False)
+        ))
+
+    def close(self):
+        """Stop the worker process, done as well when the proxy is garbage collected."""
+        self._finalizer()
+
+    def _call(self, name: str, *args) -> Any:
+        if not self._finalizer.alive:
+            raise RemoteError("The worker process is stopped")
+        try:
+            _send(self._process.stdin, (name, args))
+            reply = _receive(self._process.stdout)
+        except (OSError, ValueError):
+            reply = None
+        if reply is None:
+            raise RemoteError(f"The worker process of {self.instance_name} exited (code {self._process.poll()})")
+
+        ok, result, logs = reply
+        if logs:
+            self.log_queue.extend(unpack_log_messages(logs))
+        if not ok:
+            raise RemoteError(result)
+        return result
+
+    def _shared_buffer(self, size: int) -> mmap.mmap:
+        if self._buffer is None or self._buffer.size < size:
+            buffer = SharedBuffer(max(size, 2 * self._buffer.size if self._buffer else BUFFER_SIZE))
+            self._call("_map", buffer.path, buffer.size)
+            if self._buffer is not None:
+                self._buffers.remove(self._buffer)
+                self._buffer.close()
+            self._buffer = buffer
+            self._buffers.append(buffer)
+        return self._buffer.map
+
+    def setup_experiment(self, start_time: float, stop_time: Optional[float], tolerance: Optional[float]):
+        return self._call("setup_experiment", start_time, stop_time, tolerance)
+
+    def enter_initialization_mode(self):
+        return self._call("enter_initialization_mode")
+
+    def exit_initialization_mode(self):
+        return self._call("exit_initialization_mode")
+
+    def do_step(self, current_time: float, step_size: float) -> bool:
+        return self._call("do_step", current_time, step_size)
+
+    def terminate(self):
+        return self._call("terminate")
+
+    def get_integer(self, vrs: List[int]) -> List[int]:
+        return self._get_values("integer", vrs)
+
+    def get_real(self, vrs: List[int]) -> List[float]:
+        return self._call("get_real", list(vrs))
+
+    def get_boolean(self, vrs: List[int]) -> List[bool]:
+        return self._get_values("boolean", vrs)
+
+    def get_string(self, vrs: List[int]) -> List[str]:
+        return self._call("get_string", list(vrs))
+
+    def set_integer(self, vrs: List[int], values: List[int]):
+        self._set_values("integer", vrs, values)
+
+    def set_real(self, vrs: List[int], values: List[float]):
+        return self._call("set_real", list(vrs), list(values))
+
+    def set_boolean(self, vrs: List[int], values: List[bool]):
+        self._set_values("boolean", vrs, values)
+
+    def set_string(self, vrs: List[int], values: List[str]):
+        return self._call("set_string", list(vrs), list(values))
+
+    def _get_values(self, kind: str, vrs: List[int]) -> List[Any]:
+        size = len(vrs)
+        fmt = VALUE_FORMATS[kind]
+        buffer = self._shared_buffer(_buffer_size(size, struct.calcsize(fmt)))
+        struct.pack_into(f"={size}I", buffer, 0, *vrs)
+        self._call("_get_values", kind, size)
+        return list(struct.unpack_from(f"={size}{fmt}", buffer, _values_offset(size)))
+
+    def _set_values(self, kind: str, vrs: List[int], values: List[Any]):
+        size = len(vrs)
+        fmt = VALUE_FORMATS[kind]
+        buffer = self._shared_buffer(_buffer_size(size, struct.calcsize(fmt)))
+        struct.pack_into(f"={size}I", buffer, 0, *vrs)
+        struct.pack_into(f"={size}{fmt}", buffer, _values_offset(size), *values)
+        self._call("_set_values", kind, size)
+
+    def _get_real_buffer(self, vrs: memoryview, values: memoryview):
+        size = len(vrs) // 4
+        buffer = self._shared_buffer(_buffer_size(size, 8))
+        shared_vrs, shared_values = _real_views(buffer, size)
+        try:
+            shared_vrs[:] = vrs
+            self._call("_get_real_buffer", size)
+            values[:] = shared_values
+        finally:
+            shared_vrs.release()
+            shared_values.release()
+
+    def _set_real_buffer(self, vrs: memoryview, values: memoryview):
+        size = len(vrs) // 4
+        buffer = self._shared_buffer(_buffer_size(size, 8))
+        shared_vrs, shared_values = _real_views(buffer, size)
+        try:
+            shared_vrs[:] = vrs
+            shared_values[:] = values
+        finally:
+            shared_vrs.release()
+            shared_values.release()
+        self._call("_set_real_buffer", size)
+
+    def _get_fmu_state(self) -> bytes:
+        return self._call("_get_fmu_state")
+
+    def _update_fmu_state(self, state: bytes) -> bytes:
+        return self._get_fmu_state()
+
+    def _set_fmu_state(self, state: bytes):
+        self._call("_set_fmu_state", state)
+
+    @classmethod
+    def _fmu_state_to_bytes(cls, state: bytes) -> bytes:
+        return state
+
+    @classmethod
+    def _fmu_state_from_bytes(cls, state: bytes) -> bytes:
+        return bytes(state)
+
+    def _get_log_queue(self):
+        return self.log_queue
+
+    def _set_debug_logging(self, flag: bool, categories: Tuple[str, ...] = tuple()):
+        self._call("_set_debug_logging", bool(flag), tuple(categories))
+
+    def _pack_log_queue(self) -> bytes:
+        from .logmsg import pack_log_messages
+
+        packed = pack_log_messages(self.log_queue)
+        del self.log_queue[:]
+        return packed
+
+    def perf_stats(self) -> Optional[Dict[str, Dict[str, Dict[str, Any]]]]:
+        """Performance statistics recorded by the FMU wrapper, see `Fmi2Slave.perf_stats`."""
+        provider = getattr(self, "_perf_stats_provider", None)
+        return None if provider is None else provider()
+
+
+class _Worker:
+    """Slave served by the worker process."""
+
+    def __init__(self):
+        self.slave = None
+        self.buffer: Optional[SharedBuffer] = None
+
+    def handle(self, name: str, args: Tuple) -> Any:
+        if name in FORWARDED_CALLS:
+            return getattr(self.slave, name)(*args)
+        if name == "_get_real_buffer" or name == "_set_real_buffer":
+            vrs, values = _real_views(self.buffer.map, args[0])
+            try:
+                getattr(self.slave, name)(vrs, values)
+            finally:
+                vrs.release()
+                values.release()
+        elif name == "_get_values" or name == "_set_values":
+            kind, size = args
+            fmt = f"={size}{VALUE_FORMATS[kind]}"
+            vrs = list(struct.unpack_from(f"={size}I", self.buffer.map, 0))
+            offset = _values_offset(size)
+            if name == "_get_values":
+                struct.pack_into(fmt, self.buffer.map, offset, *getattr(self.slave, "get_" + kind)(vrs))
+            else:
+                getattr(self.slave, "set_" + kind)(vrs, list(struct.unpack_from(fmt, self.buffer.map, offset)))
+        elif name == "_get_fmu_state":
+            return type(self.slave)._fmu_state_to_bytes(self.slave._get_fmu_state())
+        elif name == "_set_fmu_state":
+            self.slave._set_fmu_state(type(self.slave)._fmu_state_from_bytes(args[0]))
+        elif name == "_map":
+            if self.buffer is not None:
+                self.buffer.close()
+            self.buffer = SharedBuffer(args[1], args[0])
+        elif name == "_instantiate":
+            module_name, class_name, kwargs = args
+            if "." in class_name:
+                module_name, _, class_name = class_name.rpartition(".")
+                slave_class = getattr(importlib.import_module(module_name), class_name)
+            else:
+                slave_class = find_slave_class(importlib.import_module(module_name))
+            self.slave = slave_class(**kwargs)
+        else:
+            raise RemoteError(f"Unknown call {name}")
+
+    def logs(self) -> bytes:
+        if self.slave is None:
+            return b""
+        return self.slave._pack_log_queue()
+
+    def serve(self, requests: BinaryIO, replies: BinaryIO):
+        while True:
+            request = _receive(requests)
+            if request is None:
+                break
+            name, args = request
+            if name == "_close":
+                break
+            try:
+                reply = (True, self.handle(name, args))
+            except Exception:
+                reply = (False, traceback.format_exc())
+            _send(replies, reply + (self.logs(),))
+        if self.buffer is not None:
+            self.buffer.close()
+
+
+def main():
+    # The standard streams are the channel, the output of the slave goes to stderr
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    with open(os.devnull, "rb") as devnull:
+        os.dup2(devnull.fileno(), sys.stdin.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    _Worker().serve(requests, replies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Contiguous storage of the variable values."""
+from array import array
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .enums import Fmi2Variability
+from .variables import Boolean, Integer, Real, ScalarVariable, String
+
+# Array type code and Python type of the variables that can be stored contiguously
+STORAGE_TYPES: Dict[type, Tuple[str, Callable[[Any], Any]]] = {
+    Real: ("d", float),
+    Integer: ("i", int),
+    Boolean: ("b", bool),
+}
+
+# Python type of the values of each variable type
+VALUE_TYPES: Dict[type, Callable[[Any], Any]] = {
+    Real: float,
+    Integer: int,
+    Boolean: bool,
+    String: str,
+}
+
+
+class StateAttribute:
+    """Data descriptor redirecting a slave attribute to its slot in the state arrays.
+
+    Instances of the slave class that do not store the attribute in arrays (e.g. before
+    the variable is registered) keep using the instance dictionary.
+
+    Args:
+        name (str): Attribute name
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            values, slot, cast = obj.state_arrays.slots[self.name]
+        except (AttributeError, KeyError):
+            try:
+                return obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name) from None
+        return cast(values[slot])
+
+    def __set__(self, obj, value):
+        try:
+            values, slot, _ = obj.state_arrays.slots[self.name]
+        except (AttributeError, KeyError):
+            obj.__dict__[self.name] = value
+        else:
+            values[slot] = value
+
+
+class StateArrays:
+    """Typed arrays holding the values of the Real, Integer and Boolean variables of a slave.
+
+    Each stored variable owns one slot of the array matching its type, so the whole state
+    can be processed at once (e.g. through `numpy.frombuffer(state_arrays.real)`) and copied
+    with a single slice. The arrays cannot grow while such a buffer view is alive.
+    """
+
+    def __init__(self):
+        self.real = array("d")
+        self.integer = array("i")
+        self.boolean = array("b")
+        self.slots: Dict[str, Tuple[array, int, Callable[[Any], Any]]] = dict()
+
+    def _array(self, typecode: str) -> array:
+        return {"d": self.real, "i": self.integer, "b": self.boolean}[typecode]
+
+    def bind(self, owner: Any, var: ScalarVariable) -> bool:
+        """Move the attribute backing a variable into the state arrays.
+
+        Args:
+            owner (Any): Object holding the attribute, its class gets a `StateAttribute` on the first bind of the name
+            var (ScalarVariable): The variable to be stored
+
+        Returns:
+            True if the variable is now stored in the arrays, False if it is not eligible
+        """
+        name = var.local_name
+        storage = STORAGE_TYPES.get(type(var))
+        descriptor = getattr(type(owner), name, None)
+        if (
+            storage is None
+            or name not in owner.__dict__
+            or name in self.slots
+            or not (descriptor is None or isinstance(descriptor, StateAttribute))
+        ):
+            return False
+
+        typecode, cast = storage
+        values = self._array(typecode)
+        try:
+            values.append(owner.__dict__[name])
+        except (TypeError, OverflowError):
+            return False
+        del owner.__dict__[name]
+
+        slot = len(values) - 1
+        self.slots[name] = (values, slot, cast)
+        if descriptor is None:
+            setattr(type(owner), name, StateAttribute(name))
+
+        var.getter = partial(values.__getitem__, slot)
+        if var.variability != Fmi2Variability.constant:
+            var.setter = partial(values.__setitem__, slot)
+        return True
+
+    def copy(self, into: Optional[Dict[str, array]] = None) -> Dict[str, array]:
+        """Copy the arrays, keyed by type code.
+
+        Args:
+            into (Dict[str, array]): Optional, previous copy to overwrite in place
+
+        Returns:
+            Dict[str, array]: The copy
+        """
+        if into is None:
+            into = dict()
+        for values in (self.real, self.integer, self.boolean):
+            saved = into.get(values.typecode)
+            if isinstance(saved, array) and len(saved) == len(values):
+                saved[:] = values
+            else:
+                into[values.typecode] = values[:]
+        return into
+
+    def restore(self, saved: Dict[str, Any]):
+        """Overwrite the arrays in place with a copy made by `copy`.
+
+        Args:
+            saved (Dict[str, Any]): Arrays or sequences keyed by type code
+        """
+        for typecode, data in saved.items():
+            values = self._array(typecode)
+            values[:] = data if isinstance(data, array) else array(typecode, data)
+
+
+class ArrayBinding:
+    """Block of contiguous value references bound to a sequence attribute of a slave.
+
+    The sequence (e.g. a list, an `array.array` or a NumPy array) is looked up on each access,
+    so the attribute may be replaced by another sequence of the same length.
+
+    Args:
+        owner (Any): Object holding the attribute
+        attribute (str): Attribute name
+        name (str): Name of the block, prefix of the element variable names
+        var_type (type): Type of the element variables
+        start (int): Value reference of the first element
+        size (int): Number of elements
+        settable (bool): Optional, can the elements be set? Default True
+    """
+
+    def __init__(
+        self, owner: Any, attribute: str, name: str, var_type: type, start: int, size: int, settable: bool = True
+    ):
+        self.owner = owner
+        self.attribute = attribute
+        self.name = name
+        self.var_type = var_type
+        self.start = start
+        self.size = size
+        self.settable = settable
+        self._cast = VALUE_TYPES[var_type]
+
+    @property
+    def values(self) -> Sequence[Any]:
+        """The bound sequence."""
+        return getattr(self.owner, self.attribute)
+
+    def get(self, first: int, last: int) -> List[Any]:
+        """Values of the elements [first, last), as Python values."""
+        values = self.values[first:last]
+        if hasattr(values, "tolist"):
+            values = values.tolist()
+        return list(map(self._cast, values))
+
+    def set(self, first: int, last: int, values: Sequence[Any]):
+        """Overwrite the elements [first, last) with a single slice assignment."""
+        target = self.values
+        if isinstance(target, array) and not isinstance(values, array):
+            values = array(target.typecode, values)
+        target[first:last] = values
+
+    def get_item(self, index: int) -> Any:
+        return self.values[index]
+
+    def set_item(self, index: int, value: Any):
+        self.values[index] = value
+
+    def copy(self) -> Any:
+        """Copy of the bound sequence, for FMU states.
+
+        Lists and `array.array` are copied as they are, other sequences (e.g. NumPy arrays) as
+        an `array.array` of the storage type of the elements (a list for strings), which FMU
+        states serialize without an encoder.
+        """
+        values = self.values
+        if isinstance(values, (list, array)):
+            return values[:]
+        if hasattr(values, "tolist"):
+            values = values.tolist()
+        storage = STORAGE_TYPES.get(self.var_type)
+        return list(values) if storage is None else array(storage[0], values)
+
+    def restore(self, saved: Sequence[Any]):
+        """Overwrite the bound sequence in place with a copy made by `copy`."""
+        self.set(0, self.size, saved)
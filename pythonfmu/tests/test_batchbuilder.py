@@ -0,0 +1,58 @@
+import json
+import zipfile
+from pathlib import Path
+
+from pythonfmu.batchbuilder import BatchBuilder, read_manifest
+
+SLAVES = Path(__file__).parent / "slaves"
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {"script_file": "model.py", "project_files": ["data"], "dest": "out", "canGetAndSetFMUstate": True}
+    ]))
+
+    assert read_manifest(manifest) == [{
+        "script_file": str(tmp_path / "model.py"),
+        "project_files": [str(tmp_path / "data")],
+        "dest": str(tmp_path / "out"),
+        "canGetAndSetFMUstate": True,
+    }]
+
+
+def test_build_manifest(tmp_path, capsys):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {"script_file": str(SLAVES / "pythonslave.py"), "canGetAndSetFMUstate": True},
+        {"script_file": str(SLAVES / "pythonslave_default_ex.py"), "dest": "other"},
+        {"script_file": "missing.py"},
+    ]))
+
+    results = BatchBuilder.build_manifest(manifest, dest=tmp_path / "fmus", jobs=2, cache_dir=tmp_path / "cache")
+
+    assert [Path(r.script_file).name for r in results] == ["pythonslave.py", "pythonslave_default_ex.py", "missing.py"]
+    assert Path(results[0].fmu).parent == tmp_path / "fmus"
+    assert Path(results[1].fmu).parent == tmp_path / "other"
+    for result in results[:2]:
+        assert result.error is None
+        assert zipfile.is_zipfile(result.fmu)
+    assert results[2].fmu is None
+    assert "No such file" in results[2].error
+
+    with zipfile.ZipFile(results[0].fmu) as files:
+        assert b'canGetAndSetFMUstate="true"' in files.read("modelDescription.xml")
+
+    output = capsys.readouterr().out
+    assert "Built 2/3 FMUs" in output
+    assert "missing.py: FAILED" in output
+
+    # The second run copies the FMUs from the shared cache
+    assert len(list((tmp_path / "cache").glob("*/*.fmu"))) == 2
+    results = BatchBuilder.build_manifest(manifest, dest=tmp_path / "fmus", jobs=2, cache_dir=tmp_path / "cache")
+    assert [r.error is None for r in results] == [True, True, False]
+    assert len(list((tmp_path / "cache").glob("*/*.fmu"))) == 2
+
+
+def test_build_many_without_builds():
+    assert BatchBuilder.build_many([]) == []
@@ -1,5 +1,9 @@
+import argparse
+import builtins
+import importlib.util
 import itertools
 import platform
+import sys
 import tempfile
 import zipfile
 from pathlib import Path
@@ -7,7 +11,9 @@ from pathlib import Path
 import pytest
 
 import pythonfmu
-from pythonfmu.builder import FmuBuilder, get_platform
+from pythonfmu import archive, builder
+from pythonfmu.buildcache import BuildCache
+from pythonfmu.builder import BUILD_MODULES, FmuBuilder, get_platform
 
 PROJECT_TEST_CASES = [
     ("dummy.txt",),
@@ -38,7 +44,7 @@ def test_zip_content(tmp_path):
         module_file = "/".join(("resources", "slavemodule.txt"))
         assert module_file in names
 
-        nfiles = 16
+        nfiles = 15
         if FmuBuilder.has_binary():
             assert (
                 "/".join(("binaries", get_platform(), f"PythonSlave.{lib_extension}"))
@@ -47,18 +53,22 @@ def test_zip_content(tmp_path):
         else:
             nfiles -= 1
 
-        # Check pythonfmu is embedded
+        # Check the pythonfmu runtime is embedded
         pkg_folder = Path(pythonfmu.__path__[0])
         for f in pkg_folder.rglob("*.py"):
             relative_f = f.relative_to(pkg_folder).as_posix()
             if "test" not in relative_f:
-                assert "/".join(("resources", "pythonfmu", relative_f)) in names
+                embedded = "/".join(("resources", "pythonfmu", relative_f)) in names
+                assert embedded == (relative_f not in BUILD_MODULES)
 
         assert len(names) >= nfiles  # Library + python script + XML + module name + sources
 
         with files.open(module_file) as myfile:
             assert myfile.read() == b"pythonslave"
 
+        with files.open("/".join(("resources", "slaveclass.txt"))) as myfile:
+            assert myfile.read() == b"pythonslave.PythonSlave"
+
 
 @pytest.mark.parametrize("pfiles", PROJECT_TEST_CASES)
 def test_project_files(tmp_path, pfiles):
@@ -165,3 +175,315 @@ def test_documentation(tmp_path):
 
         assert "documentation/index.html" in names
         assert "documentation/licenses/license.txt" in names
+
+
+@pytest.mark.parametrize("precompile", [True, False])
+def test_precompile(tmp_path, precompile):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    project_dir = tmp_path / "project"
+    (project_dir / "__pycache__").mkdir(parents=True)
+    (project_dir / "helper.py").write_text("VALUE = 1\n")
+    (project_dir / "broken.py").write_text("def broken(:\n")
+    (project_dir / "__pycache__" / "stale.cpython-00.pyc").write_bytes(b"stale")
+
+    fmu = FmuBuilder.build_FMU(script_file, dest=tmp_path, project_files=[project_dir], precompile=precompile)
+
+    tag = sys.implementation.cache_tag
+    with zipfile.ZipFile(fmu) as files:
+        names = files.namelist()
+        pyc_files = [name for name in names if name.endswith(".pyc")]
+        if not precompile:
+            assert pyc_files == []
+            return
+
+        assert f"resources/__pycache__/pythonslave.{tag}.pyc" in names
+        assert f"resources/project/__pycache__/helper.{tag}.pyc" in names
+        assert f"resources/pythonfmu/__pycache__/fmi2slave.{tag}.pyc" in names
+        assert all(name.endswith(f".{tag}.pyc") for name in pyc_files)
+        assert f"resources/project/__pycache__/broken.{tag}.pyc" not in names
+
+        # Unchecked hash-based bytecode (PEP 552)
+        header = files.read(f"resources/__pycache__/pythonslave.{tag}.pyc")[:8]
+        assert header[:4] == importlib.util.MAGIC_NUMBER
+        assert int.from_bytes(header[4:8], "little") == 0b01
+
+
+def test_build_cache(tmp_path, monkeypatch):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    data_file = project_dir / "data.txt"
+    data_file.write_text("data")
+    cache_dir = tmp_path / "cache"
+
+    builds = list()
+    get_model_description = builder.get_model_description
+
+    def counted(*args):
+        builds.append(args)
+        return get_model_description(*args)
+
+    monkeypatch.setattr(builder, "get_model_description", counted)
+
+    def build(dest, **options):
+        return FmuBuilder.build_FMU(script_file, dest=dest, project_files=[project_dir], cache_dir=cache_dir, **options)
+
+    fmu = build(tmp_path / "first")
+    assert len(builds) == 1
+
+    # Unchanged inputs, the FMU is copied
+    copy = build(tmp_path / "second")
+    assert len(builds) == 1
+    assert copy.name == fmu.name
+    assert copy.read_bytes() == fmu.read_bytes()
+
+    # Explicit FMU name
+    named = build(tmp_path / "named.fmu")
+    assert len(builds) == 2
+    assert named == tmp_path / "named.fmu"
+
+    # Changed project file
+    data_file.write_text("changed")
+    build(tmp_path / "third")
+    assert len(builds) == 3
+    with zipfile.ZipFile(tmp_path / "third" / fmu.name) as files:
+        assert files.read("resources/project/data.txt") == b"changed"
+
+    # Changed option
+    build(tmp_path / "fourth", canGetAndSetFMUstate=True)
+    assert len(builds) == 4
+    build(tmp_path / "fifth", canGetAndSetFMUstate=True)
+    assert len(builds) == 4
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="Creating links needs privileges")
+def test_build_cache_key_files(tmp_path):
+    cache = BuildCache(tmp_path / "cache")
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "__pycache__").mkdir()
+    (project_dir / "__pycache__" / "helper.pyc").write_bytes(b"bytecode")
+    external = tmp_path / "external"
+    external.mkdir()
+    (external / "weights.h5").write_bytes(b"weights")
+    (project_dir / "link").symlink_to(external, target_is_directory=True)
+
+    key = cache.key([project_dir])
+    # The bytecode is not shipped
+    (project_dir / "__pycache__" / "helper.pyc").write_bytes(b"other bytecode")
+    assert cache.key([project_dir]) == key
+    # The linked folders are
+    (external / "weights.h5").write_bytes(b"other weights")
+    assert cache.key([project_dir]) != key
+
+
+def test_build_cache_reuses_entries(tmp_path, monkeypatch):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    for i in range(3):
+        (project_dir / f"data{i}.txt").write_bytes(bytes([i]) * (1 << 17))
+
+    deflated = list()
+    deflate = archive.deflate
+    monkeypatch.setattr(archive, "deflate", lambda path, level: (deflated.append(path.name), deflate(path, level))[1])
+
+    def build(dest):
+        return FmuBuilder.build_FMU(
+            script_file, dest=dest, project_files=[project_dir], cache_dir=tmp_path / "cache",
+            compression={"*.txt": "deflated"}
+        )
+
+    build(tmp_path / "first")
+    assert sorted(deflated) == ["data0.txt", "data1.txt", "data2.txt"]
+
+    # Only the changed file is compressed again
+    deflated.clear()
+    (project_dir / "data1.txt").write_bytes(b"changed" * (1 << 15))
+    fmu = build(tmp_path / "second")
+    assert deflated == ["data1.txt"]
+    with zipfile.ZipFile(fmu) as files:
+        assert files.testzip() is None
+        for i in range(3):
+            info = files.getinfo(f"resources/project/data{i}.txt")
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert files.read(info) == (project_dir / f"data{i}.txt").read_bytes()
+
+
+def test_build_cache_digests(tmp_path):
+    cache = BuildCache(tmp_path / "cache")
+    data_file = tmp_path / "data.bin"
+    data_file.write_bytes(b"0" * 1000)
+
+    key = cache.key([data_file], option=1)
+    assert BuildCache(tmp_path / "cache").key([data_file], option=1) == key
+    assert cache.key([data_file], option=2) != key
+
+    data_file.write_bytes(b"1" * 1000)
+    assert cache.key([data_file], option=1) != key
+
+
+def test_compression(tmp_path):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    project_dir = tmp_path / "project"
+    (project_dir / "weights").mkdir(parents=True)
+    (project_dir / "weights" / "model.h5").write_bytes(b"0" * 10000)
+    (project_dir / "data.txt").write_text("data " * 2000)
+
+    fmu = FmuBuilder.build_FMU(
+        script_file,
+        dest=tmp_path,
+        project_files=[project_dir],
+        compression={"*.h5": "stored", "resources/*": "deflated:9", "modelDescription.xml": "deflated"},
+    )
+
+    with zipfile.ZipFile(fmu) as files:
+        def method(name):
+            return files.getinfo(name).compress_type
+
+        assert method("resources/project/weights/model.h5") == zipfile.ZIP_STORED
+        assert method("resources/project/data.txt") == zipfile.ZIP_DEFLATED
+        assert method("resources/pythonslave.py") == zipfile.ZIP_DEFLATED
+        assert method("modelDescription.xml") == zipfile.ZIP_DEFLATED
+        assert files.read("resources/project/data.txt") == b"data " * 2000
+        if FmuBuilder.has_binary():
+            assert method(f"binaries/{get_platform()}/PythonSlave.{lib_extension}") == zipfile.ZIP_STORED
+
+    # The project files are streamed from their location, never changed
+    assert sorted(p.name for p in project_dir.rglob("*")) == ["data.txt", "model.h5", "weights"]
+
+
+def test_compression_errors(tmp_path):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    with pytest.raises(ValueError, match="Unsupported compression method 'lzma'"):
+        FmuBuilder.build_FMU(script_file, dest=tmp_path, compression={"*": "lzma"})
+
+    parser = argparse.ArgumentParser()
+    builder.create_command_parser(parser)
+    options = parser.parse_args(["-f", str(script_file), "--compress", "*.h5=stored", "--compress", "*=deflated"])
+    assert options.compression == [("*.h5", "stored"), ("*", "deflated")]
+    assert builder.parse_compression(options.compression) == [
+        ("*.h5", zipfile.ZIP_STORED, None), ("*", zipfile.ZIP_DEFLATED, None)
+    ]
+
+
+FAILING_SLAVE = """
+from pythonfmu import Fmi2Slave, Real
+
+
+class FailingSlave(Fmi2Slave):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if {failure!r} == "init":
+            raise RuntimeError("failing model")
+        self.register_variable(Real("x"))
+        self.x = 0.0
+
+    def write_xml(self, stream, model_options=dict()):
+        if {failure!r} == "description":
+            stream.write(b"<?xml")
+            raise RuntimeError("failing model")
+        super().write_xml(stream, model_options)
+
+    def do_step(self, current_time, step_size):
+        return True
+"""
+
+
+@pytest.mark.parametrize("failure", ["init", "description", "archive"])
+def test_failed_build_leaves_no_fmu(tmp_path, monkeypatch, failure):
+    script_file = tmp_path / "failingslave.py"
+    script_file.write_text(FAILING_SLAVE.format(failure=failure))
+    dest = tmp_path / "dest"
+    dest.mkdir()
+
+    if failure == "archive":
+        def write_entries(archive, entries, previous=None):
+            archive.writestr("partial", b"partial")
+            raise RuntimeError("failing model")
+
+        monkeypatch.setattr(builder, "write_entries", write_entries)
+
+    with pytest.raises(RuntimeError, match="failing model"):
+        FmuBuilder.build_FMU(script_file, dest=dest)
+    assert list(dest.iterdir()) == []
+
+    # Nor truncates an existing FMU when failing to describe the model
+    fmu = dest / "FailingSlave.fmu"
+    fmu.write_bytes(b"previous")
+    with pytest.raises(RuntimeError, match="failing model"):
+        FmuBuilder.build_FMU(script_file, dest=fmu)
+    assert fmu.exists() == (failure != "archive")
+
+
+MUTATING_SLAVE = """
+import os
+from pythonfmu import Fmi2Slave
+
+
+class MutatingSlave(Fmi2Slave):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        with open(os.path.join(self.resources, "project", "data.txt"), {mode!r}) as f:
+            self.data = f.read()
+
+    def do_step(self, current_time, step_size):
+        return True
+"""
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="Creating links needs privileges")
+def test_project_files_streamed(tmp_path):
+    script_file = tmp_path / "mutatingslave.py"
+    script_file.write_text(MUTATING_SLAVE.format(mode="r"))
+    project_dir = tmp_path / "project"
+    (project_dir / "sub").mkdir(parents=True)
+    (project_dir / "data.txt").write_text("data")
+    (project_dir / "sub" / "more.txt").write_text("more")
+    # Link cycle
+    (project_dir / "sub" / "loop").symlink_to(project_dir, target_is_directory=True)
+
+    fmu = FmuBuilder.build_FMU(script_file, dest=tmp_path / "dest", project_files=[project_dir])
+    with zipfile.ZipFile(fmu) as files:
+        names = files.namelist()
+        assert files.read("resources/project/data.txt") == b"data"
+    assert "resources/project/sub/more.txt" in names
+    assert not any("loop" in name for name in names)
+
+    # The model can not write the project files through the build folder
+    script_file.write_text(MUTATING_SLAVE.format(mode="w"))
+    with pytest.raises(PermissionError, match="Project files can not be written"):
+        FmuBuilder.build_FMU(script_file, dest=tmp_path / "dest", project_files=[project_dir])
+    assert (project_dir / "data.txt").read_text() == "data"
+    assert open is builtins.open
+
+
+def test_compress_in_parallel(tmp_path, monkeypatch):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    for i in range(6):
+        (project_dir / f"data{i}.txt").write_bytes(bytes(range(256)) * 1024 * (i + 1))
+    (project_dir / "small.txt").write_text("small")
+
+    deflated = list()
+    deflate = archive.deflate
+    monkeypatch.setattr(archive, "deflate", lambda path, level: (deflated.append(path.name), deflate(path, level))[1])
+    fmu = FmuBuilder.build_FMU(
+        script_file, dest=tmp_path, project_files=[project_dir], compression={"*.txt": "deflated:9"}
+    )
+
+    # The large entries are compressed in the pool, all are written in order
+    assert sorted(deflated) == [f"data{i}.txt" for i in range(6)]
+    with zipfile.ZipFile(fmu) as files:
+        assert files.testzip() is None
+        names = [n for n in files.namelist() if n.startswith("resources/project/")]
+        assert names == sorted(names)
+        for i in range(6):
+            info = files.getinfo(f"resources/project/data{i}.txt")
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert info.compress_size < info.file_size
+            assert files.read(info) == (project_dir / f"data{i}.txt").read_bytes()
+        assert files.read("resources/project/small.txt") == b"small"
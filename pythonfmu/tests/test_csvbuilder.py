@@ -0,0 +1,284 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from pythonfmu import csvbuilder
+from pythonfmu.csvbuilder import write_columns
+from pythonfmu.csvslave import CsvData, CsvSlave
+from pythonfmu.enums import Fmi2Type
+
+DEMO_FILE = Path(__file__).parent / "data/csvdemo.csv"
+
+
+def test_write_columns(tmp_path, monkeypatch):
+    # Several chunks of rows
+    monkeypatch.setattr(csvbuilder, "CHUNK_ROWS", 4)
+    csv_file = tmp_path / "data.csv"
+    rows = ["t, x, n [INTEGER], flag [BOOLEAN], label [STRING]"]
+    rows += [f"{0.5 * i}, {i / 3}, {i - 5}, {str(i % 2 == 0).lower()}, \"é{'x' * i}\"" for i in range(10)]
+    csv_file.write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+    data = CsvData(str(write_columns(csv_file, tmp_path / "data.columns")))
+
+    assert data.rows == 10
+    assert list(data.times) == [0.5 * i for i in range(10)]
+    assert [(c.name, c.type) for c in data.columns] == [
+        ("x", Fmi2Type.real), ("n", Fmi2Type.integer), ("flag", Fmi2Type.boolean), ("label", Fmi2Type.string)
+    ]
+    x, n, flag, label = (c.values for c in data.columns)
+    assert list(x) == [i / 3 for i in range(10)]
+    assert list(n) == [i - 5 for i in range(10)]
+    assert [bool(v) for v in flag] == [i % 2 == 0 for i in range(10)]
+    assert len(label) == 10
+    assert [label[i] for i in range(10)] == [f"é{'x' * i}" for i in range(10)]
+
+
+def test_write_columns_errors(tmp_path):
+    csv_file = tmp_path / "data.csv"
+    csv_file.write_text("t, x\n0.0, 1.0\n0.1\n")
+    with pytest.raises(ValueError, match="Row 2 of .* has 1 values, expected 2"):
+        write_columns(csv_file, tmp_path / "data.columns")
+    csv_file.write_text("t, x\n0.0, 1.0\n0.1, 2.0, 3.0\n")
+    with pytest.raises(ValueError, match="Row 2 of .* has 3 values, expected 2"):
+        write_columns(csv_file, tmp_path / "data.columns")
+
+    # Blank lines are skipped
+    csv_file.write_text("t, x\n0.0, 1.0\n\n0.1, 2.0\n\n")
+    assert CsvData(str(write_columns(csv_file, tmp_path / "data.columns"))).rows == 2
+
+    csv_file.write_text("t, x [ENUMERATION]\n0.0, 1\n")
+    with pytest.raises(NotImplementedError):
+        write_columns(csv_file, tmp_path / "data.columns")
+
+    (tmp_path / "other.columns").write_bytes(b"not columnar data")
+    with pytest.raises(ValueError, match="is not a CSV data file"):
+        CsvData(str(tmp_path / "other.columns"))
+
+
+def test_csv_slave(tmp_path):
+    write_columns(DEMO_FILE, tmp_path / "csvdemo.columns")
+
+    class Csvdemo(CsvSlave):
+        data_file = "csvdemo.columns"
+
+    slave = Csvdemo(instance_name="csvdemo", resources=str(tmp_path))
+    names = [var.name for var in slave.vars.values()]
+    assert names == ["default_real", "submodel.int", "real[1]", "bool", "string", "num_rows", "end_time", "interpolate"]
+
+    slave.setup_experiment(0.0, None, None)
+    assert slave.get_real([0, 2, 6]) == [-1.0, 2.0, 0.5]
+    assert slave.get_integer([1, 5]) == [1, 6]
+    assert slave.get_boolean([3]) == [True]
+    assert slave.get_string([4]) == ["1"]
+
+    slave.do_step(0.0, 0.05)
+    assert slave.get_real([2]) == [pytest.approx(3.0)]
+    assert slave.get_string([4]) == ["1"]
+
+
+def test_csv_slave_jumps(tmp_path):
+    csv_file = tmp_path / "ramp.csv"
+    csv_file.write_text("t, x, n [INTEGER]\n" + "".join(f"{i}, {2 * i}, {i}\n" for i in range(1000)))
+    write_columns(csv_file, tmp_path / "ramp.columns")
+
+    class Ramp(CsvSlave):
+        data_file = "ramp.columns"
+
+    slave = Ramp(instance_name="ramp", resources=str(tmp_path))
+    slave.setup_experiment(0.0, None, None)
+
+    # Forward, backward and past the end of the data
+    for t, x, n in [(500.25, 1000.5, 500), (10.5, 21.0, 10), (0.0, 0.0, 0), (998.5, 1997.0, 998), (2000.0, 1998.0, 999)]:
+        slave.do_step(t - 0.25, 0.25)
+        assert slave.get_real([0]) == [pytest.approx(x)]
+        assert slave.get_integer([1]) == [n]
+
+    # Before the first row
+    slave.setup_experiment(-1.0, None, None)
+    assert slave.get_real([0]) == [0.0]
+
+    # Values computed once per step, for all columns
+    slave.do_step(0.0, 0.5)
+    values = slave.values()
+    assert slave.values() is values
+    assert values == [pytest.approx(1.0), 0]
+    slave.do_step(0.5, 0.5)
+    assert slave.values() is not values
+
+    slave.interpolate = False
+    slave.do_step(1.0, 0.5)
+    assert slave.get_real([0]) == [2.0]
+
+
+def test_csv_slave_streaming(tmp_path, monkeypatch):
+    csv_file = tmp_path / "ramp.csv"
+    csv_file.write_text("t, x, s [STRING]\n" + "".join(f"{i}, {2 * i}, \"{i}\"\n" for i in range(1000)))
+    write_columns(csv_file, tmp_path / "ramp.columns")
+
+    loaded = list()
+    released = list()
+    load = CsvData.load
+    monkeypatch.setattr(CsvData, "load", lambda self, first, last: (loaded.append((first, last)), load(self, first, last)))
+    release = CsvData.release
+    monkeypatch.setattr(CsvData, "release", lambda self, first, last: (released.append(first), release(self, first, last)))
+
+    class Ramp(CsvSlave):
+        data_file = "ramp.columns"
+        chunk_rows = 100
+
+    slave = Ramp(instance_name="ramp", resources=str(tmp_path))
+    slave.setup_experiment(0.0, None, None)
+    t = 0.0
+    while t < 350.0:
+        slave.do_step(t, 10.0)
+        t += 10.0
+        assert slave.get_real([0]) == [pytest.approx(2 * t)]
+        assert slave.get_string([1]) == [str(int(t))]
+
+    # Jump back
+    slave.do_step(0.0, 50.0)
+    assert slave.get_real([0]) == [pytest.approx(100.0)]
+
+    prefetcher = slave._prefetcher
+    slave.terminate()
+    prefetcher.join()
+    assert loaded == [(0, 100), (100, 200), (200, 300), (300, 400), (400, 500), (0, 100), (100, 200)]
+    assert released == [0, 100, 200, 300, 400]
+
+
+def test_csv_builder_chunk_rows(tmp_path):
+    with pytest.raises(ValueError, match="must be positive"):
+        csvbuilder.CsvFmuBuilder.build_FMU(DEMO_FILE, dest=tmp_path, chunk_rows=-1)
+    assert "chunk_rows = 500" in csvbuilder.create_csv_slave(DEMO_FILE, "csvdemo.columns", 500)
+
+
+def test_csv_builder_resources(tmp_path):
+    fmu = csvbuilder.CsvFmuBuilder.build_FMU(DEMO_FILE, dest=tmp_path)
+    with zipfile.ZipFile(fmu) as files:
+        # The CSV file is shipped along its conversion
+        assert files.read("resources/csvdemo.csv") == DEMO_FILE.read_bytes()
+        assert "resources/csvdemo.columns" in files.namelist()
+
+
+def test_csv_builder_cache(tmp_path, monkeypatch):
+    csv_file = tmp_path / "ramp.csv"
+    csv_file.write_text("t, x\n" + "".join(f"{i}, {2 * i}\n" for i in range(100)))
+    cache_dir = tmp_path / "cache"
+
+    conversions = list()
+    convert = csvbuilder.write_columns
+
+    def counted(*args):
+        conversions.append(args)
+        return convert(*args)
+
+    monkeypatch.setattr(csvbuilder, "write_columns", counted)
+
+    def build(dest, **options):
+        return csvbuilder.CsvFmuBuilder.build_FMU(csv_file, dest=dest, cache_dir=cache_dir, **options)
+
+    fmu = build(tmp_path / "first")
+    assert len(conversions) == 1
+
+    # Unchanged CSV and options, the FMU is copied without converting the CSV
+    copy = build(tmp_path / "second")
+    assert len(conversions) == 1
+    assert copy == tmp_path / "second" / fmu.name
+    assert copy.read_bytes() == fmu.read_bytes()
+    named = build(tmp_path / "named.fmu")
+    assert len(conversions) == 2
+    assert named == tmp_path / "named.fmu"
+
+    # Changed options and content
+    build(tmp_path / "third", interpolation="hold")
+    assert len(conversions) == 3
+    build(tmp_path / "fourth", chunk_rows=10)
+    assert len(conversions) == 4
+    csv_file.write_text("t, x\n0.0, 1.0\n")
+    build(tmp_path / "fifth")
+    assert len(conversions) == 5
+    build(tmp_path / "sixth")
+    assert len(conversions) == 5
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("x", ("x", Fmi2Type.real, None)),
+    ("n [1 INTEGER]", ("n", Fmi2Type.integer, None)),
+    ("real[1][REAL]", ("real[1]", Fmi2Type.real, None)),
+    ("mode [hold]", ("mode", Fmi2Type.real, "hold")),
+    ("p [REAL, cubic]", ("p", Fmi2Type.real, "cubic")),
+])
+def test_parse_header(header, expected):
+    assert csvbuilder.parse_header(header) == expected
+
+
+def test_cubic_coefficients():
+    times = [0.0, 1.0, 2.0, 3.0, 3.0, 4.0]
+    values = [0.0, 1.0, 4.0, 9.0, 0.0, 2.0]
+    coefficients = list(csvbuilder.cubic_coefficients(times, values))
+    assert len(coefficients) == len(times)
+
+    def value(i, s):
+        c0, c1, c2, c3 = coefficients[i]
+        return c0 + s * (c1 + s * (c2 + s * c3))
+
+    for i in range(len(times) - 1):
+        h = times[i + 1] - times[i]
+        assert value(i, 0.0) == values[i]
+        if h > 0:
+            # Continuous and monotone between the rows
+            assert value(i, h) == pytest.approx(values[i + 1])
+            samples = [value(i, h * k / 10) for k in range(11)]
+            assert samples == sorted(samples)
+    # The event at t=3 holds its value, as the last row
+    assert coefficients[3] == (9.0, 0.0, 0.0, 0.0)
+    assert coefficients[-1] == (2.0, 0.0, 0.0, 0.0)
+
+
+def test_csv_slave_interpolations(tmp_path, monkeypatch):
+    monkeypatch.setattr(csvbuilder, "CHUNK_ROWS", 3)
+    csv_file = tmp_path / "data.csv"
+    csv_file.write_text(
+        "t, linear [linear], cubic, mode [REAL hold], n [INTEGER]\n"
+        + "".join(f"{i}, {i * i}, {i * i}, {i * i}, {i}\n" for i in range(10))
+    )
+    write_columns(csv_file, tmp_path / "data.columns", interpolation="cubic")
+    data = CsvData(str(tmp_path / "data.columns"))
+    assert [c.interpolation for c in data.columns] == ["linear", "cubic", "hold", "hold"]
+    assert list(data.columns[1].coefficients[:4]) == pytest.approx([0.0, 1.0, -0.5, 0.5])
+
+    class Data(CsvSlave):
+        data_file = "data.columns"
+
+    slave = Data(instance_name="data", resources=str(tmp_path))
+    slave.setup_experiment(0.0, None, None)
+    slave.do_step(0.0, 4.5)
+    linear, cubic, mode = slave.get_real([0, 1, 2])
+    # Linear towards the row following the end of the next step (t=9)
+    assert linear == pytest.approx(16.0 + 0.1 * (81 - 16))
+    assert 16.0 < cubic < 25.0
+    assert cubic == pytest.approx(4.5 ** 2, rel=0.01)
+    assert mode == 16.0
+    assert slave.get_integer([3]) == [4]
+
+    # Setting the parameter changes the values of the current step
+    interpolate = slave._variable("interpolate").value_reference
+    slave.set_boolean([interpolate], [False])
+    assert slave.get_real([0, 1, 2]) == [16.0, 16.0, 16.0]
+    slave.set_boolean([interpolate], [True])
+    assert slave.get_real([0, 1, 2]) == [linear, cubic, mode]
+
+    slave.interpolate = False
+    slave.do_step(4.5, 0.25)
+    assert slave.get_real([0, 1, 2]) == [16.0, 16.0, 16.0]
+
+
+def test_interpolation_errors(tmp_path):
+    csv_file = tmp_path / "data.csv"
+    csv_file.write_text("t, n [INTEGER linear]\n0.0, 1\n")
+    with pytest.raises(ValueError, match="Column n of type integer can not be interpolated"):
+        write_columns(csv_file, tmp_path / "data.columns")
+
+    with pytest.raises(ValueError, match="Unsupported interpolation 'spline'"):
+        csvbuilder.CsvFmuBuilder.build_FMU(DEMO_FILE, dest=tmp_path, interpolation="spline")
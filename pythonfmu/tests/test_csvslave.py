@@ -2,6 +2,7 @@ import pytest
 from pathlib import Path
 
 from pythonfmu.csvbuilder import CsvFmuBuilder
+from pythonfmu.csvslave import Prefetcher
 
 fmpy = pytest.importorskip(
     "fmpy", reason="fmpy is not available for testing the produced FMU"
@@ -10,11 +11,12 @@ fmpy = pytest.importorskip(
 EPS = 1e-7
 
 
-def test_csvslave(tmp_path):
+@pytest.mark.parametrize("chunk_rows", [0, 2])
+def test_csvslave(tmp_path, chunk_rows):
 
     csv_file = Path(__file__).parent / "data/csvdemo.csv"
 
-    fmu = CsvFmuBuilder.build_FMU(csv_file, dest=tmp_path)
+    fmu = CsvFmuBuilder.build_FMU(csv_file, dest=tmp_path, chunk_rows=chunk_rows)
     assert fmu.exists()
 
     model_description = fmpy.read_model_description(fmu)
@@ -106,3 +108,24 @@ def test_csvslave(tmp_path):
         assert actual_reals[i] == pytest.approx(expected_reals[i], rel=EPS)
     assert actual_bools == expected_bools
     assert actual_strings == expected_strings
+
+
+def test_prefetcher_thread():
+
+    class Data:
+        def __init__(self):
+            self.loaded = []
+
+        def load(self, first, last):
+            self.loaded.append((first, last))
+
+    data = Data()
+    prefetcher = Prefetcher(data)
+    # Sub-interpreters do not allow daemon threads
+    assert not prefetcher._thread.daemon
+
+    prefetcher.request(0, 2)
+    prefetcher.stop()
+    prefetcher.join()
+    assert not prefetcher._thread.is_alive()
+    assert data.loaded == [(0, 2)]
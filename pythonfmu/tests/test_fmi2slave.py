@@ -1,7 +1,13 @@
+import subprocess
+import sys
+from array import array
+
 import pytest
 
-from pythonfmu import Fmi2Slave
+from pythonfmu import Boolean, Fmi2Slave, Integer, Real, String
 from pythonfmu import __version__ as VERSION
+from pythonfmu.enums import Fmi2Causality, Fmi2DependencyKind, Fmi2Status, Fmi2Variability
+from pythonfmu.logmsg import LOG_RECORD
 
 from .utils import FMI2PY, PY2FMI
 
@@ -150,3 +156,473 @@ def test_Fmi2Slave_customized_log_categories(new_categories):
             assert categories.find(f"Category[@name='{category}'][@description='{description}']") is not None
     else:
         assert categories is None
+
+
+@pytest.mark.parametrize("fmi_type", FMI2PY)
+@pytest.mark.parametrize("value", [
+    False,
+    22,
+    2./3.,
+    "hello_world",
+])
+def test_Fmi2Slave_compiled_accessors(fmi_type, value):
+
+    class Slave(Fmi2Slave):
+
+        compiled_accessors = True
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.var = None
+            self.register_variable(PY2FMI[type(value)]("var"))
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    py_type = FMI2PY[fmi_type]
+    fmi_type_name = fmi_type.__qualname__.lower()
+    set_method = getattr(slave, f"set_{fmi_type_name}")
+    get_method = getattr(slave, f"get_{fmi_type_name}")
+
+    if type(value) is py_type:
+        set_method([0], [value])
+        assert get_method([0]) == [value]
+    else:
+        with pytest.raises(TypeError):
+            set_method([0], [value])
+        with pytest.raises(TypeError):
+            get_method([0])
+
+
+def test_Fmi2Slave_compiled_accessors_invalidated_on_register():
+
+    class Slave(Fmi2Slave):
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.a = 1.0
+            self.b = 2.0
+            self.register_variable(Real("a"))
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    slave.compile_accessors()
+    assert slave.get_real([0]) == [1.0]
+
+    slave.register_variable(Real("b"))
+    assert slave.get_real([0, 1]) == [1.0, 2.0]
+    with pytest.raises(TypeError):
+        slave.get_real([2])
+
+
+def test_Fmi2Slave_compiled_accessors_read_only():
+
+    class Slave(Fmi2Slave):
+
+        compiled_accessors = True
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.register_variable(Real("var", getter=lambda: 3.0))
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    assert slave.get_real([0]) == [3.0]
+    with pytest.raises(TypeError):
+        slave.set_real([0], [1.0])
+
+
+def test_Fmi2Slave_real_buffers():
+
+    class Slave(Fmi2Slave):
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.a = 1.0
+            self.b = 2.0
+            self.register_variable(Real("a"))
+            self.register_variable(Real("b"))
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    # The wrapper passes byte memoryviews over the arrays of the FMI call
+    vrs = memoryview(array("I", [1, 0]).tobytes())
+
+    values = array("d", [0.0, 0.0])
+    slave._get_real_buffer(vrs, memoryview(values).cast("B"))
+    assert values.tolist() == [2.0, 1.0]
+
+    slave._set_real_buffer(vrs, memoryview(array("d", [5.0, 4.0]).tobytes()))
+    assert slave.get_real([0, 1]) == [4.0, 5.0]
+
+
+def test_Fmi2Slave_real_buffers_override():
+
+    class Slave(Fmi2Slave):
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.state = [10.0, 20.0]
+
+        def get_real_buffer(self, vrs, values):
+            for i, vr in enumerate(vrs):
+                values[i] = self.state[vr]
+
+        def set_real_buffer(self, vrs, values):
+            for vr, value in zip(vrs, values):
+                self.state[vr] = value
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    values = bytearray(array("d").itemsize)
+    slave._get_real_buffer(array("I", [1]).tobytes(), values)
+    assert array("d", values).tolist() == [20.0]
+
+    slave._set_real_buffer(array("I", [0]).tobytes(), array("d", [1.5]).tobytes())
+    assert slave.state == [1.5, 20.0]
+
+
+def test_Fmi2Slave_log_filter():
+
+    class Slave(Fmi2Slave):
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="instance")
+    slave._set_debug_logging(False)
+    slave.log("dropped", Fmi2Status.error)
+    assert slave.log_queue == []
+
+    slave._set_debug_logging(True, ("logStatusError",))
+    slave.log("dropped", Fmi2Status.warning)
+    slave.log("kept", Fmi2Status.error)
+    slave.log("kept wörld", Fmi2Status.ok, "logStatusError")
+    assert [m.msg for m in slave.log_queue] == ["kept", "kept wörld"]
+
+    queue = slave.log_queue
+    packed = slave._pack_log_queue()
+    assert slave.log_queue is queue and queue == []
+
+    status, category_size, msg_size = LOG_RECORD.unpack_from(packed)
+    assert status == Fmi2Status.error
+    assert packed[LOG_RECORD.size:LOG_RECORD.size + category_size] == b"logStatusError"
+    assert len(packed) == 2 * LOG_RECORD.size + 2 * len(b"logStatusError") + len(b"kept") + len("kept wörld".encode("utf-8"))
+
+
+def test_Fmi2Slave_runtime_imports():
+    # The FMU wrapper only imports what is needed to run a slave
+    code = (
+        "import sys\n"
+        "from pythonfmu import Fmi2Slave, Real\n"
+        "class Slave(Fmi2Slave):\n"
+        "    def do_step(self, t, dt):\n"
+        "        return True\n"
+        "slave = Slave(instance_name='instance')\n"
+        "slave.register_variable(Real('x'))\n"
+        "slave.do_step(0.0, 1.0)\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    modules = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout.split()
+
+    for module in ("pythonfmu.builder", "zipfile", "xml.etree.ElementTree", "uuid", "datetime", "json"):
+        assert module not in modules
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_Fmi2Slave_register_array(compiled):
+
+    class Slave(Fmi2Slave):
+
+        compiled_accessors = compiled
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.gain = 2.0
+            self.x = [0.0, 1.0, 2.0, 3.0]
+            self.counts = array("i", [5, 6, 7])
+            self.register_variable(Real("gain", causality=Fmi2Causality.parameter, variability=Fmi2Variability.tunable))
+            self.x_vrs = self.register_array("x", causality=Fmi2Causality.output)
+            self.counts_vrs = self.register_array(
+                "counts", Integer, causality=Fmi2Causality.input, variability=Fmi2Variability.discrete
+            )
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    assert slave.x_vrs == range(1, 5)
+    assert slave.counts_vrs == range(5, 8)
+    assert [v.name for v in slave.vars.values()] == ["gain", "x[0]", "x[1]", "x[2]", "x[3]", "counts[0]", "counts[1]", "counts[2]"]
+
+    # Runs within a block are slices, other requests go through the element variables
+    assert slave.get_real([1, 2, 3, 4]) == [0.0, 1.0, 2.0, 3.0]
+    assert slave.get_real([2, 3]) == [1.0, 2.0]
+    assert slave.get_real([4, 0, 1]) == [3.0, 2.0, 0.0]
+    assert slave.get_integer([6, 7]) == [6, 7]
+
+    slave.set_real([2, 3], [10.0, 20.0])
+    slave.set_integer([5, 6, 7], [1, 2, 3])
+    slave.set_real([4, 0], [30.0, 4.0])
+    assert slave.x == [0.0, 10.0, 20.0, 30.0]
+    assert slave.counts == array("i", [1, 2, 3])
+    assert slave.gain == 4.0
+
+    values = bytearray(8 * 4)
+    slave._get_real_buffer(array("I", slave.x_vrs).tobytes(), values)
+    assert array("d", bytes(values)).tolist() == [0.0, 10.0, 20.0, 30.0]
+
+    with pytest.raises(TypeError):
+        slave.get_integer([1, 2])
+
+    # The attribute may be replaced, states copy the whole sequence
+    slave.x = [1.0, 1.0, 1.0, 1.0]
+    state = slave._get_fmu_state()
+    assert state["x"] == [1.0, 1.0, 1.0, 1.0]
+    assert "x[0]" not in state
+    slave.set_real(slave.x_vrs, [0.0] * 4)
+    slave._set_fmu_state(state)
+    assert slave.get_real(slave.x_vrs) == [1.0] * 4
+
+    xml = slave.to_xml()
+    nodes = xml.findall(".//ScalarVariable")
+    assert [n.get("name") for n in nodes[5:]] == ["counts[0]", "counts[1]", "counts[2]"]
+    assert [n.find("Integer").get("start") for n in nodes[5:]] == ["1", "2", "3"]
+
+
+def test_Fmi2Slave_register_array_numpy():
+    np = pytest.importorskip("numpy")
+
+    class Slave(Fmi2Slave):
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.state = np.zeros(1000)
+            self.flags = np.zeros(3, dtype=bool)
+            self.register_array("state", causality=Fmi2Causality.output)
+            self.register_array("flags", Boolean, variability=Fmi2Variability.constant)
+
+        def do_step(self, t, dt):
+            self.state += dt
+            return True
+
+    slave = Slave(instance_name="slaveInstance")
+    slave.set_real(list(range(10, 20)), [1.5] * 10)
+    slave.do_step(0.0, 0.5)
+    values = slave.get_real(list(range(1000)))
+    assert values[10:20] == [2.0] * 10
+    assert values[0] == 0.5
+    assert all(type(v) is float for v in values)
+    assert slave.get_boolean([1000, 1001]) == [False, False]
+
+    state = slave._get_fmu_state()
+    slave.do_step(0.5, 0.5)
+    slave._set_fmu_state(state)
+    assert slave.get_real([0]) == [0.5]
+
+    # Serialized without pickle
+    slave.do_step(0.5, 0.5)
+    slave._set_fmu_state(Slave._fmu_state_from_bytes(Slave._fmu_state_to_bytes(state)))
+    assert slave.get_real([0, 10]) == [0.5, 2.0]
+    assert isinstance(slave.state, np.ndarray)
+
+
+def test_Fmi2Slave_write_xml():
+    from io import BytesIO
+    from xml.etree.ElementTree import SubElement, canonicalize, fromstring, tostring
+
+    class Annotated(Real):
+        __slots__ = ()
+
+        def to_xml(self):
+            node = super().to_xml()
+            SubElement(node, "Annotations")
+            return node
+
+    class Slave(Fmi2Slave):
+        description = 'Quotes " and <tags> & \nnew lines'
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.x = 1.0 / 3.0
+            self.n = 3
+            self.flag = True
+            self.label = "a & b"
+            self.y = 2.0
+            self.register_variable(Real("x", causality=Fmi2Causality.output))
+            self.register_variable(Integer("n", causality=Fmi2Causality.parameter, variability=Fmi2Variability.tunable))
+            self.register_variable(Boolean("flag", causality=Fmi2Causality.output))
+            self.register_variable(String("label", causality=Fmi2Causality.parameter, variability=Fmi2Variability.fixed))
+            self.register_variable(Annotated("y", causality=Fmi2Causality.input))
+
+        def do_step(self, t, dt):
+            return True
+
+    calls = list()
+    slave = Slave(instance_name="instance")
+    get_real = slave.get_real
+    slave.get_real = lambda vrs: (calls.append(vrs), get_real(vrs))[1]
+
+    stream = BytesIO()
+    slave.write_xml(stream, dict(canGetAndSetFMUstate=True))
+    assert not stream.closed
+    assert calls == [[4]]
+
+    written = fromstring(stream.getvalue())
+    expected = slave.to_xml(dict(canGetAndSetFMUstate=True))
+    for node in (written, expected):
+        node.attrib.pop("generationDateAndTime")
+    assert written.attrib["description"] == Slave.description
+    def canonical(node):
+        return canonicalize(tostring(node), strip_text=True)
+
+    assert canonical(written.find("ModelVariables")) == canonical(expected.find("ModelVariables"))
+    assert canonical(written.find("ModelStructure")) == canonical(expected.find("ModelStructure"))
+    assert written.attrib == expected.attrib
+    assert written.find("CoSimulation").attrib == expected.find("CoSimulation").attrib
+    assert written.find("CoSimulation").get("canGetAndSetFMUstate") == "true"
+    assert [n.get("index") for n in written.find("ModelStructure/Outputs")] == ["1", "3"]
+    assert written.find(".//ScalarVariable[5]/Annotations") is not None
+    assert written.find(".//ScalarVariable[4]/String").get("start") == "a & b"
+
+
+class DependentSlave(Fmi2Slave):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.u1 = 1.0
+        self.u2 = 2.0
+        self.gain = 3.0
+        self.x = 0.0
+        self.der_x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.n = 0
+        self.register_variable(Real("u1", causality=Fmi2Causality.input))
+        self.register_variable(Real("u2", causality=Fmi2Causality.input))
+        self.register_variable(Real("gain", causality=Fmi2Causality.parameter, variability=Fmi2Variability.fixed))
+        self.register_variable(Real("x", causality=Fmi2Causality.local))
+        self.register_variable(Real("der_x", causality=Fmi2Causality.local, derivative=3))
+        self.register_variable(Real("y", causality=Fmi2Causality.output))
+        self.register_variable(Real("z", causality=Fmi2Causality.output))
+        self.register_variable(Integer("n", causality=Fmi2Causality.output, variability=Fmi2Variability.discrete))
+
+    def do_step(self, t, dt):
+        self.der_x = self.u1
+        self.x += self.der_x * dt
+        self.y = self.gain * self.u2
+        self.n += 1
+        return True
+
+
+def test_Fmi2Slave_declare_dependencies():
+    from io import BytesIO
+    from xml.etree.ElementTree import fromstring
+
+    slave = DependentSlave(instance_name="instance")
+    slave.declare_dependencies("y", ["u2", "u1"], [Fmi2DependencyKind.dependent, Fmi2DependencyKind.fixed])
+    slave.declare_dependencies("n", [])
+    slave.declare_dependencies("der_x", ["x", "u1"])
+    slave.declare_dependencies("y", ["gain"], initial=True)
+
+    stream = BytesIO()
+    slave.write_xml(stream)
+    for xml in (slave.to_xml(), fromstring(stream.getvalue())):
+        structure = xml.find("ModelStructure")
+        assert [node.tag for node in structure] == ["Outputs", "Derivatives", "InitialUnknowns"]
+        assert xml.find(".//ScalarVariable[5]/Real").get("derivative") == "4"
+        assert [n.attrib for n in structure.find("Outputs")] == [
+            {"index": "6", "dependencies": "1 2", "dependenciesKind": "fixed dependent"},
+            {"index": "7"},
+            {"index": "8", "dependencies": ""},
+        ]
+        assert [n.attrib for n in structure.find("Derivatives")] == [{"index": "5", "dependencies": "1 4"}]
+        assert [n.attrib for n in structure.find("InitialUnknowns")] == [
+            {"index": "4"}, {"index": "5"}, {"index": "6", "dependencies": "3"}, {"index": "7"}, {"index": "8"}
+        ]
+
+
+@pytest.mark.parametrize("unknown, dependencies, options, message", [
+    ("w", [], dict(), "Unknown variable 'w'"),
+    ("y", ["w"], dict(), "Unknown variable 'w'"),
+    ("u1", [], dict(), "'u1' is neither an output nor a derivative"),
+    ("y", ["gain"], dict(), "'y' may only depend on inputs and states, not on 'gain'"),
+    ("y", ["u1"], dict(kinds=[]), "0 dependency kinds given for the 1 dependencies of 'y'"),
+    ("gain", [], dict(initial=True), "'gain' is not an initial unknown"),
+    ("y", ["x"], dict(initial=True), "'y' may only depend on inputs and variables with exact initial value, not on 'x'"),
+    ("y", ["u1"], dict(initial=True, kinds=[Fmi2DependencyKind.tunable]), "may only have dependent or constant dependencies"),
+])
+def test_Fmi2Slave_declare_dependencies_errors(unknown, dependencies, options, message):
+    slave = DependentSlave(instance_name="instance")
+    with pytest.raises(ValueError, match=message):
+        slave.declare_dependencies(unknown, dependencies, **options)
+
+
+def test_Fmi2Slave_trace_dependencies():
+    slave = DependentSlave(instance_name="instance")
+    slave.declare_dependencies("n", [])
+    # All the outputs assigned depend on all the inputs read and on the states
+    assert slave.trace_dependencies([(0.0, 0.1)]) == {"y": ["u1", "u2", "x"]}
+    # The state is restored after the traced step
+    assert (slave.x, slave.y, slave.n) == (0.0, 0.0, 0)
+    # Nothing is declared
+    assert [n.attrib for n in slave.to_xml().find("ModelStructure/Outputs")] == [
+        {"index": "6"}, {"index": "7"}, {"index": "8", "dependencies": ""}
+    ]
+
+
+def test_Fmi2Slave_trace_dependencies_branches():
+
+    class Slave(DependentSlave):
+
+        def do_step(self, t, dt):
+            self.y = self.u1 if t < 1 else self.u2
+            if t >= 2:
+                self.z = 0.0
+            self.count = self.n + 1
+            self.n += 1
+            return True
+
+    slave = Slave(instance_name="instance")
+    # One step only sees the branch it takes
+    assert slave.trace_dependencies([(0.0, 0.1)]) == {
+        "y": ["u1", "x"], "n": ["u1", "x"]
+    }
+    # The inputs read in any sample
+    traced = slave.trace_dependencies([(0.0, 0.1), (1.0, 0.1), (2.0, 0.1)])
+    assert traced == {"y": ["u1", "u2", "x"], "z": ["u1", "u2", "x"], "n": ["u1", "u2", "x"]}
+    for output, dependencies in traced.items():
+        slave.declare_dependencies(output, dependencies)
+    assert [n.attrib for n in slave.to_xml().find("ModelStructure/Outputs")] == [
+        {"index": "6", "dependencies": "1 2 4"}, {"index": "7", "dependencies": "1 2 4"},
+        {"index": "8", "dependencies": "1 2 4"}
+    ]
+    # The attributes assigned by the steps are restored, registered or not
+    assert slave.n == 0
+    assert not hasattr(slave, "count")
+
+
+def test_Fmi2Slave_trace_dependencies_no_input():
+
+    class Slave(DependentSlave):
+
+        def do_step(self, t, dt):
+            # The inputs are only read after the first step
+            if self.n > 0:
+                self.y = self.u1
+            self.n += 1
+            return True
+
+    # No input read, the outputs keep depending on all the inputs and states
+    assert Slave(instance_name="instance").trace_dependencies([(0.0, 0.1), (1.0, 0.1)]) == {}
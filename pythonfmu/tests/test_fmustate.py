@@ -0,0 +1,195 @@
+import json
+import pickle
+import struct
+from array import array
+from collections import OrderedDict
+
+import pytest
+
+from pythonfmu import Fmi2Slave
+from pythonfmu.fmustate import HEADER, MAGIC, MAX_SNAPSHOT_DEPTH, VERSION, decode_state, encode_state
+from pythonfmu.variables import Real, String
+
+
+STATE = {
+    "real": 2. / 3.,
+    "integer": -42,
+    "big_integer": 2 ** 70,
+    "boolean": True,
+    "string": "hello wörld",
+    "array": array("d", [1.0, 2.0, 3.0]),
+    "nested": {"a": 1.0, "b": array("i", [4, 5])},
+    "object": [1, None, {"x": [2.5]}],
+    "": 0.0,
+}
+
+
+def test_state_roundtrip():
+    state = decode_state(encode_state(STATE))
+
+    assert state == STATE
+    assert list(state) == list(STATE)
+    assert type(state["boolean"]) is bool
+    assert state["array"].typecode == "d"
+
+
+@pytest.mark.parametrize("value", [(1, 2), complex(1, 2), OrderedDict(a=1.0), [OrderedDict(a=1.0)], {1: "a"}])
+def test_state_rejects_values_changing_type(value):
+    with pytest.raises(TypeError, match="FMU state entry 'x': .* can not be serialized as JSON"):
+        encode_state({"x": value})
+
+
+def test_state_pickle_encoder():
+    state = {"tuple": (1, None, complex(1, 2)), "ordered": OrderedDict(b=1.0, a=2.0)}
+    restored = decode_state(encode_state(state, pickle), pickle)
+
+    assert restored == state
+    assert type(restored["ordered"]) is OrderedDict
+    # Without pickle, the pickled values are not loaded
+    with pytest.raises(ValueError):
+        decode_state(encode_state(state, pickle))
+
+
+def test_state_is_compact():
+    state = dict((f"x{i}", i / 3.) for i in range(1000))
+    data = encode_state(state)
+
+    assert data.startswith(MAGIC)
+    assert len(data) < len(json.dumps(state))
+
+
+def test_state_legacy_json():
+    assert decode_state(json.dumps({"x": 1.0, "s": "a"}).encode("utf-8")) == {"x": 1.0, "s": "a"}
+
+
+def test_state_corrupted_schema():
+    data = bytearray(encode_state({"x": 1.0}))
+    data[HEADER.size + 3] ^= 0xFF
+
+    with pytest.raises(ValueError):
+        decode_state(bytes(data))
+
+
+def test_state_unsupported_version():
+    data = bytearray(encode_state({"x": 1.0}))
+    struct.pack_into("<H", data, len(MAGIC), VERSION + 1)
+
+    with pytest.raises(ValueError):
+        decode_state(bytes(data))
+
+
+def test_state_custom_encoder():
+
+    class Encoder:
+
+        @staticmethod
+        def dumps(obj):
+            return repr(obj).encode("utf-8")
+
+        @staticmethod
+        def loads(data):
+            return f"decoded {data.decode('utf-8')}"
+
+    class Slave(Fmi2Slave):
+
+        state_encoder = Encoder
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.x = 1.0
+            self.register_variable(Real("x"))
+
+        def do_step(self, t, dt):
+            return True
+
+    slave = Slave(instance_name="instance")
+    state = slave._get_fmu_state()
+    state["extra"] = [1, 2]
+
+    restored = Slave._fmu_state_from_bytes(Slave._fmu_state_to_bytes(state))
+    assert restored == {"x": 1.0, "extra": "decoded [1, 2]"}
+
+
+class SnapshotSlave(Fmi2Slave):
+
+    incremental_snapshots = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.x = 0.0
+        self.y = 0.0
+        self.text = "a"
+        self.register_variable(Real("x"))
+        self.register_variable(Real("y"))
+        self.register_variable(String("text"))
+
+    def do_step(self, t, dt):
+        self.x += dt
+        return True
+
+
+def test_incremental_snapshots():
+    slave = SnapshotSlave(instance_name="instance")
+    first = slave._get_fmu_state()
+    slave.do_step(0.0, 1.0)
+    second = slave._get_fmu_state()
+
+    assert dict(first) == {"x": 0.0, "y": 0.0, "text": "a"}
+    assert dict(second) == {"x": 1.0}
+    assert second.base is first
+    assert second.resolve() == {"x": 1.0, "y": 0.0, "text": "a"}
+
+    slave.do_step(0.0, 1.0)
+    slave._set_fmu_state(first)
+    assert slave.x == 0.0
+    slave._set_fmu_state(second)
+    assert slave.x == 1.0
+
+    restored = SnapshotSlave._fmu_state_from_bytes(SnapshotSlave._fmu_state_to_bytes(second))
+    assert restored == {"x": 1.0, "y": 0.0, "text": "a"}
+
+
+def test_incremental_snapshots_depth_is_bounded():
+    slave = SnapshotSlave(instance_name="instance")
+    snapshots = list()
+    for _ in range(MAX_SNAPSHOT_DEPTH + 2):
+        snapshots.append(slave._get_fmu_state())
+        slave.do_step(0.0, 1.0)
+
+    assert snapshots[MAX_SNAPSHOT_DEPTH].depth == MAX_SNAPSHOT_DEPTH
+    assert snapshots[MAX_SNAPSHOT_DEPTH + 1].depth == 0
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_update_snapshot_in_place(incremental):
+    slave = SnapshotSlave(instance_name="instance")
+    slave.incremental_snapshots = incremental
+    first = slave._get_fmu_state()
+    slave.do_step(0.0, 1.0)
+    second = slave._get_fmu_state()
+    slave.do_step(0.0, 1.0)
+    slave.text = "b"
+
+    assert slave._update_fmu_state(first) is first
+    assert first.resolve() == {"x": 2.0, "y": 0.0, "text": "b"}
+    # Snapshots taken on top of the overwritten one keep their values
+    assert second.resolve() == {"x": 1.0, "y": 0.0, "text": "a"}
+
+    slave._set_fmu_state(second)
+    assert (slave.x, slave.text) == (1.0, "a")
+    slave._set_fmu_state(first)
+    assert (slave.x, slave.text) == (2.0, "b")
+
+
+def test_update_snapshot_with_custom_state():
+
+    class Slave(SnapshotSlave):
+
+        def _get_fmu_state(self):
+            return {"x": self.x}
+
+    slave = Slave(instance_name="instance")
+    state = slave._get_fmu_state()
+    slave.do_step(0.0, 1.0)
+
+    assert slave._update_fmu_state(state) == {"x": 1.0}
@@ -1,4 +1,8 @@
+import json
 import math
+import os
+import subprocess
+import sys
 from pathlib import Path
 
 import pytest
@@ -30,6 +34,16 @@ def test_integration_demo(tmp_path):
     assert res["realOut"][-1] == pytest.approx(res["time"][-1], rel=1e-7)
 
 
+@pytest.mark.integration
+def test_integration_precompiled(tmp_path):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    fmu = FmuBuilder.build_FMU(script_file, dest=tmp_path, needsExecutionTool="false", precompile=True)
+    assert fmu.exists()
+    res = fmpy.simulate_fmu(str(fmu), stop_time=0.5, validate=False)
+
+    assert res["realOut"][-1] == pytest.approx(res["time"][-1], rel=1e-7)
+
+
 @pytest.mark.integration
 def test_integration_reset(tmp_path):
     script_file = Path(__file__).parent / "slaves/pythonslave.py"
@@ -65,6 +79,53 @@ def test_integration_reset(tmp_path):
     model.freeInstance()
 
 
+@pytest.mark.integration
+def test_integration_instantiate_many(tmp_path):
+    script_file = Path(__file__).parent / "slaves/pythonslave.py"
+    fmu = FmuBuilder.build_FMU(script_file, dest=tmp_path, needsExecutionTool="false")
+    assert fmu.exists()
+
+    md = fmpy.read_model_description(str(fmu), validate=False)
+    unzipdir = fmpy.extract(str(fmu))
+    vr = mapped(md)["realOut"].valueReference
+
+    def instantiate(instance_name):
+        model = fmpy.fmi2.FMU2Slave(guid=md.guid,
+                                    unzipDirectory=unzipdir,
+                                    modelIdentifier=md.coSimulation.modelIdentifier,
+                                    instanceName=instance_name
+                                    )
+        model.instantiate()
+        model.setupExperiment()
+        model.enterInitializationMode()
+        model.exitInitializationMode()
+        return model
+
+    def step(model):
+        model.doStep(0.0, 0.1, True)
+        return model.getReal([vr])[0]
+
+    # Building imported the original script, the FMU must import the copy of its resources
+    sys.modules.pop("pythonslave", None)
+
+    # The slave class is resolved once, then reused by the next instantiations
+    models = [instantiate(f"instance{i}") for i in range(5)]
+    for model in models:
+        assert step(model) == pytest.approx(0.1, rel=1e-7)
+
+    # Changing the module file invalidates the cached class
+    module = Path(unzipdir) / "resources" / "pythonslave.py"
+    module.write_text(module.read_text().replace("self.realOut = current_time + step_size",
+                                                 "self.realOut = 2 * (current_time + step_size)"))
+    models.append(instantiate("changed"))
+    assert step(models[-1]) == pytest.approx(0.2, rel=1e-7)
+
+    for model in models:
+        model.terminate()
+        model.freeInstance()
+    sys.modules.pop("pythonslave", None)
+
+
 @pytest.mark.integration
 def test_integration_get_state(tmp_path):
     script_file = Path(__file__).parent / "slaves/pythonslave.py"
@@ -354,3 +415,126 @@ def test_integration_throw_py_error(tmp_path):
 
     with pytest.raises(Exception):
         fmpy.simulate_fmu(str(fmu), stop_time=1.0)
+
+
+PERF_STATS_SLAVE = """
+import json
+
+from pythonfmu import Fmi2Causality, Fmi2Slave, Real, String
+
+
+class PerfSlave(Fmi2Slave):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.realIn = 0.0
+        self.realOut = 0.0
+        self.register_variable(Real("realIn", causality=Fmi2Causality.input))
+        self.register_variable(Real("realOut", causality=Fmi2Causality.output))
+        self.register_variable(String("stats", getter=lambda: json.dumps(self.perf_stats())))
+
+    def do_step(self, current_time, step_size):
+        self.realOut = self.realIn + current_time
+        return True
+"""
+
+PERF_STATS_DRIVER = """
+import json
+import sys
+import fmpy
+from fmpy.fmi2 import FMU2Slave, fmi2CallbackFunctions, fmi2CallbackLoggerTYPE
+
+fmu = sys.argv[1]
+md = fmpy.read_model_description(fmu, validate=False)
+model = FMU2Slave(guid=md.guid, unzipDirectory=fmpy.extract(fmu),
+                  modelIdentifier=md.coSimulation.modelIdentifier, instanceName="instance")
+callbacks = fmi2CallbackFunctions()
+callbacks.logger = fmi2CallbackLoggerTYPE(lambda env, name, status, category, msg: print(msg.decode()))
+callbacks.allocateMemory = fmpy.fmi2.fmi2CallbackAllocateMemoryTYPE(fmpy.calloc)
+callbacks.freeMemory = fmpy.fmi2.fmi2CallbackFreeMemoryTYPE(fmpy.free)
+model.instantiate(callbacks=callbacks, loggingOn=True)
+model.setupExperiment()
+model.enterInitializationMode()
+model.exitInitializationMode()
+outputs = list()
+for i in range(3):
+    model.setReal([0], [10.0 * i])
+    model.doStep(i * 0.1, 0.1)
+    outputs.extend(model.getReal([1]))
+print(model.getString([2])[0].decode())
+print(json.dumps(outputs))
+try:
+    # Setting a String variable as Real fails, with deferred sets on the next call waiting for a result
+    model.setReal([2], [1.0])
+    print("set ok")
+    model.doStep(0.3, 0.1)
+    print("no error")
+except Exception:
+    print("error")
+model.freeInstance()
+"""
+
+
+def run_perf_stats_driver(fmu, **variables):
+    # The wrapper reads the environment variables once per process
+    env = dict(os.environ)
+    for name in ("PYTHONFMU_PERF_STATS", "PYTHONFMU_EXECUTION_MODE", "PYTHONFMU_WORKER_DEFER_SETS"):
+        env.pop(name, None)
+    env.update(variables)
+    return subprocess.run(
+        [sys.executable, "-c", PERF_STATS_DRIVER, str(fmu)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout.splitlines()
+
+
+@pytest.fixture
+def perf_stats_fmu(tmp_path):
+    script_file = tmp_path / "orig" / "perfslave.py"
+    script_file.parent.mkdir(parents=True, exist_ok=True)
+    script_file.write_text(PERF_STATS_SLAVE)
+    return FmuBuilder.build_FMU(script_file, dest=tmp_path, needsExecutionTool="false")
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("mode", ["inline", "worker"])
+@pytest.mark.parametrize("enabled", [True, False])
+def test_integration_perf_stats(perf_stats_fmu, enabled, mode):
+    variables = dict(PYTHONFMU_EXECUTION_MODE=mode)
+    if enabled:
+        variables["PYTHONFMU_PERF_STATS"] = "1"
+    output = run_perf_stats_driver(perf_stats_fmu, **variables)
+
+    stats = json.loads(output[0])
+    if not enabled:
+        assert stats is None
+        assert not any(line.startswith("Performance statistics") for line in output)
+    else:
+        assert stats["DoStep"]["total"]["count"] == 3
+        assert stats["GetReal"]["python"]["count"] == 3
+        assert stats["SetReal"]["python"]["count"] == 3
+        assert sum(stats["DoStep"]["gil_wait"]["histogram"]) == 3
+        assert stats["DoStep"]["total"]["max"] >= stats["DoStep"]["python"]["max"] > 0
+        assert "Instantiate" in stats
+        assert any(line.startswith("Performance statistics") for line in output)
+        assert any(line.strip().startswith("DoStep: 3 calls") for line in output)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("mode", ["inline", "worker", "subinterpreter", "process"])
+def test_integration_execution_mode(perf_stats_fmu, mode):
+    output = run_perf_stats_driver(perf_stats_fmu, PYTHONFMU_EXECUTION_MODE=mode)
+
+    assert json.loads(output[1]) == pytest.approx([0.0, 10.1, 20.2])
+    # The failing fmi2SetReal reports the error itself
+    assert "set ok" not in output
+    assert output[-1] == "error"
+
+
+@pytest.mark.integration
+def test_integration_worker_deferred_sets(perf_stats_fmu):
+    output = run_perf_stats_driver(perf_stats_fmu, PYTHONFMU_EXECUTION_MODE="worker", PYTHONFMU_WORKER_DEFER_SETS="1")
+
+    assert json.loads(output[1]) == pytest.approx([0.0, 10.1, 20.2])
+    # Reported by the next call waiting for a result
+    assert "set ok" in output
+    assert output[-1] == "error"
@@ -0,0 +1,155 @@
+import struct
+from pathlib import Path
+
+import pytest
+
+from pythonfmu.enums import Fmi2Status
+from pythonfmu.remote import RemoteError, RemoteSlave
+
+SLAVES = Path(__file__).parent / "slaves"
+
+REMOTE_SLAVE = """
+import os
+
+from pythonfmu import Boolean, Fmi2Causality, Fmi2Slave, Integer, Real, String
+
+
+class RemoteTestSlave(Fmi2Slave):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.realIn = 0.0
+        self.realOut = 0.0
+        self.pid = str(os.getpid())
+        self.register_variable(Real("realIn", causality=Fmi2Causality.input))
+        self.register_variable(Real("realOut", causality=Fmi2Causality.output))
+        self.register_variable(String("pid", causality=Fmi2Causality.output))
+        self.intIn = 0
+        self.boolIn = False
+        self.register_variable(Integer("intIn", causality=Fmi2Causality.input))
+        self.register_variable(Boolean("boolIn", causality=Fmi2Causality.input))
+
+    def do_step(self, current_time, step_size):
+        self.realOut = self.realIn + step_size
+        self.log("stepped", category="logAll")
+        if current_time < 0:
+            os._exit(3)
+        return True
+"""
+
+
+@pytest.fixture
+def slave(tmp_path):
+    (tmp_path / "remoteslave.py").write_text(REMOTE_SLAVE)
+    (tmp_path / "slavemodule.txt").write_text("remoteslave")
+    slave = RemoteSlave(instance_name="remote", resources=str(tmp_path))
+    yield slave
+    slave.close()
+
+
+def test_remote_slave_runs_in_worker_process(slave):
+    import os
+
+    pid = slave.get_string([2])[0]
+    assert pid != str(os.getpid())
+
+    slave.set_real([0], [1.5])
+    assert slave.do_step(0.0, 0.5)
+    assert slave.get_real([1]) == [2.0]
+
+
+def test_remote_slave_class_from_manifest(tmp_path):
+    derived = "\n\nclass DerivedSlave(RemoteTestSlave):\n    def do_step(self, current_time, step_size):\n        return False\n"
+    (tmp_path / "remoteslave.py").write_text(REMOTE_SLAVE + derived)
+    (tmp_path / "slavemodule.txt").write_text("remoteslave")
+
+    # Without manifest, the class deriving the deepest from Fmi2Slave is found
+    slave = RemoteSlave(instance_name="remote", resources=str(tmp_path))
+    try:
+        assert not slave.do_step(0.0, 1.0)
+    finally:
+        slave.close()
+
+    (tmp_path / "slaveclass.txt").write_text("remoteslave.RemoteTestSlave")
+    slave = RemoteSlave(instance_name="remote", resources=str(tmp_path))
+    try:
+        assert slave.do_step(0.0, 1.0)
+    finally:
+        slave.close()
+
+
+def test_remote_slave_real_buffers(slave):
+    vrs = struct.pack("=2I", 0, 1)
+    slave._set_real_buffer(vrs, struct.pack("=2d", 4.0, 0.0))
+    slave.do_step(0.0, 1.0)
+
+    values = bytearray(16)
+    slave._get_real_buffer(vrs, values)
+    assert struct.unpack("=2d", values) == (4.0, 5.0)
+
+    # Calls larger than the initial buffer remap a bigger one
+    size = 10000
+    values = bytearray(8 * size)
+    slave._get_real_buffer(struct.pack(f"={size}I", *([1] * size)), values)
+    assert set(struct.unpack(f"={size}d", values)) == {5.0}
+
+
+def test_remote_slave_integer_boolean(slave):
+    slave.set_integer([3], [-7])
+    slave.set_boolean([4], [True])
+    assert slave.get_integer([3]) == [-7]
+    assert slave.get_boolean([4, 4]) == [True, True]
+
+    # The values go through the shared buffer, remapped for larger calls
+    size = 20000
+    slave.set_boolean([4] * size, [False] * size)
+    assert slave.get_boolean([4] * size) == [False] * size
+    assert slave.get_integer([3] * size) == [-7] * size
+
+    with pytest.raises(RemoteError):
+        slave.get_integer([0])
+
+
+def test_remote_slave_fmu_state(slave):
+    slave.set_real([0], [1.0])
+    state = slave._fmu_state_from_bytes(slave._fmu_state_to_bytes(slave._get_fmu_state()))
+    slave.set_real([0], [2.0])
+    slave._set_fmu_state(state)
+
+    assert slave.get_real([0]) == [1.0]
+
+
+def test_remote_slave_forwards_logs(slave):
+    slave._set_debug_logging(True, ("logAll",))
+    slave.do_step(0.0, 1.0)
+
+    assert [(m.status, m.category, m.msg) for m in slave._get_log_queue()] == [
+        (Fmi2Status.ok, "logAll", "stepped")
+    ]
+    assert len(slave._pack_log_queue()) > 0
+    assert slave._get_log_queue() == []
+
+
+def test_remote_slave_errors(slave):
+    with pytest.raises(RemoteError, match="not of type Real"):
+        slave.set_real([2], [1.0])
+
+    with pytest.raises(RemoteError, match="exited"):
+        slave.do_step(-1.0, 1.0)
+    with pytest.raises(RemoteError, match="stopped"):
+        slave.close()
+        slave.do_step(0.0, 1.0)
+
+
+def test_remote_slave_exceptions(tmp_path):
+    (tmp_path / "slavemodule.txt").write_text("PythonSlaveWithException")
+    (tmp_path / "PythonSlaveWithException.py").write_text((SLAVES / "PythonSlaveWithException.py").read_text())
+    slave = RemoteSlave(instance_name="remote", resources=str(tmp_path))
+
+    try:
+        with pytest.raises(RemoteError, match="RuntimeError"):
+            slave.do_step(0.0, 1.0)
+        # The worker process survives exceptions of the slave
+        assert slave.get_real([0]) == [22.0]
+    finally:
+        slave.close()
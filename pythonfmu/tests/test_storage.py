@@ -0,0 +1,133 @@
+from pythonfmu import Fmi2Slave
+from pythonfmu.enums import Fmi2Causality
+from pythonfmu.storage import StateAttribute
+from pythonfmu.variables import Boolean, Integer, Real, String
+
+
+class ArraySlave(Fmi2Slave):
+
+    array_storage = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.realIn = 1.0
+        self.realOut = 2.0
+        self.intOut = 3
+        self.flag = True
+        self.text = "hello"
+        self.register_variable(Real("realIn", causality=Fmi2Causality.input))
+        self.register_variable(Real("realOut", causality=Fmi2Causality.output))
+        self.register_variable(Integer("intOut", causality=Fmi2Causality.output))
+        self.register_variable(Boolean("flag", causality=Fmi2Causality.local))
+        self.register_variable(String("text", causality=Fmi2Causality.local))
+
+    def do_step(self, current_time, step_size):
+        self.realOut = self.realIn * 2
+        self.intOut += 1
+        self.flag = not self.flag
+        return True
+
+
+def test_array_storage_layout():
+    slave = ArraySlave(instance_name="instance")
+
+    assert type(slave) is ArraySlave
+    assert isinstance(ArraySlave.realIn, StateAttribute)
+    assert slave.state_arrays.real.tolist() == [1.0, 2.0]
+    assert slave.state_arrays.integer.tolist() == [3]
+    assert slave.state_arrays.boolean.tolist() == [1]
+    assert "text" not in slave.state_arrays.slots
+    assert "realIn" not in vars(slave)
+
+
+def test_array_storage_attribute_access():
+    slave = ArraySlave(instance_name="instance")
+    slave.set_real([0], [4.0])
+    slave.do_step(0.0, 0.1)
+
+    assert slave.realOut == 8.0
+    assert slave.intOut == 4
+    assert slave.flag is False
+    assert slave.get_real([0, 1]) == [4.0, 8.0]
+    assert slave.get_integer([2]) == [4]
+    assert slave.get_boolean([3]) == [False]
+    assert slave.get_string([4]) == ["hello"]
+
+
+def test_array_storage_instances_are_independent():
+    first = ArraySlave(instance_name="first")
+    second = ArraySlave(instance_name="second")
+    first.realIn = 10.0
+
+    assert second.realIn == 1.0
+    assert second.state_arrays.real.tolist() == [1.0, 2.0]
+
+
+def test_array_storage_registrations_per_instance():
+
+    class Slave(Fmi2Slave):
+
+        array_storage = True
+
+        def __init__(self, stored=True, **kwargs):
+            super().__init__(**kwargs)
+            self.value = 1.0
+            if stored:
+                self.register_variable(Real("value"))
+
+        def do_step(self, current_time, step_size):
+            return True
+
+    stored = Slave(instance_name="stored")
+    plain = Slave(stored=False, instance_name="plain")
+    assert stored.state_arrays.slots.keys() == {"value"}
+    assert "value" not in vars(stored)
+    assert plain.state_arrays.slots == {}
+
+    # The attribute of the instance not registering the variable stays its own
+    assert type(plain) is type(stored) is Slave
+    assert isinstance(Slave.value, StateAttribute)
+    assert vars(plain)["value"] == 1.0
+    plain.value = 2.0
+    assert vars(plain)["value"] == 2.0
+    assert stored.value == 1.0
+    stored.value = 3.0
+    assert stored.state_arrays.real.tolist() == [3.0]
+    assert plain.value == 2.0
+
+
+def test_array_storage_state():
+    slave = ArraySlave(instance_name="instance")
+    state = slave._get_fmu_state()
+    slave.do_step(0.0, 0.1)
+    slave.text = "world"
+
+    restored = ArraySlave._fmu_state_from_bytes(ArraySlave._fmu_state_to_bytes(state))
+    for s in (state, restored):
+        slave._set_fmu_state(s)
+        assert slave.realOut == 2.0
+        assert slave.intOut == 3
+        assert slave.flag is True
+        assert slave.text == "hello"
+        slave.do_step(0.0, 0.1)
+
+
+def test_array_storage_falls_back_to_attributes():
+
+    class Slave(Fmi2Slave):
+
+        array_storage = True
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.big = 2 ** 40
+            self.register_variable(Integer("big"))
+            self.register_variable(Real("computed", getter=lambda: 1.5))
+
+        def do_step(self, current_time, step_size):
+            return True
+
+    slave = Slave(instance_name="instance")
+    assert slave.state_arrays.slots == {}
+    assert slave.get_integer([0]) == [2 ** 40]
+    assert slave.get_real([1]) == [1.5]
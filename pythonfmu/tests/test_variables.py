@@ -1,3 +1,4 @@
+import pickle
 from enum import Enum
 from random import randint
 
@@ -20,6 +21,22 @@ def test_ScalarVariable_reference_set_once_only():
         v.value_reference = 33
 
 
+@pytest.mark.parametrize("var_type", [Boolean, Integer, Real, String])
+def test_ScalarVariable_slots(var_type):
+    var = var_type("sub.var", start=None, causality=Fmi2Causality.output)
+
+    assert not hasattr(var, "__dict__")
+    assert var.local_name == "var"
+    with pytest.raises(AttributeError):
+        var.name = "other"
+    with pytest.raises(AttributeError):
+        var.unknown = 1
+
+    var.value_reference = 3
+    copy = pickle.loads(pickle.dumps(var))
+    assert (copy.name, copy.value_reference, copy.causality, copy.start) == ("sub.var", 3, Fmi2Causality.output, None)
+
+
 @pytest.mark.parametrize("causality", list(Fmi2Causality) + [None])
 @pytest.mark.parametrize("initial", list(Fmi2Initial) + [None])
 @pytest.mark.parametrize("variability", list(Fmi2Variability) + [None])
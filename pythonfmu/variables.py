@@ -1,15 +1,34 @@
 """Classes describing interface variables."""
+from __future__ import annotations
+
 from abc import ABC
 from enum import Enum
-from typing import Any, Optional
-from xml.etree.ElementTree import Element, SubElement
+from typing import TYPE_CHECKING, Any, ClassVar, Dict, Optional
 
 from .enums import Fmi2Causality, Fmi2Initial, Fmi2Variability
 
+if TYPE_CHECKING:
+    from xml.etree.ElementTree import Element
+
+
+# XML attribute of the ScalarVariable node and slot holding it, in the node order
+XML_ATTRIBUTES = (
+    ("name", "_name"),
+    ("valueReference", "_value_reference"),
+    ("description", "_description"),
+    ("causality", "_causality"),
+    ("variability", "_variability"),
+    ("initial", "_initial"),
+    # 'canHandleMultipleSetPerTimeInstant': # Only for ME
+)
+
 
 class ScalarVariable(ABC):
     """Abstract FMI scalar variable definition.
 
+    Variables are slotted, models registering many of them do not pay for an attribute dictionary
+    per variable.
+
     Args:
         name (str): Variable name
         causality (:obj:`Fmi2Causality`, optional): Variable causality
@@ -17,6 +36,12 @@ class ScalarVariable(ABC):
         initial (:obj:`Fmi2Initial`, optional): Variable initial status
         variability (:obj:`Fmi2Variability`, optional): Variable variability
     """
+
+    __slots__ = (
+        "getter", "setter", "local_name",
+        "_name", "_value_reference", "_description", "_causality", "_variability", "_initial",
+    )
+
     def __init__(
         self,
         name: str,
@@ -29,52 +54,49 @@ class ScalarVariable(ABC):
     ):
         self.getter = getter
         self.setter = setter
-        self.local_name = name.split(".")[-1]
-        self.__attrs = {
-            "name": name,
-            "valueReference": None,
-            "description": description,
-            "causality": causality,
-            "variability": variability,
-            "initial": initial,
-            # 'canHandleMultipleSetPerTimeInstant': # Only for ME
-        }
+        self.local_name = name.rpartition(".")[2]
+        self._name = name
+        self._value_reference = None
+        self._description = description
+        self._causality = causality
+        self._variability = variability
+        self._initial = initial
 
     @property
     def causality(self) -> Optional[Fmi2Causality]:
         """:obj:`Fmi2Causality` or None: Variable causality - None if not set"""
-        return self.__attrs["causality"]
+        return self._causality
 
     @property
     def description(self) -> Optional[str]:
         """str or None: Variable description - None if not set"""
-        return self.__attrs["description"]
+        return self._description
 
     @property
     def initial(self) -> Optional[Fmi2Initial]:
         """:obj:`Fmi2Initial` or None: Variable initial status - None if not set"""
-        return self.__attrs["initial"]
+        return self._initial
 
     @property
     def name(self) -> str:
         """str: Variable name"""
-        return self.__attrs["name"]
+        return self._name
 
     @property
     def value_reference(self) -> int:
         """int: Variable reference index"""
-        return self.__attrs["valueReference"]
+        return self._value_reference
 
     @value_reference.setter
     def value_reference(self, value: int):
-        if self.__attrs["valueReference"] is not None:
+        if self._value_reference is not None:
             raise RuntimeError("Value reference already set.")
-        self.__attrs["valueReference"] = value
+        self._value_reference = value
 
     @property
     def variability(self) -> Optional[Fmi2Variability]:
         """:obj:`Fmi2Variability` or None: Variable variability - None if not set"""
-        return self.__attrs["variability"]
+        return self._variability
 
     @staticmethod
     def requires_start(v: 'ScalarVariable') -> bool:
@@ -91,17 +113,28 @@ class ScalarVariable(ABC):
             or v.variability == Fmi2Variability.constant
         )
 
+    def xml_attrib(self) -> Dict[str, str]:
+        """Attributes of the ScalarVariable XML node."""
+        attrib = dict()
+        for key, slot in XML_ATTRIBUTES:
+            value = getattr(self, slot)
+            if value is not None:
+                attrib[key] = str(value.name if isinstance(value, Enum) else value)
+        return attrib
+
+    def type_attrib(self) -> Dict[str, str]:
+        """Attributes of the XML node of the variable type (child of the ScalarVariable node)."""
+        return dict()
+
     def to_xml(self) -> Element:
         """Convert the variable to XML node.
 
         Returns
             xml.etree.ElementTree.Element: XML node
         """
-        attrib = dict()
-        for key, value in self.__attrs.items():
-            if value is not None:
-                attrib[key] = str(value.name if isinstance(value, Enum) else value)
-        return Element("ScalarVariable", attrib)
+        from xml.etree.ElementTree import Element
+
+        return Element("ScalarVariable", self.xml_attrib())
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}" \
@@ -111,98 +144,108 @@ class ScalarVariable(ABC):
 
 
 class Real(ScalarVariable):
-    def __init__(self, name: str, start: Optional[Any] = None, **kwargs):
-        super().__init__(name, **kwargs)
-        self.__attrs = {"start": start}
+    """Real variable, `derivative` is the value reference of the state variable it is the time derivative of."""
 
-    @property
-    def start(self) -> Optional[Any]:
-        return self.__attrs["start"]
+    __slots__ = ("start", "derivative")
 
-    @start.setter
-    def start(self, value: float):
-        self.__attrs["start"] = value
+    # Tag of the XML node of the type
+    xml_type: ClassVar[str] = "Real"
 
-    def to_xml(self) -> Element:
+    def __init__(self, name: str, start: Optional[Any] = None, derivative: Optional[int] = None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.start = start
+        self.derivative = derivative
+
+    def type_attrib(self) -> Dict[str, str]:
         attrib = dict()
-        for key, value in self.__attrs.items():
-            if value is not None:
-                # In order to not loose precision, a number of this type should be 
-                # stored on an XML file with at least 16 significant digits
-                attrib[key] = f"{value:.16g}"
+        if self.start is not None:
+            # In order to not loose precision, a number of this type should be 
+            # stored on an XML file with at least 16 significant digits
+            attrib["start"] = f"{self.start:.16g}"
+        if self.derivative is not None:
+            # Index of the state in the model variables, numbered from 1 in registration order
+            attrib["derivative"] = str(self.derivative + 1)
+        return attrib
+
+    def to_xml(self) -> Element:
+        from xml.etree.ElementTree import SubElement
+
         parent = super().to_xml()
-        SubElement(parent, "Real", attrib)
+        SubElement(parent, self.xml_type, self.type_attrib())
 
         return parent
 
 
 class Integer(ScalarVariable):
+
+    __slots__ = ("start",)
+
+    xml_type: ClassVar[str] = "Integer"
+
     def __init__(self, name: str, start: Optional[Any] = None, **kwargs):
         super().__init__(name, **kwargs)
-        self.__attrs = {"start": start}
-
-    @property
-    def start(self) -> Optional[Any]:
-        return self.__attrs["start"]
+        self.start = start
 
-    @start.setter
-    def start(self, value: float):
-        self.__attrs["start"] = value
+    def type_attrib(self) -> Dict[str, str]:
+        attrib = dict()
+        if self.start is not None:
+            attrib["start"] = str(self.start)
+        return attrib
 
     def to_xml(self) -> Element:
-        attrib = dict()
-        for key, value in self.__attrs.items():
-            if value is not None:
-                attrib[key] = str(value)
+        from xml.etree.ElementTree import SubElement
+
         parent = super().to_xml()
-        SubElement(parent, "Integer", attrib)
+        SubElement(parent, self.xml_type, self.type_attrib())
 
         return parent
 
 
 class Boolean(ScalarVariable):
+
+    __slots__ = ("start",)
+
+    xml_type: ClassVar[str] = "Boolean"
+
     def __init__(self, name: str, start: Optional[Any] = None, **kwargs):
         super().__init__(name, **kwargs)
-        self.__attrs = {"start": start}
-
-    @property
-    def start(self) -> Optional[Any]:
-        return self.__attrs["start"]
+        self.start = start
 
-    @start.setter
-    def start(self, value: float):
-        self.__attrs["start"] = value
+    def type_attrib(self) -> Dict[str, str]:
+        attrib = dict()
+        if self.start is not None:
+            attrib["start"] = str(self.start).lower()
+        return attrib
 
     def to_xml(self) -> Element:
-        attrib = dict()
-        for key, value in self.__attrs.items():
-            if value is not None:
-                attrib[key] = str(value).lower()
+        from xml.etree.ElementTree import SubElement
+
         parent = super().to_xml()
-        SubElement(parent, "Boolean", attrib)
+        SubElement(parent, self.xml_type, self.type_attrib())
 
         return parent
 
 
 class String(ScalarVariable):
+
+    __slots__ = ("start",)
+
+    xml_type: ClassVar[str] = "String"
+
     def __init__(self, name: str, start: Optional[Any] = None, **kwargs):
         super().__init__(name, **kwargs)
-        self.__attrs = {"start": start}
+        self.start = start
 
-    @property
-    def start(self) -> Optional[Any]:
-        return self.__attrs["start"]
-
-    @start.setter
-    def start(self, value: float):
-        self.__attrs["start"] = value
+    def type_attrib(self) -> Dict[str, str]:
+        attrib = dict()
+        if self.start is not None:
+            attrib["start"] = str(self.start)
+        return attrib
 
     def to_xml(self) -> Element:
-        attrib = dict()
-        for key, value in self.__attrs.items():
-            if value is not None:
-                attrib[key] = str(value)
+        from xml.etree.ElementTree import SubElement
+
         parent = super().to_xml()
-        SubElement(parent, "String", attrib)
+        SubElement(parent, self.xml_type, self.type_attrib())
 
         return parent
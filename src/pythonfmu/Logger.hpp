@@ -25,6 +25,16 @@ public:
         categories_ = categories;
     }
 
+    [[nodiscard]] bool debugLogging() const
+    {
+        return debugLogging_;
+    }
+
+    [[nodiscard]] const std::vector<std::string>& categories() const
+    {
+        return categories_;
+    }
+
     // Logs a message.
     void log(fmi2Status s, const std::string& message)
     {
@@ -0,0 +1,217 @@
+#ifndef PYTHONFMU_PERFSTATS_HPP
+#define PYTHONFMU_PERFSTATS_HPP
+
+#include <array>
+#include <chrono>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <iomanip>
+#include <sstream>
+#include <string>
+
+namespace pythonfmu
+{
+
+// FMI calls going through the slave instance
+enum class PerfCall : std::size_t
+{
+    Instantiate,
+    SetDebugLogging,
+    SetupExperiment,
+    EnterInitializationMode,
+    ExitInitializationMode,
+    Terminate,
+    Reset,
+    SetReal,
+    SetInteger,
+    SetBoolean,
+    SetString,
+    GetReal,
+    GetInteger,
+    GetBoolean,
+    GetString,
+    DoStep,
+    GetFMUstate,
+    SetFMUstate,
+    FreeFMUstate,
+    SerializedFMUstateSize,
+    SerializeFMUstate,
+    DeSerializeFMUstate,
+    Count
+};
+
+// Phases of one call; marshalling is the time not spent in any other phase
+enum class PerfPhase : std::size_t
+{
+    Total,
+    GilWait,
+    Marshalling,
+    Python,
+    LogDrain,
+    Count
+};
+
+constexpr std::array<const char*, static_cast<std::size_t>(PerfCall::Count)> perfCallNames{
+    "Instantiate", "SetDebugLogging", "SetupExperiment", "EnterInitializationMode", "ExitInitializationMode",
+    "Terminate", "Reset", "SetReal", "SetInteger", "SetBoolean", "SetString", "GetReal", "GetInteger",
+    "GetBoolean", "GetString", "DoStep", "GetFMUstate", "SetFMUstate", "FreeFMUstate", "SerializedFMUstateSize",
+    "SerializeFMUstate", "DeSerializeFMUstate"};
+
+constexpr std::array<const char*, static_cast<std::size_t>(PerfPhase::Count)> perfPhaseNames{
+    "total", "gil_wait", "marshalling", "python", "log_drain"};
+
+struct LatencyHistogram
+{
+    // Bucket i counts the latencies in [2^i, 2^(i+1)) ns, the last one is open-ended
+    static constexpr std::size_t size = 40;
+
+    std::uint64_t count{0};
+    std::uint64_t totalNs{0};
+    std::uint64_t maxNs{0};
+    std::array<std::uint64_t, size> buckets{};
+
+    void add(std::uint64_t ns)
+    {
+        count++;
+        totalNs += ns;
+        if (ns > maxNs) maxNs = ns;
+
+        std::size_t bucket = 0;
+        while ((ns >>= 1) != 0 && bucket < size - 1) {
+            bucket++;
+        }
+        buckets[bucket]++;
+    }
+};
+
+// Per instance call counts and latency histograms, enabled by the PYTHONFMU_PERF_STATS environment variable.
+// Instances are not shared between threads (FMI forbids concurrent calls on one instance), so no locking is needed.
+class PerfStats
+{
+public:
+    using clock = std::chrono::steady_clock;
+
+    static bool enabled()
+    {
+        static const bool enabled = [] {
+            const char* value = std::getenv("PYTHONFMU_PERF_STATS");
+            return value != nullptr && *value != '\0' && std::strcmp(value, "0") != 0;
+        }();
+        return enabled;
+    }
+
+    // Times one call, recording the total and the marshalling remainder when going out of scope
+    class CallScope
+    {
+    public:
+        CallScope(PerfStats& stats, PerfCall call)
+            : stats_(stats)
+            , call_(call)
+            , start_(clock::now())
+        {
+            stats_.phaseNs_.fill(0);
+        }
+
+        ~CallScope()
+        {
+            const auto total = elapsedNs(start_);
+            std::uint64_t other = 0;
+            for (auto phase : {PerfPhase::GilWait, PerfPhase::Python, PerfPhase::LogDrain}) {
+                other += stats_.phaseNs_[index(phase)];
+                stats_.histogram(call_, phase).add(stats_.phaseNs_[index(phase)]);
+            }
+            stats_.histogram(call_, PerfPhase::Marshalling).add(total > other ? total - other : 0);
+            stats_.histogram(call_, PerfPhase::Total).add(total);
+        }
+
+        CallScope(const CallScope&) = delete;
+        CallScope& operator=(const CallScope&) = delete;
+
+    private:
+        PerfStats& stats_;
+        PerfCall call_;
+        clock::time_point start_;
+    };
+
+    void add(PerfPhase phase, std::uint64_t ns)
+    {
+        phaseNs_[index(phase)] += ns;
+    }
+
+    template<class F>
+    decltype(auto) time(PerfPhase phase, F&& f)
+    {
+        PhaseScope scope(*this, phase);
+        return f();
+    }
+
+    [[nodiscard]] const LatencyHistogram& histogram(PerfCall call, PerfPhase phase) const
+    {
+        return histograms_[index(call)][index(phase)];
+    }
+
+    [[nodiscard]] std::string report() const
+    {
+        std::ostringstream oss;
+        oss << std::fixed << std::setprecision(1) << "Performance statistics (mean/max in us):";
+        for (std::size_t call = 0; call < perfCallNames.size(); call++) {
+            const auto& total = histograms_[call][index(PerfPhase::Total)];
+            if (total.count == 0) continue;
+            oss << "\n  " << perfCallNames[call] << ": " << total.count << " calls";
+            for (std::size_t phase = 0; phase < perfPhaseNames.size(); phase++) {
+                const auto& h = histograms_[call][phase];
+                oss << ", " << perfPhaseNames[phase] << " " << (h.totalNs / 1e3 / h.count) << "/" << (h.maxNs / 1e3);
+            }
+        }
+        return oss.str();
+    }
+
+private:
+    class PhaseScope
+    {
+    public:
+        PhaseScope(PerfStats& stats, PerfPhase phase)
+            : stats_(stats)
+            , phase_(phase)
+            , start_(clock::now())
+        { }
+
+        ~PhaseScope()
+        {
+            stats_.phaseNs_[index(phase_)] += elapsedNs(start_);
+        }
+
+        PhaseScope(const PhaseScope&) = delete;
+        PhaseScope& operator=(const PhaseScope&) = delete;
+
+    private:
+        PerfStats& stats_;
+        PerfPhase phase_;
+        clock::time_point start_;
+    };
+
+    template<class T>
+    static constexpr std::size_t index(T value)
+    {
+        return static_cast<std::size_t>(value);
+    }
+
+    static std::uint64_t elapsedNs(clock::time_point start)
+    {
+        return static_cast<std::uint64_t>(
+            std::chrono::duration_cast<std::chrono::nanoseconds>(clock::now() - start).count());
+    }
+
+    LatencyHistogram& histogram(PerfCall call, PerfPhase phase)
+    {
+        return histograms_[index(call)][index(phase)];
+    }
+
+    std::array<std::array<LatencyHistogram, perfPhaseNames.size()>, perfCallNames.size()> histograms_{};
+    std::array<std::uint64_t, perfPhaseNames.size()> phaseNs_{};
+};
+
+} // namespace pythonfmu
+
+#endif // PYTHONFMU_PERFSTATS_HPP
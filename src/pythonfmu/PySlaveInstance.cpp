@@ -2,9 +2,13 @@
 #include "fmu_except.hpp"
 
 #include "pythonfmu/Logger.hpp"
+#include "pythonfmu/PerfStats.hpp"
 #include "pythonfmu/PyState.hpp"
+#include "pythonfmu/PyWorker.hpp"
 #include "pythonfmu/SlaveInstance.hpp"
 
+#include <cstdint>
+#include <cstring>
 #include <filesystem>
 #include <fstream>
 #include <functional>
@@ -12,8 +16,17 @@
 #include <regex>
 #include <sstream>
 #include <string>
+#include <system_error>
+#include <type_traits>
+#include <unordered_map>
 #include <utility>
 
+// Only declared by the limited API of Python 3.11+, their values are part of the stable ABI
+#ifndef PyBUF_READ
+#    define PyBUF_READ 0x100
+#    define PyBUF_WRITE 0x200
+#endif
+
 using namespace pythonfmu;
 
 namespace
@@ -119,10 +132,148 @@ PyObject* findClass(const std::string& resources, const std::string& moduleName)
     return pyClass;
 }
 
-void py_safe_run(const std::function<void(PyGILState_STATE gilState)>& f)
+// Class recorded by the builder in slaveclass.txt, as module.ClassName
+PyObject* importClass(const std::string& qualifiedName)
+{
+    const auto dot = qualifiedName.rfind('.');
+    PyObject* pyModule = PyImport_ImportModule(qualifiedName.substr(0, dot).c_str());
+    if (pyModule == nullptr) {
+        return nullptr;
+    }
+    PyObject* pyClass = PyObject_GetAttrString(pyModule, qualifiedName.substr(dot + 1).c_str());
+    Py_DECREF(pyModule);
+    return pyClass;
+}
+
+// The class recorded by the builder, discovered in the module for FMUs built without it
+PyObject* resolveClass(const std::string& resources, const std::string& moduleName, const std::string& className)
+{
+    if (className.empty() || className.find('.') == std::string::npos) {
+        return findClass(resources, moduleName);
+    }
+    return importClass(className);
+}
+
+// Slave class resolved by resolveClass, valid as long as the module file is unchanged
+struct CachedClass
+{
+    std::filesystem::file_time_type lastWriteTime;
+    std::uintmax_t fileSize;
+    PyObject* pyClass;
+};
+
+// Keyed by module file, only accessed with the GIL held. The interpreter lives as long as the library
+std::unordered_map<std::string, CachedClass> classCache;
+
+// Like resolveClass, reusing the class of previous instantiations of the same FMU
+PyObject* findCachedClass(const std::string& resources, const std::string& moduleName, const std::string& className)
+{
+    const std::string filename = resources + "/" + moduleName + ".py";
+    std::error_code ec;
+    const auto lastWriteTime = std::filesystem::last_write_time(filename, ec);
+    const auto fileSize = ec ? 0 : std::filesystem::file_size(filename, ec);
+    if (ec) {
+        return resolveClass(resources, moduleName, className);
+    }
+
+    auto it = classCache.find(filename);
+    if (it != classCache.end()) {
+        if (it->second.lastWriteTime == lastWriteTime && it->second.fileSize == fileSize) {
+            Py_INCREF(it->second.pyClass);
+            return it->second.pyClass;
+        }
+        // The module file changed, the import would return the module already in sys.modules
+        PyObject* pyModule = PyImport_ImportModule(moduleName.c_str());
+        PyObject* pyReloaded = pyModule == nullptr ? nullptr : PyImport_ReloadModule(pyModule);
+        Py_XDECREF(pyModule);
+        if (pyReloaded == nullptr) {
+            return nullptr;
+        }
+        Py_DECREF(pyReloaded);
+    }
+
+    PyObject* pyClass = resolveClass(resources, moduleName, className);
+    if (pyClass == nullptr) {
+        return nullptr;
+    }
+    // resolveClass may release the GIL while importing, look the entry up again
+    it = classCache.find(filename);
+    if (it != classCache.end()) {
+        Py_DECREF(it->second.pyClass);
+        classCache.erase(it);
+    }
+    Py_INCREF(pyClass);
+    classCache.emplace(filename, CachedClass{lastWriteTime, fileSize, pyClass});
+    return pyClass;
+}
+
+PyObject* findRemoteClass()
+{
+    PyObject* pyModule = PyImport_ImportModule("pythonfmu.remote");
+    if (pyModule == nullptr) {
+        return nullptr;
+    }
+    PyObject* pyClass = PyObject_GetAttrString(pyModule, "RemoteSlave");
+    Py_DECREF(pyModule);
+    return pyClass;
+}
+
+PyObject* perf_stats_to_python(PyObject* capsule, PyObject*)
+{
+    auto stats = static_cast<const PerfStats*>(PyCapsule_GetContext(capsule));
+    PyObject* result = PyDict_New();
+    if (stats == nullptr || result == nullptr) {
+        return result;
+    }
+    for (std::size_t call = 0; call < perfCallNames.size(); call++) {
+        if (stats->histogram(static_cast<PerfCall>(call), PerfPhase::Total).count == 0) {
+            continue;
+        }
+        PyObject* phases = PyDict_New();
+        for (std::size_t phase = 0; phase < perfPhaseNames.size(); phase++) {
+            const auto& h = stats->histogram(static_cast<PerfCall>(call), static_cast<PerfPhase>(phase));
+            PyObject* buckets = PyList_New(LatencyHistogram::size);
+            for (std::size_t i = 0; i < LatencyHistogram::size; i++) {
+                PyList_SetItem(buckets, static_cast<Py_ssize_t>(i), PyLong_FromUnsignedLongLong(h.buckets[i]));
+            }
+            PyObject* entry = Py_BuildValue("{sKsdsdsN}",
+                "count", static_cast<unsigned long long>(h.count),
+                "total", h.totalNs * 1e-9,
+                "max", h.maxNs * 1e-9,
+                "histogram", buckets);
+            PyDict_SetItemString(phases, perfPhaseNames[phase], entry);
+            Py_DECREF(entry);
+        }
+        PyDict_SetItemString(result, perfCallNames[call], phases);
+        Py_DECREF(phases);
+    }
+    return result;
+}
+
+PyMethodDef perfStatsMethod{"_perf_stats_provider", perf_stats_to_python, METH_NOARGS, nullptr};
+
+// Callable handing the statistics of one instance over to Fmi2Slave.perf_stats
+PyObject* createPerfStatsProvider(const PerfStats* stats)
+{
+    PyObject* capsule = PyCapsule_New(const_cast<PerfStats*>(stats), "pythonfmu.PerfStats", nullptr);
+    if (capsule == nullptr) {
+        return nullptr;
+    }
+    PyCapsule_SetContext(capsule, const_cast<PerfStats*>(stats));
+    PyObject* provider = PyCFunction_NewEx(&perfStatsMethod, capsule, nullptr);
+    Py_DECREF(capsule);
+    return provider;
+}
+
+void py_safe_run(const std::function<void()>& f)
 {
     PyGILState_STATE gil_state = PyGILState_Ensure();
-    f(gil_state);
+    try {
+        f();
+    } catch (...) {
+        PyGILState_Release(gil_state);
+        throw;
+    }
     PyGILState_Release(gil_state);
 }
 
@@ -133,81 +284,112 @@ class PySlaveInstance : public SlaveInstance
 public:
     explicit PySlaveInstance(fmu_data data)
         : data_(std::move(data))
+        , perf_(PerfStats::enabled() ? std::make_unique<PerfStats>() : nullptr)
+        , worker_(createWorker())
     {
-        py_safe_run([this](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::Instantiate, [this]() {
             // Append resources path to python sys path
             PyObject* sys_module = PyImport_ImportModule("sys");
             if (sys_module == nullptr) {
-                handle_py_exception("[ctor] PyImport_ImportModule", gilState);
+                handle_py_exception("[ctor] PyImport_ImportModule");
             }
             PyObject* sys_path = PyObject_GetAttrString(sys_module, "path");
             Py_DECREF(sys_module);
             if (sys_path == nullptr) {
-                handle_py_exception("[ctor] PyObject_GetAttrString", gilState);
+                handle_py_exception("[ctor] PyObject_GetAttrString");
             }
             int success = PyList_Insert(sys_path, 0, PyUnicode_FromString(resourceLocation().c_str()));
 
             Py_DECREF(sys_path);
             if (success != 0) {
-                handle_py_exception("[ctor] PyList_Insert", gilState);
+                handle_py_exception("[ctor] PyList_Insert");
             }
 
             std::string moduleName = getline(resourceLocation() + "/slavemodule.txt");
+            // Missing in FMUs built by older versions
+            std::string className = getline(resourceLocation() + "/slaveclass.txt");
+
+            if (executionMode() == ExecutionMode::Subinterpreter && !worker_->ownsInterpreter()) {
+                // Not through the FMI logger, the fallback is a property of the wrapper, not of the model
+                if (PyErr_WarnEx(PyExc_RuntimeWarning,
+                        "Sub-interpreters need a wrapper built for Python 3.12+ without the limited API "
+                        "(cmake -DUSE_PYTHON_SABI=OFF), falling back to the worker mode", 1) != 0) {
+                    handle_py_exception("[ctor] PyErr_WarnEx");
+                }
+            }
 
-            pClass_ = findClass(resourceLocation(), moduleName);
+            if (executionMode() == ExecutionMode::Process) {
+                // The proxy imports the slave module in its worker process, not in the importer
+                pClass_ = findRemoteClass();
+            } else if (worker_ != nullptr && worker_->ownsInterpreter()) {
+                // Objects cannot be shared across interpreters, and each instance has its own
+                pClass_ = resolveClass(resourceLocation(), moduleName, className);
+            } else {
+                pClass_ = findCachedClass(resourceLocation(), moduleName, className);
+            }
             if (pClass_ == nullptr) {
-                handle_py_exception("[ctor] findClass", gilState);
+                handle_py_exception("[ctor] findClass");
+            }
+
+            if (perf_ != nullptr) {
+                pPerfStats_ = createPerfStatsProvider(perf_.get());
             }
 
-            initialize(gilState);
+            initialize();
         });
     }
 
     void clearLogBuffer() const
     {
-        clearLogStrBuffer();
-
-        PyObject* msgField = Py_BuildValue("s", "msg");
-        PyObject* categoryField = Py_BuildValue("s", "category");
-        PyObject* statusField = Py_BuildValue("s", "status");
-
-        if (pMessages_ != nullptr && PyList_Check(pMessages_)) {
-            const auto size = PyList_Size(pMessages_);
-            for (auto i = 0; i < size; i++) {
-                PyObject* msg = PyList_GetItem(pMessages_, i);
-
-                const auto msgAttr = PyObject_GetAttr(msg, msgField);
-                const auto categoryAttr = PyObject_GetAttr(msg, categoryField);
-                const auto statusAttr = PyObject_GetAttr(msg, statusField);
-
-                const auto statusValue = static_cast<fmi2Status>(PyLong_AsLong(statusAttr));
-
-                PyObject* msgValue = PyUnicode_AsEncodedString(msgAttr, "utf-8", nullptr);
-                char* msgStr = PyBytes_AsString(msgValue);
-                logStrBuffer.emplace_back(msgValue);
-
-                const char* categoryStr = "";
-                if (categoryAttr != Py_None) {
-                    PyObject* categoryValue = PyUnicode_AsEncodedString(categoryAttr, "utf-8", nullptr);
-                    categoryStr = PyBytes_AsString(categoryValue);
-                    logStrBuffer.emplace_back(categoryValue);
-                }
+        // Messages not passing the debug logging filter are dropped by Fmi2Slave.log,
+        // so an empty queue is the common case and costs no Python call.
+        if (pMessages_ == nullptr || !PyList_Check(pMessages_) || PyList_Size(pMessages_) == 0) {
+            return;
+        }
+        timed(PerfPhase::LogDrain, [this] { drainLogQueue(); });
+    }
 
+    void drainLogQueue() const
+    {
+        PyObject* packed = PyObject_CallMethod(pInstance_, "_pack_log_queue", nullptr);
+        if (packed == nullptr) {
+            PyErr_Clear();
+            return;
+        }
 
-                log(statusValue, categoryStr, msgStr);
+        const char* buffer = PyBytes_AsString(packed);
+        const auto size = static_cast<std::size_t>(PyBytes_Size(packed));
+        std::size_t offset = 0;
+        while (buffer != nullptr && offset + sizeof(LogRecord) <= size) {
+            LogRecord record;
+            std::memcpy(&record, buffer + offset, sizeof(LogRecord));
+            offset += sizeof(LogRecord);
+            if (offset + record.categorySize + record.msgSize > size) {
+                break;
             }
-            PyList_SetSlice(pMessages_, 0, size, nullptr);
+            const std::string category(buffer + offset, record.categorySize);
+            offset += record.categorySize;
+            const std::string msg(buffer + offset, record.msgSize);
+            offset += record.msgSize;
+
+            log(static_cast<fmi2Status>(record.status), category, msg);
         }
+        Py_DECREF(packed);
+    }
 
-        Py_DECREF(msgField);
-        Py_DECREF(categoryField);
-        Py_DECREF(statusField);
+    void SetDebugLogging(bool flag, const std::vector<std::string>& categories) override
+    {
+        py_safe_run(PerfCall::SetDebugLogging, [this, flag, &categories]() {
+            setDebugLogging(flag, categories);
+        });
     }
 
-    void initialize(PyGILState_STATE gilState)
+    void initialize()
     {
         Py_XDECREF(pInstance_);
         Py_XDECREF(pMessages_);
+        pInstance_ = nullptr;
+        pMessages_ = nullptr;
 
         PyObject* args = PyTuple_New(0);
         PyObject* kwargs = Py_BuildValue("{ss,ss,sn,si}",
@@ -215,28 +397,48 @@ public:
             "resources", data_.resourceLocation.c_str(),
             "logger", data_.fmiLogger,
             "visible", data_.visible);
-        pInstance_ = PyObject_Call(pClass_, args, kwargs);
+        pInstance_ = timed(PerfPhase::Python, [&] { return PyObject_Call(pClass_, args, kwargs); });
         Py_DECREF(args);
         Py_DECREF(kwargs);
         if (pInstance_ == nullptr) {
-            handle_py_exception("[initialize] PyObject_Call", gilState);
+            handle_py_exception("[initialize] PyObject_Call");
         }
         pMessages_ = PyObject_CallMethod(pInstance_, "_get_log_queue", nullptr);
+        if (pPerfStats_ != nullptr) {
+            PyObject_SetAttrString(pInstance_, "_perf_stats_provider", pPerfStats_);
+        }
+        setDebugLogging(data_.fmiLogger->debugLogging(), data_.fmiLogger->categories());
+    }
+
+    void setDebugLogging(bool flag, const std::vector<std::string>& categories) const
+    {
+        PyObject* pyCategories = PyTuple_New(static_cast<Py_ssize_t>(categories.size()));
+        for (std::size_t i = 0; i < categories.size(); i++) {
+            PyTuple_SetItem(pyCategories, static_cast<Py_ssize_t>(i), PyUnicode_FromString(categories[i].c_str()));
+        }
+        auto f = timed(PerfPhase::Python, [&] {
+            return PyObject_CallMethod(pInstance_, "_set_debug_logging", "(OO)", flag ? Py_True : Py_False, pyCategories);
+        });
+        Py_DECREF(pyCategories);
+        if (f == nullptr) {
+            handle_py_exception("[setDebugLogging] PyObject_CallMethod");
+        }
+        Py_DECREF(f);
     }
 
     void SetupExperiment(double startTime, std::optional<double> stop, std::optional<double> tolerance) override
     {
-        py_safe_run([this, startTime, stop, tolerance](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::SetupExperiment, [this, startTime, stop, tolerance]() {
             PyObject* pyStop = stop ? Py_BuildValue("d", *stop) : (Py_INCREF(Py_None), Py_None);
             PyObject* pyTol = tolerance ? Py_BuildValue("d", *tolerance) : (Py_INCREF(Py_None), Py_None);
 
-            auto f = PyObject_CallMethod(pInstance_, "setup_experiment", "(dOO)", startTime, pyStop, pyTol);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "setup_experiment", "(dOO)", startTime, pyStop, pyTol); });
 
             Py_DECREF(pyStop);
             Py_DECREF(pyTol);
 
             if (f == nullptr) {
-                handle_py_exception("[setupExperiment] PyObject_CallMethod", gilState);
+                handle_py_exception("[setupExperiment] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -245,10 +447,10 @@ public:
 
     void EnterInitializationMode() override
     {
-        py_safe_run([this](PyGILState_STATE gilState) {
-            auto f = PyObject_CallMethod(pInstance_, "enter_initialization_mode", nullptr);
+        py_safe_run(PerfCall::EnterInitializationMode, [this]() {
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "enter_initialization_mode", nullptr); });
             if (f == nullptr) {
-                handle_py_exception("[enterInitializationMode] PyObject_CallMethod", gilState);
+                handle_py_exception("[enterInitializationMode] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -257,10 +459,10 @@ public:
 
     void ExitInitializationMode() override
     {
-        py_safe_run([this](PyGILState_STATE gilState) {
-            auto f = PyObject_CallMethod(pInstance_, "exit_initialization_mode", nullptr);
+        py_safe_run(PerfCall::ExitInitializationMode, [this]() {
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "exit_initialization_mode", nullptr); });
             if (f == nullptr) {
-                handle_py_exception("[exitInitializationMode] PyObject_CallMethod", gilState);
+                handle_py_exception("[exitInitializationMode] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -270,10 +472,10 @@ public:
     bool Step(double currentTime, double stepSize) override
     {
         bool status;
-        py_safe_run([this, &status, currentTime, stepSize](PyGILState_STATE gilState) {
-            auto f = PyObject_CallMethod(pInstance_, "do_step", "(dd)", currentTime, stepSize);
+        py_safe_run(PerfCall::DoStep, [this, &status, currentTime, stepSize]() {
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "do_step", "(dd)", currentTime, stepSize); });
             if (f == nullptr) {
-                handle_py_exception("[doStep] PyObject_CallMethod", gilState);
+                handle_py_exception("[doStep] PyObject_CallMethod");
             }
             status = static_cast<bool>(PyObject_IsTrue(f));
             Py_DECREF(f);
@@ -285,17 +487,17 @@ public:
 
     void Reset() override
     {
-        py_safe_run([this](PyGILState_STATE gilState) {
-            initialize(gilState);
+        py_safe_run(PerfCall::Reset, [this]() {
+            initialize();
         });
     }
 
     void Terminate() override
     {
-        py_safe_run([this](PyGILState_STATE gilState) {
-            auto f = PyObject_CallMethod(pInstance_, "terminate", nullptr);
+        py_safe_run(PerfCall::Terminate, [this]() {
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "terminate", nullptr); });
             if (f == nullptr) {
-                handle_py_exception("[terminate] PyObject_CallMethod", gilState);
+                handle_py_exception("[terminate] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -304,28 +506,36 @@ public:
 
     void SetReal(const fmi2ValueReference* vr, std::size_t nvr, const fmi2Real* values) override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
-            PyObject* vrs = PyList_New(nvr);
-            PyObject* refs = PyList_New(nvr);
-            for (int i = 0; i < nvr; i++) {
-                PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
-                PyList_SetItem(refs, i, Py_BuildValue("d", values[i]));
-            }
+        const auto set = [this](const fmi2ValueReference* vr, std::size_t nvr, const fmi2Real* values) {
+            // Hand the arrays over as read-only memoryviews, only valid during the call
+            PyObject* vrs = memoryView(vr, nvr, PyBUF_READ);
+            PyObject* refs = memoryView(values, nvr, PyBUF_READ);
 
-            auto f = PyObject_CallMethod(pInstance_, "set_real", "(OO)", vrs, refs);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "_set_real_buffer", "(OO)", vrs, refs); });
             Py_DECREF(vrs);
             Py_DECREF(refs);
             if (f == nullptr) {
-                handle_py_exception("[setReal] PyObject_CallMethod", gilState);
+                handle_py_exception("[setReal] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
+        };
+        if (!deferSets()) {
+            py_safe_run(PerfCall::SetReal, [&]() { set(vr, nvr, values); });
+            return;
+        }
+        // The call is deferred, the arguments are copied
+        py_safe_post(PerfCall::SetReal, [set, vr = std::vector<fmi2ValueReference>(vr, vr + nvr), nvr,
+                                            values = std::vector<fmi2Real>(values, values + nvr)]() {
+            set(vr.data(), nvr, values.data());
         });
     }
 
     void SetInteger(const fmi2ValueReference* vr, std::size_t nvr, const fmi2Integer* values) override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        // The arguments are copied, the call is deferred in worker mode
+        py_safe_post(PerfCall::SetInteger, [this, vr = std::vector<fmi2ValueReference>(vr, vr + nvr), nvr,
+                                  values = std::vector<fmi2Integer>(values, values + nvr)]() {
             PyObject* vrs = PyList_New(nvr);
             PyObject* refs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
@@ -333,11 +543,11 @@ public:
                 PyList_SetItem(refs, i, Py_BuildValue("i", values[i]));
             }
 
-            auto f = PyObject_CallMethod(pInstance_, "set_integer", "(OO)", vrs, refs);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "set_integer", "(OO)", vrs, refs); });
             Py_DECREF(vrs);
             Py_DECREF(refs);
             if (f == nullptr) {
-                handle_py_exception("[setInteger] PyObject_CallMethod", gilState);
+                handle_py_exception("[setInteger] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -346,7 +556,9 @@ public:
 
     void SetBoolean(const fmi2ValueReference* vr, std::size_t nvr, const fmi2Boolean* values) override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        // The arguments are copied, the call is deferred in worker mode
+        py_safe_post(PerfCall::SetBoolean, [this, vr = std::vector<fmi2ValueReference>(vr, vr + nvr), nvr,
+                                  values = std::vector<fmi2Boolean>(values, values + nvr)]() {
             PyObject* vrs = PyList_New(nvr);
             PyObject* refs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
@@ -354,11 +566,11 @@ public:
                 PyList_SetItem(refs, i, PyBool_FromLong(values[i]));
             }
 
-            auto f = PyObject_CallMethod(pInstance_, "set_boolean", "(OO)", vrs, refs);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "set_boolean", "(OO)", vrs, refs); });
             Py_DECREF(vrs);
             Py_DECREF(refs);
             if (f == nullptr) {
-                handle_py_exception("[setBoolean] PyObject_CallMethod", gilState);
+                handle_py_exception("[setBoolean] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -367,19 +579,21 @@ public:
 
     void SetString(const fmi2ValueReference* vr, std::size_t nvr, fmi2String const* values) override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        // The arguments are copied, the call is deferred in worker mode
+        py_safe_post(PerfCall::SetString, [this, vr = std::vector<fmi2ValueReference>(vr, vr + nvr), nvr,
+                                           values = std::vector<std::string>(values, values + nvr)]() {
             PyObject* vrs = PyList_New(nvr);
             PyObject* refs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
                 PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
-                PyList_SetItem(refs, i, Py_BuildValue("s", values[i]));
+                PyList_SetItem(refs, i, Py_BuildValue("s", values[i].c_str()));
             }
 
-            auto f = PyObject_CallMethod(pInstance_, "set_string", "(OO)", vrs, refs);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "set_string", "(OO)", vrs, refs); });
             Py_DECREF(vrs);
             Py_DECREF(refs);
             if (f == nullptr) {
-                handle_py_exception("[setString] PyObject_CallMethod", gilState);
+                handle_py_exception("[setString] PyObject_CallMethod");
             }
             Py_DECREF(f);
             clearLogBuffer();
@@ -388,38 +602,33 @@ public:
 
     void GetReal(const fmi2ValueReference* vr, std::size_t nvr, fmi2Real* values) const override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
-            PyObject* vrs = PyList_New(nvr);
-            for (int i = 0; i < nvr; i++) {
-                PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
-            }
+        py_safe_run(PerfCall::GetReal, [this, &vr, nvr, &values]() {
+            // The slave writes straight into the caller's array through a memoryview, only valid during the call
+            PyObject* vrs = memoryView(vr, nvr, PyBUF_READ);
+            PyObject* refs = memoryView(values, nvr, PyBUF_WRITE);
 
-            auto refs = PyObject_CallMethod(pInstance_, "get_real", "O", vrs);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "_get_real_buffer", "(OO)", vrs, refs); });
             Py_DECREF(vrs);
-            if (refs == nullptr) {
-                handle_py_exception("[getReal] PyObject_CallMethod", gilState);
-            }
-
-            for (int i = 0; i < nvr; i++) {
-                PyObject* value = PyList_GetItem(refs, i);
-                values[i] = PyFloat_AsDouble(value);
-            }
             Py_DECREF(refs);
+            if (f == nullptr) {
+                handle_py_exception("[getReal] PyObject_CallMethod");
+            }
+            Py_DECREF(f);
             clearLogBuffer();
         });
     }
 
     void GetInteger(const fmi2ValueReference* vr, std::size_t nvr, fmi2Integer* values) const override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::GetInteger, [this, &vr, nvr, &values]() {
             PyObject* vrs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
                 PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
             }
-            auto refs = PyObject_CallMethod(pInstance_, "get_integer", "O", vrs);
+            auto refs = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "get_integer", "O", vrs); });
             Py_DECREF(vrs);
             if (refs == nullptr) {
-                handle_py_exception("[getInteger] PyObject_CallMethod", gilState);
+                handle_py_exception("[getInteger] PyObject_CallMethod");
             }
 
             for (int i = 0; i < nvr; i++) {
@@ -433,15 +642,15 @@ public:
 
     void GetBoolean(const fmi2ValueReference* vr, std::size_t nvr, fmi2Boolean* values) const override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::GetBoolean, [this, &vr, nvr, &values]() {
             PyObject* vrs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
                 PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
             }
-            auto refs = PyObject_CallMethod(pInstance_, "get_boolean", "O", vrs);
+            auto refs = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "get_boolean", "O", vrs); });
             Py_DECREF(vrs);
             if (refs == nullptr) {
-                handle_py_exception("[getBoolean] PyObject_CallMethod", gilState);
+                handle_py_exception("[getBoolean] PyObject_CallMethod");
             }
 
             for (int i = 0; i < nvr; i++) {
@@ -455,16 +664,16 @@ public:
 
     void GetString(const fmi2ValueReference* vr, std::size_t nvr, fmi2String* values) const override
     {
-        py_safe_run([this, &vr, nvr, &values](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::GetString, [this, &vr, nvr, &values]() {
             clearStrBuffer();
             PyObject* vrs = PyList_New(nvr);
             for (int i = 0; i < nvr; i++) {
                 PyList_SetItem(vrs, i, Py_BuildValue("i", vr[i]));
             }
-            auto refs = PyObject_CallMethod(pInstance_, "get_string", "O", vrs);
+            auto refs = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "get_string", "O", vrs); });
             Py_DECREF(vrs);
             if (refs == nullptr) {
-                handle_py_exception("[getString] PyObject_CallMethod", gilState);
+                handle_py_exception("[getString] PyObject_CallMethod");
             }
 
             for (int i = 0; i < nvr; i++) {
@@ -479,11 +688,19 @@ public:
 
     void GetFMUstate(fmi2FMUstate& state) override
     {
-        py_safe_run([this, &state](PyGILState_STATE gilState) {
-            auto f = PyObject_CallMethod(pInstance_, "_get_fmu_state", nullptr);
+        py_safe_run(PerfCall::GetFMUstate, [this, &state]() {
+            PyObject* f;
+            auto previous = reinterpret_cast<PyObject*>(state);
+            if (previous == nullptr) {
+                f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "_get_fmu_state", nullptr); });
+            } else {
+                // Overwrite the state the environment hands back, instead of leaking it
+                f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "_update_fmu_state", "(O)", previous); });
+            }
             if (f == nullptr) {
-                handle_py_exception("[_get_fmu_state] PyObject_CallMethod", gilState);
+                handle_py_exception("[_get_fmu_state] PyObject_CallMethod");
             }
+            Py_XDECREF(previous);
             state = reinterpret_cast<fmi2FMUstate*>(f);
             clearLogBuffer();
         });
@@ -491,19 +708,20 @@ public:
 
     void SetFMUstate(const fmi2FMUstate& state) override
     {
-        py_safe_run([this, &state](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::SetFMUstate, [this, &state]() {
             auto pyState = reinterpret_cast<PyObject*>(state);
-            auto f = PyObject_CallMethod(pInstance_, "_set_fmu_state", "(O)", pyState);
+            auto f = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pInstance_, "_set_fmu_state", "(O)", pyState); });
             if (f == nullptr) {
-                handle_py_exception("[_set_fmu_state] PyObject_CallMethod", gilState);
+                handle_py_exception("[_set_fmu_state] PyObject_CallMethod");
             }
+            Py_DECREF(f);
             clearLogBuffer();
         });
     }
 
     void FreeFMUstate(fmi2FMUstate& state) override
     {
-        py_safe_run([this, &state](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::FreeFMUstate, [this, &state]() {
             auto f = reinterpret_cast<PyObject*>(state);
             Py_XDECREF(f);
         });
@@ -512,11 +730,11 @@ public:
     size_t SerializedFMUstateSize(const fmi2FMUstate& state) override
     {
         size_t size;
-        py_safe_run([this, &state, &size](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::SerializedFMUstateSize, [this, &state, &size]() {
             auto pyState = reinterpret_cast<PyObject*>(state);
-            PyObject* pyStateBytes = PyObject_CallMethod(pClass_, "_fmu_state_to_bytes", "(O)", pyState);
+            PyObject* pyStateBytes = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pClass_, "_fmu_state_to_bytes", "(O)", pyState); });
             if (pyStateBytes == nullptr) {
-                handle_py_exception("[SerializedFMUstateSize] PyObject_CallMethod", gilState);
+                handle_py_exception("[SerializedFMUstateSize] PyObject_CallMethod");
             }
             size = PyBytes_Size(pyStateBytes);
             Py_DECREF(pyStateBytes);
@@ -527,15 +745,15 @@ public:
 
     void SerializeFMUstate(const fmi2FMUstate& state, fmi2Byte* bytes, size_t size) override
     {
-        py_safe_run([this, &state, &bytes, size](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::SerializeFMUstate, [this, &state, &bytes, size]() {
             auto pyState = reinterpret_cast<PyObject*>(state);
-            PyObject* pyStateBytes = PyObject_CallMethod(pClass_, "_fmu_state_to_bytes", "(O)", pyState);
+            PyObject* pyStateBytes = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pClass_, "_fmu_state_to_bytes", "(O)", pyState); });
             if (pyStateBytes == nullptr) {
-                handle_py_exception("[SerializeFMUstate] PyObject_CallMethod", gilState);
+                handle_py_exception("[SerializeFMUstate] PyObject_CallMethod");
             }
             char* c = PyBytes_AsString(pyStateBytes);
             if (c == nullptr) {
-                handle_py_exception("[SerializeFMUstate] PyBytes_AsString", gilState);
+                handle_py_exception("[SerializeFMUstate] PyBytes_AsString");
             }
             for (int i = 0; i < size; i++) {
                 bytes[i] = c[i];
@@ -547,14 +765,14 @@ public:
 
     void DeSerializeFMUstate(const fmi2Byte bytes[], size_t size, fmi2FMUstate& state) override
     {
-        py_safe_run([this, &bytes, size, &state](PyGILState_STATE gilState) {
+        py_safe_run(PerfCall::DeSerializeFMUstate, [this, &bytes, size, &state]() {
             PyObject* pyStateBytes = PyBytes_FromStringAndSize(bytes, size);
             if (pyStateBytes == nullptr) {
-                handle_py_exception("[DeSerializeFMUstate] PyBytes_FromStringAndSize", gilState);
+                handle_py_exception("[DeSerializeFMUstate] PyBytes_FromStringAndSize");
             }
-            PyObject* pyState = PyObject_CallMethod(pClass_, "_fmu_state_from_bytes", "(O)", pyStateBytes);
+            PyObject* pyState = timed(PerfPhase::Python, [&] { return PyObject_CallMethod(pClass_, "_fmu_state_from_bytes", "(O)", pyStateBytes); });
             if (pyState == nullptr) {
-                handle_py_exception("[DeSerializeFMUstate] PyObject_CallMethod", gilState);
+                handle_py_exception("[DeSerializeFMUstate] PyObject_CallMethod");
             }
             state = reinterpret_cast<fmi2FMUstate*>(pyState);
             Py_DECREF(pyStateBytes);
@@ -562,22 +780,146 @@ public:
         });
     }
 
+    [[nodiscard]] std::string PerfReport() const override
+    {
+        std::string report;
+        if (perf_ != nullptr) {
+            try {
+                // Run along the Python calls, which update the statistics on the worker thread
+                runOnPythonThread([this, &report]() { report = perf_->report(); });
+            } catch (const std::exception&) {
+                // Error of a deferred call, already reported
+            }
+        }
+        return report;
+    }
+
     ~PySlaveInstance() override
     {
-        py_safe_run([this](PyGILState_STATE) {
-            cleanPyObject();
-        });
+        try {
+            runOnPythonThread([this]() { cleanPyObject(); });
+        } catch (const std::exception&) {
+            // Error of a deferred call, the instance is being freed anyway
+        }
     }
 
 private:
     fmu_data data_;
 
-    PyObject* pClass_;
-    PyObject* pInstance_{};
-    PyObject* pMessages_{};
+    // Cleared by cleanPyObject, which runs on fatal errors and again in the destructor
+    mutable PyObject* pClass_{};
+    mutable PyObject* pInstance_{};
+    mutable PyObject* pMessages_{};
+    mutable PyObject* pPerfStats_{};
+
+    // Null unless enabled through PYTHONFMU_PERF_STATS, keeping the disabled cost to a pointer check
+    std::unique_ptr<PerfStats> perf_;
+
+    // Header of one message packed by Fmi2Slave._pack_log_queue (see pythonfmu.logmsg.LOG_RECORD)
+    struct LogRecord
+    {
+        int32_t status;
+        uint32_t categorySize;
+        uint32_t msgSize;
+    };
+    static_assert(sizeof(LogRecord) == 12, "LogRecord must match the packed log record layout");
 
     mutable std::vector<PyObject*> strBuffer;
-    mutable std::vector<PyObject*> logStrBuffer;
+
+    // Null unless running in worker mode (see PyWorker)
+    std::unique_ptr<PyWorker> worker_;
+
+    std::unique_ptr<PyWorker> createWorker() const
+    {
+        switch (executionMode()) {
+            case ExecutionMode::Worker:
+                return std::make_unique<PyWorker>();
+            case ExecutionMode::Subinterpreter:
+                // Falls back to the worker mode, with a warning on instantiation
+                return std::make_unique<PyWorker>(PyWorker::supportsSubinterpreters());
+            default:
+                return nullptr;
+        }
+    }
+
+    void py_safe_run(PerfCall call, const std::function<void()>& f) const
+    {
+        if (worker_ != nullptr) {
+            worker_->run([this, call, &f]() { runTimed(call, f); });
+            return;
+        }
+        if (perf_ == nullptr) {
+            ::py_safe_run(f);
+            return;
+        }
+        PerfStats::CallScope scope(*perf_, call);
+        const auto gilState = perf_->time(PerfPhase::GilWait, [] { return PyGILState_Ensure(); });
+        try {
+            f();
+        } catch (...) {
+            PyGILState_Release(gilState);
+            throw;
+        }
+        PyGILState_Release(gilState);
+    }
+
+    // Whether the fmi2Set* calls are queued on the worker instead of run before returning
+    bool deferSets() const
+    {
+        return worker_ != nullptr && deferredSets();
+    }
+
+    // Byte memoryview over an array of n values, the buffer is not copied
+    template<class T>
+    PyObject* memoryView(const T* data, std::size_t n, int flags) const
+    {
+        PyObject* view = PyMemoryView_FromMemory(
+            const_cast<char*>(reinterpret_cast<const char*>(data)), static_cast<Py_ssize_t>(n * sizeof(T)), flags);
+        if (view == nullptr) {
+            handle_py_exception("[memoryView] PyMemoryView_FromMemory");
+        }
+        return view;
+    }
+
+    // Like py_safe_run, except that with deferred sets the call only runs before the next one waiting for a result
+    void py_safe_post(PerfCall call, std::function<void()> f) const
+    {
+        if (!deferSets()) {
+            py_safe_run(call, f);
+            return;
+        }
+        worker_->post([this, call, f = std::move(f)]() { runTimed(call, f); });
+    }
+
+    // Runs a call on the worker thread, which already holds the GIL
+    void runTimed(PerfCall call, const std::function<void()>& f) const
+    {
+        if (perf_ == nullptr) {
+            f();
+            return;
+        }
+        PerfStats::CallScope scope(*perf_, call);
+        perf_->add(PerfPhase::GilWait, worker_->takeGilWaitNs());
+        f();
+    }
+
+    void runOnPythonThread(const std::function<void()>& f) const
+    {
+        if (worker_ != nullptr) {
+            worker_->run(f);
+        } else {
+            ::py_safe_run(f);
+        }
+    }
+
+    template<class F>
+    std::invoke_result_t<F&> timed(PerfPhase phase, F&& f) const
+    {
+        if (perf_ == nullptr) {
+            return f();
+        }
+        return perf_->time(phase, std::forward<F>(f));
+    }
 
     std::string resourceLocation() const
     {
@@ -604,36 +946,30 @@ private:
         }
     }
 
-    void clearLogStrBuffer() const
-    {
-        if (!logStrBuffer.empty()) {
-            for (auto obj : logStrBuffer) {
-                Py_DECREF(obj);
-            }
-            logStrBuffer.clear();
-        }
-    }
-
     void cleanPyObject() const
     {
         clearLogBuffer();
-        clearLogStrBuffer();
         clearStrBuffer();
-        Py_XDECREF(pClass_);
-        Py_XDECREF(pInstance_);
-        Py_XDECREF(pMessages_);
+        Py_CLEAR(pClass_);
+        Py_CLEAR(pInstance_);
+        Py_CLEAR(pMessages_);
+        if (pPerfStats_ != nullptr) {
+            // The provider may outlive this instance on the Python side
+            PyCapsule_SetContext(PyCFunction_GetSelf(pPerfStats_), nullptr);
+            Py_CLEAR(pPerfStats_);
+        }
     }
 
 
-    void handle_py_exception(const std::string& what, PyGILState_STATE gilState) const
+    void handle_py_exception(const std::string& what) const
     {
         const auto err = PyErr_Occurred();
         if (err != nullptr) {
-            cleanPyObject();
-
             PyObject *pExcType, *pExcValue, *pExcTraceback;
             PyErr_Fetch(&pExcType, &pExcValue, &pExcTraceback);
 
+            cleanPyObject();
+
             std::ostringstream oss;
             oss << "Fatal py exception encountered: ";
             oss << what << "\n";
@@ -653,8 +989,6 @@ private:
             Py_XDECREF(pExcValue);
             Py_XDECREF(pExcTraceback);
 
-            PyGILState_Release(gilState);
-
             throw fatal_error(oss.str());
         }
     }
@@ -677,9 +1011,9 @@ std::unique_ptr<SlaveInstance> pythonfmu::createInstance(fmu_data data)
         };
 
         ensurePyStateAlive();
-        auto c = std::make_unique<PySlaveInstance>(data);
+        // The interpreter must outlive the instance (and its sub-interpreter, if any)
         data.pyState = pyState;
-        return c;
+        return std::make_unique<PySlaveInstance>(std::move(data));
     }
 }
 
@@ -0,0 +1,376 @@
+#ifndef PYTHONFMU_PYWORKER_HPP
+#define PYTHONFMU_PYWORKER_HPP
+
+#include <Python.h>
+#include <chrono>
+#include <condition_variable>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <deque>
+#include <exception>
+#include <functional>
+#include <mutex>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <unordered_set>
+#include <utility>
+
+// Interpreters with their own GIL need the full (non limited) C API of Python 3.12 or later
+#if !defined(Py_LIMITED_API) && PY_VERSION_HEX >= 0x030C0000
+#    define PYTHONFMU_HAS_SUBINTERPRETERS 1
+#endif
+
+namespace pythonfmu
+{
+
+// How the Python code of an instance is run, selected by the PYTHONFMU_EXECUTION_MODE environment variable
+enum class ExecutionMode
+{
+    // On the calling thread, taking the GIL for each FMI call (default)
+    Inline,
+    // On a dedicated thread per instance keeping its Python thread state (PYTHONFMU_EXECUTION_MODE=worker)
+    Worker,
+    // As Worker, in a sub-interpreter with its own GIL (PYTHONFMU_EXECUTION_MODE=subinterpreter)
+    Subinterpreter,
+    // Inline, through a proxy running the slave in a worker process (PYTHONFMU_EXECUTION_MODE=process)
+    Process
+};
+
+inline ExecutionMode executionMode()
+{
+    static const ExecutionMode mode = [] {
+        const char* value = std::getenv("PYTHONFMU_EXECUTION_MODE");
+        if (value != nullptr && std::strcmp(value, "worker") == 0) {
+            return ExecutionMode::Worker;
+        }
+        if (value != nullptr && std::strcmp(value, "subinterpreter") == 0) {
+            return ExecutionMode::Subinterpreter;
+        }
+        if (value != nullptr && std::strcmp(value, "process") == 0) {
+            return ExecutionMode::Process;
+        }
+        return ExecutionMode::Inline;
+    }();
+    return mode;
+}
+
+// Whether the worker only runs fmi2Set* calls along with the next call waiting for a result
+// (PYTHONFMU_WORKER_DEFER_SETS=1). fmi2Set* then returns fmi2OK before the values are set and its errors
+// are reported by that later call, which does not conform to the FMI 2.0 status semantics.
+inline bool deferredSets()
+{
+    static const bool deferred = [] {
+        const char* value = std::getenv("PYTHONFMU_WORKER_DEFER_SETS");
+        return value != nullptr && std::strcmp(value, "1") == 0;
+    }();
+    return deferred;
+}
+
+// Thread running the Python calls of one instance.
+//
+// The thread keeps its Python thread state for its whole life and takes the GIL once per batch of tasks.
+// Optionally (PYTHONFMU_WORKER_LINGER_US), the GIL is kept for a short linger time after a batch so that the
+// calls following each other (e.g. setting inputs, stepping and reading outputs) join the same batch. The other
+// Python threads of the process are blocked meanwhile, so it is off by default. Tasks posted without waiting
+// (only with `deferredSets`) are run along with the next task a caller waits for.
+// An error raised by a posted task is reported by the next waited-for task, the tasks queued after it are dropped.
+//
+// With ownInterpreter, the thread runs the tasks in a new sub-interpreter with its own GIL, so that instances
+// step in parallel. Extension modules not supporting sub-interpreters (e.g. numpy) cannot be imported there.
+class PyWorker
+{
+public:
+    explicit PyWorker(bool ownInterpreter = false, std::chrono::microseconds linger = lingerFromEnvironment())
+        : ownInterpreter_(ownInterpreter)
+        , linger_(linger)
+        , thread_(&PyWorker::loop, this)
+    {
+        auto lock = std::unique_lock{mutex_};
+        done_.wait(lock, [this] { return started_; });
+        if (error_ != nullptr) {
+            lock.unlock();
+            thread_.join();
+            std::rethrow_exception(error_);
+        }
+    }
+
+    static bool supportsSubinterpreters()
+    {
+#ifdef PYTHONFMU_HAS_SUBINTERPRETERS
+        return true;
+#else
+        return false;
+#endif
+    }
+
+    // Whether the tasks run in a sub-interpreter of their own
+    bool ownsInterpreter() const
+    {
+        return ownInterpreter_;
+    }
+
+    // Runs a task and waits for its completion, rethrowing its error or the one of a previously posted task
+    void run(std::function<void()> task)
+    {
+        auto lock = std::unique_lock{mutex_};
+        if (stopRequested_) {
+            throw std::runtime_error("The Python worker of the instance is stopped");
+        }
+        queue_.push_back({std::move(task), true});
+        ++pendingWaited_;
+        const auto ticket = ++posted_;
+        wakeup_.notify_one();
+        done_.wait(lock, [this, ticket] { return completed_ >= ticket; });
+        if (error_ != nullptr) {
+            std::exception_ptr error;
+            std::swap(error, error_);
+            std::rethrow_exception(error);
+        }
+    }
+
+    // Queues a task to be run before the next task run with `run`
+    void post(std::function<void()> task)
+    {
+        auto const lock = std::lock_guard{mutex_};
+        if (stopRequested_) {
+            throw std::runtime_error("The Python worker of the instance is stopped");
+        }
+        queue_.push_back({std::move(task), false});
+        ++posted_;
+    }
+
+    // Time spent acquiring the GIL since the last call, only to be called from tasks
+    std::uint64_t takeGilWaitNs()
+    {
+        return std::exchange(gilWaitNs_, 0);
+    }
+
+    ~PyWorker()
+    {
+        stop();
+#ifdef PYTHONFMU_HAS_SUBINTERPRETERS
+        if (ownInterpreter_) {
+            auto const lock = std::lock_guard{registryMutex()};
+            registry().erase(this);
+        }
+#endif
+    }
+
+    PyWorker(const PyWorker&) = delete;
+    PyWorker& operator=(const PyWorker&) = delete;
+
+private:
+    static std::chrono::microseconds lingerFromEnvironment()
+    {
+        const char* value = std::getenv("PYTHONFMU_WORKER_LINGER_US");
+        return std::chrono::microseconds(value != nullptr ? std::strtol(value, nullptr, 10) : 0);
+    }
+
+    struct Task
+    {
+        std::function<void()> f;
+        bool waited;
+    };
+
+    // Stops the thread after the queued tasks, the following tasks are rejected
+    void stop()
+    {
+        {
+            auto const lock = std::lock_guard{mutex_};
+            stopRequested_ = true;
+        }
+        wakeup_.notify_one();
+        auto const lock = std::lock_guard{joinMutex_};
+        if (thread_.joinable()) thread_.join();
+    }
+
+#ifdef PYTHONFMU_HAS_SUBINTERPRETERS
+    // Workers owning a sub-interpreter, stopped when the main interpreter exits: the instances the importer
+    // did not free would otherwise keep their sub-interpreters alive during finalization, which aborts.
+    static std::unordered_set<PyWorker*>& registry()
+    {
+        static std::unordered_set<PyWorker*> workers;
+        return workers;
+    }
+
+    static std::mutex& registryMutex()
+    {
+        static std::mutex mutex;
+        return mutex;
+    }
+
+    // atexit callback, called with the GIL of the main interpreter held
+    static PyObject* stopAll(PyObject*, PyObject*)
+    {
+        Py_BEGIN_ALLOW_THREADS
+        auto const lock = std::lock_guard{registryMutex()};
+        for (auto worker : registry()) {
+            // Ending the sub-interpreter takes the GIL of the main interpreter
+            worker->stop();
+        }
+        Py_END_ALLOW_THREADS
+        Py_RETURN_NONE;
+    }
+
+    // Registers `stopAll` once, called with the GIL of the main interpreter held
+    static void registerAtExit()
+    {
+        static bool registered = false;
+        static PyMethodDef method = {"_pythonfmu_stop_workers", stopAll, METH_NOARGS, nullptr};
+        if (registered) return;
+        PyObject* callback = PyCFunction_New(&method, nullptr);
+        PyObject* atexit = PyImport_ImportModule("atexit");
+        PyObject* result = (callback == nullptr || atexit == nullptr)
+            ? nullptr : PyObject_CallMethod(atexit, "register", "O", callback);
+        if (result == nullptr) {
+            PyErr_WriteUnraisable(nullptr);
+        } else {
+            registered = true;
+        }
+        Py_XDECREF(result);
+        Py_XDECREF(atexit);
+        Py_XDECREF(callback);
+    }
+#endif
+
+    // Creates the thread state of the worker, returns it with the GIL released
+    PyThreadState* attach()
+    {
+#ifdef PYTHONFMU_HAS_SUBINTERPRETERS
+        if (ownInterpreter_) {
+            mainThreadState_ = PyThreadState_New(PyInterpreterState_Main());
+            PyEval_RestoreThread(mainThreadState_);
+            registerAtExit();
+
+            PyInterpreterConfig config{};
+            config.use_main_obmalloc = 0;
+            config.allow_fork = 0;
+            config.allow_exec = 0;
+            config.allow_threads = 1;
+            config.allow_daemon_threads = 0;
+            config.check_multi_interp_extensions = 1;
+            config.gil = PyInterpreterConfig_OWN_GIL;
+
+            // Releases the main GIL and returns holding the GIL of the new interpreter
+            PyThreadState* threadState = nullptr;
+            const PyStatus status = Py_NewInterpreterFromConfig(&threadState, &config);
+            if (PyStatus_Exception(status)) {
+                PyThreadState_Clear(mainThreadState_);
+                PyThreadState_DeleteCurrent();
+                throw std::runtime_error(std::string("Failed to create a sub-interpreter: ") +
+                    (status.err_msg != nullptr ? status.err_msg : "unknown error"));
+            }
+            {
+                auto const lock = std::lock_guard{registryMutex()};
+                registry().insert(this);
+            }
+            return PyEval_SaveThread();
+        }
+#endif
+        gilState_ = PyGILState_Ensure();
+        return PyEval_SaveThread();
+    }
+
+    void detach(PyThreadState* threadState)
+    {
+        PyEval_RestoreThread(threadState);
+#ifdef PYTHONFMU_HAS_SUBINTERPRETERS
+        if (ownInterpreter_) {
+            Py_EndInterpreter(threadState);
+            PyEval_RestoreThread(mainThreadState_);
+            PyThreadState_Clear(mainThreadState_);
+            PyThreadState_DeleteCurrent();
+            return;
+        }
+#endif
+        PyGILState_Release(gilState_);
+    }
+
+    void loop()
+    {
+        PyThreadState* threadState = nullptr;
+        try {
+            threadState = attach();
+        } catch (...) {
+            auto const lock = std::lock_guard{mutex_};
+            error_ = std::current_exception();
+            started_ = true;
+            done_.notify_all();
+            return;
+        }
+        {
+            auto const lock = std::lock_guard{mutex_};
+            started_ = true;
+        }
+        done_.notify_all();
+
+        const auto wakeup = [this] { return stopRequested_ || pendingWaited_ > 0; };
+        auto lock = std::unique_lock{mutex_};
+        while (true) {
+            wakeup_.wait(lock, wakeup);
+            if (stopRequested_ && queue_.empty()) break;
+
+            lock.unlock();
+            const auto start = std::chrono::steady_clock::now();
+            PyEval_RestoreThread(threadState);
+            gilWaitNs_ += static_cast<std::uint64_t>(
+                std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count());
+            lock.lock();
+
+            do {
+                while (!queue_.empty()) {
+                    auto task = std::move(queue_.front());
+                    queue_.pop_front();
+                    if (task.waited) --pendingWaited_;
+                    lock.unlock();
+                    std::exception_ptr error;
+                    try {
+                        task.f();
+                    } catch (...) {
+                        error = std::current_exception();
+                    }
+                    lock.lock();
+                    if (error != nullptr) {
+                        if (error_ == nullptr) error_ = error;
+                        completed_ += queue_.size();
+                        queue_.clear();
+                        pendingWaited_ = 0;
+                    }
+                    ++completed_;
+                    done_.notify_all();
+                }
+            } while (!stopRequested_ && linger_.count() > 0 && wakeup_.wait_for(lock, linger_, wakeup));
+
+            lock.unlock();
+            threadState = PyEval_SaveThread();
+            lock.lock();
+        }
+        lock.unlock();
+
+        detach(threadState);
+    }
+
+    bool ownInterpreter_;
+    std::chrono::microseconds linger_;
+    PyGILState_STATE gilState_{};
+    PyThreadState* mainThreadState_{nullptr};
+    std::deque<Task> queue_;
+    std::uint64_t posted_{0};
+    std::uint64_t completed_{0};
+    std::uint64_t pendingWaited_{0};
+    std::uint64_t gilWaitNs_{0};
+    std::exception_ptr error_;
+    bool started_{false};
+    bool stopRequested_{false};
+    std::mutex mutex_;
+    std::mutex joinMutex_;
+    std::condition_variable wakeup_;
+    std::condition_variable done_;
+    std::thread thread_;
+};
+
+} // namespace pythonfmu
+
+#endif // PYTHONFMU_PYWORKER_HPP
@@ -7,6 +7,8 @@
 
 #include <memory>
 #include <optional>
+#include <string>
+#include <vector>
 
 namespace pythonfmu
 {
@@ -24,6 +26,8 @@ class SlaveInstance
 {
 public:
 
+    virtual void SetDebugLogging(bool flag, const std::vector<std::string>& categories) = 0;
+
     virtual void SetupExperiment(double start, std::optional<double> stop, std::optional<double> tolerance) = 0;
 
     virtual void EnterInitializationMode() = 0;
@@ -85,6 +89,12 @@ public:
     virtual void SerializeFMUstate(const fmi2FMUstate& state, fmi2Byte bytes[], size_t size) = 0;
     virtual void DeSerializeFMUstate(const fmi2Byte bytes[], size_t size, fmi2FMUstate& state) = 0;
 
+    // Summary of the performance statistics, empty unless they are enabled
+    [[nodiscard]] virtual std::string PerfReport() const
+    {
+        return {};
+    }
+
     virtual ~SlaveInstance() = default;
     ;
 };
@@ -119,6 +119,10 @@ void fmi2FreeInstance(fmi2Component c)
 {
     if (c) {
         const auto component = static_cast<Fmi2Component*>(c);
+        const auto report = component->slave->PerfReport();
+        if (!report.empty()) {
+            component->logger->log(fmi2OK, "logAll", report);
+        }
         delete component;
     }
 }
@@ -143,7 +147,16 @@ fmi2Status fmi2SetDebugLogging(
 
     component->logger->setDebugLogging(loggingOn, categoriesVec);
 
-    return fmi2OK;
+    try {
+        component->slave->SetDebugLogging(loggingOn == fmi2True, categoriesVec);
+        return fmi2OK;
+    } catch (const pythonfmu::fatal_error& e) {
+        component->logger->log(fmi2Fatal, e.what());
+        return fmi2Fatal;
+    } catch (const std::exception& e) {
+        component->logger->log(fmi2Error, e.what());
+        return fmi2Error;
+    }
 }
 
 